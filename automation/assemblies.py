@@ -1,17 +1,40 @@
+import collections
+import concurrent.futures
+import contextlib
+import logging
+import socket
 import sys
+import threading
 import time
 
 import matplotlib.pyplot as plt
 import matplotlib.animation as anim
+import numpy as np
 import simple_pid
 
 try:
+    import oven_protocol
     from connection_type import SocketEthernetDevice
+    from telemetry_history import HISTORY_CHUNK
+    from telemetry_history import TelemetryHistory
+    from telemetry_history import parse_history
+    from telemetry_history import ControlSample
+    from settings_cache import SettingsCache
+    from connection_type import AsyncSocketEthernetDevice
     from device_type import Heater
 except ModuleNotFoundError:
+    from automation import oven_protocol
     from automation.connection_type import SocketEthernetDevice
+    from automation.telemetry_history import HISTORY_CHUNK
+    from automation.telemetry_history import TelemetryHistory
+    from automation.telemetry_history import parse_history
+    from automation.telemetry_history import ControlSample
+    from automation.settings_cache import SettingsCache
+    from automation.connection_type import AsyncSocketEthernetDevice
     from automation.device_type import Heater
 
+log = logging.getLogger('oven.client')
+
 
 class HeaterAssembly:
     def __init__(
@@ -19,6 +42,7 @@ class HeaterAssembly:
             supply_and_channel,
             daq_and_channel,
             heater=None,
+            history_size=3600,
     ):
         """
         A heater assembly composed of a heater, a temperature measuring device, and a power supply. This assembly
@@ -36,6 +60,8 @@ class HeaterAssembly:
         heater : Heater
             Object that contains the MAX temperature, MAX current, and MAX volts based on the physical heater
             hardware. If none is provided, the class will create an instance of the Heater class to use.
+        history_size : int
+            number of control updates kept in the history. See the history property.
         """
 
         self._supply_and_channel = supply_and_channel
@@ -43,11 +69,14 @@ class HeaterAssembly:
         self._heater = heater
         if self._heater is None:
             self._heater = Heater()
+        self._pid_bank = None  # PidBank holding the PID, see use_pid_bank()
         self._pid = self._get_default_pid()
         self._MAX_voltage = min(self._heater.MAX_volts, self._supply_and_channel[0].MAX_voltage)
         self._MAX_current = min(self._heater.MAX_current, self._supply_and_channel[0].MAX_current)
         self._MAX_temp_limit = self._heater.MAX_temp
         self._regulating = False
+        self._last_sample = None  # ControlSample of the last update_supply()
+        self._history = TelemetryHistory(history_size)
 
     # Assembly
     # --------
@@ -58,10 +87,10 @@ class HeaterAssembly:
 
         Returns
         -------
-        simple_pid.PID()
-            PID object with default values.
+        simple_pid.PID(), PidSlot
+            PID object with default values. A new slot of the PidBank of the assembly if it uses one.
         """
-        pid = simple_pid.PID()
+        pid = simple_pid.PID() if self._pid_bank is None else self._pid_bank.add()
         ps = self._supply_and_channel[0]
         ch = self._supply_and_channel[1]
         out_max = min(self._heater.MAX_volts, ps.get_voltage_limit(ch))
@@ -80,7 +109,32 @@ class HeaterAssembly:
         Resets the pid settings to their default values. Output limits set based on power supply and heater limit
         voltage.
         """
+        old = self._pid
         self._pid = self._get_default_pid()
+        if self._pid_bank is not None:
+            self._pid_bank.release(old)
+
+    def use_pid_bank(self, bank):
+        """
+        Move the PID of the assembly into a new slot of a PidBank, keeping its gains, setpoint, sample time, and output
+        limits, so that a BankControlLoop can update it in the same vectorized step as the PIDs of other assemblies.
+        The integral and derivative start over.
+
+        Parameters
+        ----------
+        bank : PidBank, None
+            bank to move the PID to. None to move it back to a simple_pid.PID of its own.
+        """
+        old = self._pid
+        pid = simple_pid.PID() if bank is None else bank.add()
+        pid.tunings = old.tunings
+        pid.setpoint = old.setpoint
+        pid.sample_time = old.sample_time
+        pid.output_limits = old.output_limits
+        self._pid = pid
+        if self._pid_bank is not None:
+            self._pid_bank.release(old)
+        self._pid_bank = bank
 
     def reset_pid_limits(self):
         """
@@ -93,15 +147,28 @@ class HeaterAssembly:
 
         pid.output_limits = (0, out_max)
 
+    def _supply_lock(self):
+        """
+        The lock of the power supply session. It is held during operations made of several commands so that other
+        assemblies sharing the same power supply do not interleave their own commands.
+
+        Returns
+        -------
+        context manager
+            The lock of the power supply, or a context manager that does nothing if the supply has no lock.
+        """
+        return getattr(self._supply_and_channel[0], 'lock', contextlib.nullcontext())
+
     def stop_supply(self):
         """
         Turn off supply channel, set voltage and current to 0.
         """
         ps = self._supply_and_channel[0]
         ch = self._supply_and_channel[1]
-        ps.set_channel_state(ch, False)
-        ps.set_voltage(ch, 0)
-        ps.set_current(ch, 0)
+        with self._supply_lock():
+            ps.set_channel_state(ch, False)
+            ps.set_voltage(ch, 0)
+            ps.set_current(ch, 0)
 
     def reset_power_supply(self):
         """
@@ -110,11 +177,12 @@ class HeaterAssembly:
         """
         ps = self._supply_and_channel[0]
         ch = self._supply_and_channel[1]
-        ps.set_channel_state(ch, False)
-        ps.set_voltage(ch, 0)
-        ps.set_current(ch, 0)
-        ps.set_voltage_limit(ch, ps.MAX_voltage)
-        ps.set_current_limit(ch, ps.MAX_current)
+        with self._supply_lock():
+            ps.set_channel_state(ch, False)
+            ps.set_voltage(ch, 0)
+            ps.set_current(ch, 0)
+            ps.set_voltage_limit(ch, ps.MAX_voltage)
+            ps.set_current_limit(ch, ps.MAX_current)
 
     def ready_power_supply(self):
         """
@@ -123,14 +191,15 @@ class HeaterAssembly:
         """
         ps = self._supply_and_channel[0]
         ch = self._supply_and_channel[1]
-        ps.set_voltage(ch, 0)
-        ps.set_current(ch, 0)
-        if ps.get_voltage_limit(ch) > self.MAX_voltage:
-            ps.set_voltage_limit(ch, self.MAX_voltage)
-        if ps.get_current_limit(ch) > self.MAX_current:
-            ps.set_current_limit(ch, self.MAX_current)
-        ps.set_current(ch, ps.get_current_limit(ch))
-        ps.set_channel_state(ch, True)
+        with self._supply_lock():
+            ps.set_voltage(ch, 0)
+            ps.set_current(ch, 0)
+            if ps.get_voltage_limit(ch) > self.MAX_voltage:
+                ps.set_voltage_limit(ch, self.MAX_voltage)
+            if ps.get_current_limit(ch) > self.MAX_current:
+                ps.set_current_limit(ch, self.MAX_current)
+            ps.set_current(ch, ps.get_current_limit(ch))
+            ps.set_channel_state(ch, True)
 
     def reset_assembly(self):
         """
@@ -140,9 +209,10 @@ class HeaterAssembly:
         """
         ps = self._supply_and_channel[0]
         ch = self._supply_and_channel[1]
-        self.reset_power_supply()
-        ps.set_voltage_limit(ch, self.MAX_voltage)
-        ps.set_current_limit(ch, self.MAX_current)
+        with self._supply_lock():
+            self.reset_power_supply()
+            ps.set_voltage_limit(ch, self.MAX_voltage)
+            ps.set_current_limit(ch, self.MAX_current)
         self.reset_pid()
 
     def ready_assembly(self):
@@ -170,6 +240,53 @@ class HeaterAssembly:
     def is_regulating(self):
         return self.get_pid_regulation()
 
+    @property
+    def history(self):
+        """
+        TelemetryHistory with the time, temperature, voltage, setpoint, and PID terms of the latest updates made by
+        update_supply().
+        """
+        return self._history
+
+    @property
+    def pid(self):
+        """
+        simple_pid.PID of the assembly, or its PidSlot if it uses a PidBank (see use_pid_bank()).
+        """
+        return self._pid
+
+    @property
+    def pid_components(self):
+        """
+        Proportional, integral, and derivative terms of the last PID output.
+        """
+        return self._pid.components
+
+    @property
+    def last_output(self):
+        """
+        The last voltage calculated by the PID in update_supply(), or None before the first update.
+        """
+        return None if self._last_sample is None else self._last_sample.volts
+
+    @property
+    def last_sample(self):
+        """
+        ControlSample of the last update_supply(): time, temperature, voltage, setpoint, and PID terms. None before the
+        first update.
+        """
+        return self._last_sample
+
+    @property
+    def is_ready(self):
+        """
+        True if the power supply and the DAQ are connected. Devices that don't keep track of their connection are
+        always considered ready.
+        """
+        ps = self._supply_and_channel[0]
+        daq = self._daq_and_channel[0]
+        return all(getattr(dev, 'connection_state', 'connected') == 'connected' for dev in (ps, daq))
+
     # Power supply
     # ------------
     def get_supply_channel(self):
@@ -179,8 +296,8 @@ class HeaterAssembly:
         ps = self._supply_and_channel[0]
         err = ps.check_valid_channel(new_ch)
         if err is None:
-            ps.zero_all_channels()
-            self._supply_and_channel[1] = new_ch
+            self.stop_supply()  # only the old channel. Other channels might be used by other assemblies.
+            self._supply_and_channel = (ps, new_ch)
         return err
 
     def get_supply_channel_state(self):
@@ -473,20 +590,131 @@ class HeaterAssembly:
     # -----------------------------------------------------------------------------
     # methods
     # -----------------------------------------------------------------------------
-    def update_supply(self):
+    def get_snapshot(self, supply_snapshot=None, temp=None):
+        """
+        State of the assembly read with a single power supply snapshot and a single DAQ reading.
+
+        Parameters
+        ----------
+        supply_snapshot : PowerSupplySnapshot, str, None
+            snapshot of the power supply of the assembly, or the error string returned instead. If None, it is taken.
+            See get_assemblies_snapshot(), which shares a snapshot between assemblies using the same supply.
+        temp : float, str, None
+            temperature of the assembly, or the error string returned instead. If None, it is read.
+
+        Returns
+        -------
+        dict
+            keys: 'temp', 'setpoint_voltage', 'actual_voltage', 'setpoint_current', 'actual_current',
+            'channel_state', 'pid_setpoint', 'kp', 'ki', 'kd', and 'regulating'.
+        str
+            If the supply or the DAQ could not be read, return the error string.
+        """
+        ps = self._supply_and_channel[0]
+        ch = self._supply_and_channel[1]
+        if supply_snapshot is None:
+            supply_snapshot = ps.get_snapshot()
+        if isinstance(supply_snapshot, str):
+            return supply_snapshot
+        if temp is None:
+            temp = self.get_daq_temp()
+        if isinstance(temp, str):
+            return temp
+
+        out = {'temp': temp}
+        out.update(supply_snapshot.get_channel(ch))
+        out.update({
+            'pid_setpoint': self._pid.setpoint,
+            'kp': self._pid.Kp,
+            'ki': self._pid.Ki,
+            'kd': self._pid.Kd,
+            'regulating': self._regulating,
+        })
+        return out
+
+    def update_supply(self, dt=None):
         """
         Calculates the new power supply voltage using the PID function based on the current temperature from the
         temperature daq channel. It then sets the power supply channel voltage to this new voltage.
+
+        Parameters
+        ----------
+        dt : float, None
+            time in seconds since the last update, used by the PID instead of its own clock. Should be given by
+            schedulers that call update_supply at fixed deadlines: the PID skips updates that come less than a sample
+            time after the previous one by its own clock.
+
+        Returns
+        -------
+        float
+            If succesful, the temperature used by the PID. The DAQ is read once per update: the full sample is in
+            last_sample.
+        str
+            Else, return error string
+        """
+        t, temp = self.read_control_temp()
+        if isinstance(temp, str):
+            return temp
+        if dt is None:
+            new_volts = self._pid(temp)
+        else:
+            new_volts = self._pid(temp, dt=dt)
+        return self.apply_control_output(t, temp, new_volts)
+
+    def read_control_temp(self):
+        """
+        First half of update_supply(): read the temperature given to the PID.
+
+        Returns
+        -------
+        tuple of float and float or str
+            time.time() of the reading, and the temperature rounded to 0.01 or the error string of the DAQ.
+        """
+        t = time.time()
+        temp = self.get_daq_temp()
+        if isinstance(temp, str):
+            return t, temp
+        return t, round(temp, 2)
+
+    def apply_control_output(self, t, temp, new_volts):
+        """
+        Second half of update_supply(): record the PID output computed from a read_control_temp() reading, and set the
+        power supply channel to it. Used by schedulers that compute the PID outputs of many assemblies at once, like
+        BankControlLoop.
+
+        Parameters
+        ----------
+        t : float
+            time.time() of the reading.
+        temp : float
+            temperature given to the PID.
+        new_volts : float
+            output of the PID.
+
+        Returns
+        -------
+        float
+            If succesful, the temperature used by the PID.
+        str
+            Else, return error string
         """
         ps = self._supply_and_channel[0]
         ch = self._supply_and_channel[1]
-        new_volts = self._pid(round(self.temp, 2))
+        sample = ControlSample(t, temp, new_volts, self._pid.setpoint, *self._pid.components)
+        self._last_sample = sample
+        self._history.append(*sample)
 
         err = ps.set_voltage(channel=ch, volts=new_volts)
         if err is not None:
             return err
 
-        out = self.get_daq_temp()
+        out = sample.temp
+
+        flush = getattr(ps, 'flush_commands', None)  # supplies that check for errors once per control loop
+        if flush is not None:
+            err = flush()
+            if err is not None:
+                return err
         return out
 
     def live_plot(self, x_size=10):
@@ -501,16 +729,18 @@ class HeaterAssembly:
         ax = plt.subplot(111)
 
         def animate(i):
-            ps_volt = self.update_supply()
+            if isinstance(self.update_supply(), str):
+                return
+            sample = self.last_sample
 
             temp.pop(0)
-            temp.append(self.temp)
+            temp.append(sample.temp)
 
             time_.pop(0)
             time_.append(i)
 
             ps_v.pop(0)
-            ps_v.append(ps_volt)
+            ps_v.append(sample.volts)
 
             ax.cla()
             ax.plot(time_, temp)
@@ -523,27 +753,309 @@ class HeaterAssembly:
         plt.show()
 
 
+def get_assemblies_snapshot(asm_dict):
+    """
+    Snapshot of many assemblies at once. Assemblies sharing a power supply share a single snapshot of it, and
+    assemblies sharing a DAQ share a single scan of its channels, so every device is read once.
+
+    Parameters
+    ----------
+    asm_dict : dictionary of str: HeaterAssembly
+
+    Returns
+    -------
+    dictionary of str: dict or str
+        the result of HeaterAssembly.get_snapshot() for every assembly. Assemblies whose devices are not connected
+        get an error string.
+    """
+    supplies = {}
+    temps = {}
+    daqs = {}
+    for key, asm in list(asm_dict.items()):
+        if not asm.is_ready:
+            continue
+        ps = asm._supply_and_channel[0]
+        if id(ps) not in supplies:
+            supplies[id(ps)] = ps.get_snapshot()
+        daq, ch = asm._daq_and_channel
+        daqs.setdefault(id(daq), (daq, []))[1].append((key, ch))
+
+    for daq, channels in daqs.values():
+        if len(channels) == 1 or not hasattr(daq, 'get_temp_scan'):
+            for key, ch in channels:
+                temps[key] = daq.get_temp(ch)
+            continue
+        low = min(ch for key, ch in channels)
+        high = max(ch for key, ch in channels)
+        scan = daq.get_temp_scan(low, high)
+        for key, ch in channels:
+            temps[key] = scan if isinstance(scan, str) else scan[ch - low]
+
+    out = {}
+    for key, asm in list(asm_dict.items()):
+        if key not in temps:
+            out[key] = 'ERROR: HeaterAssembly ' + key + ' is not connected'
+        else:
+            out[key] = asm.get_snapshot(supplies[id(asm._supply_and_channel[0])], temps[key])
+    return out
+
+
 class Oven(SocketEthernetDevice):
     """
     The Oven class refers to the combination of a BeagleBoneBlack rev C and a number of HeaterAssembly objects. A single
     HeaterAssembly object is composed of a power supply, a temperature daq, and a physical heater. The
     BeagleBoneBlack acts as the "brain" of the oven, commanding the different HeaterAssembly objects.
     """
-    def __init__(self, ip4_address, port=65432, ):
-        super().__init__(ip4_address, port)
+    def __init__(self, ip4_address, port=65432, binary=False, timeout=15):
+        """
+        Parameters
+        ----------
+        ip4_address : str
+            IP v4 address of the BeagleBoneBlack that is controlling the HeaterAssembly objects part of the physical
+            oven.
+        port : int
+            port number. Default to 65432
+        timeout : float
+            Maximum time in seconds to wait for a reply, or for a single connection attempt.
+        binary : bool
+            If True, switch the connection to the binary protocol (see oven_protocol.py): commands and replies are
+            sent as struct-packed frames, and floats are sent without losing precision. Falls back to the ASCII
+            protocol if the server does not support it. Replies to queries are then returned as float, bool, or str
+            instead of str.
+        """
+        self._binary = binary
+        self._keys = None  # assembly keys, fetched on connect. None until fetched or after invalidate_keys()
+        self._cache = None  # SettingsCache, see enable_cache()
+        self._binary_keys = {}  # assembly key: index in the binary protocol
+        self._binary_commands = {}  # command: id in the binary protocol
+        self._request_id = 0
+        super().__init__(ip4_address, port, terminator=b'\r', timeout=timeout)
+
+    @property
+    def binary(self):
+        """
+        True if the connection uses the binary protocol.
+        """
+        return self._binary
+
+    @property
+    def keys(self):
+        """
+        Keys of the heater assemblies, cached when the connection is established, so that using an assembly index does
+        not need a round trip to the oven. Refreshed by get_assemblies_keys(), and automatically after an unknown
+        index or a 'not found' error. Empty if the keys could not be fetched.
+        """
+        if self._keys is None:
+            self.get_assemblies_keys()
+        return list(self._keys or [])
+
+    def invalidate_keys(self):
+        """
+        Forget the cached assembly keys. They are fetched again the next time they are needed.
+        """
+        self._keys = None
+
+    @property
+    def cache(self):
+        """
+        SettingsCache used by the oven, with its hits and misses counters. None if caching is disabled.
+        """
+        return self._cache
+
+    def enable_cache(self, ttls=None, generation_interval=1.0):
+        """
+        Cache the replies to queries of settings that almost never change, like PID gains, heater limits, and
+        thermocouple types, instead of asking the oven every time. Cached replies are dropped after their time to live,
+        after any command to the same assembly from this client, and when the settings generation of the server changes
+        because another client changed a setting. See settings_cache.py.
+
+        Parameters
+        ----------
+        ttls : dictionary of str: float, None
+            maps commands ('PD:KPRO') to the time in seconds their replies are kept. Defaults to
+            settings_cache.DEFAULT_TTLS.
+        generation_interval : float, None
+            shortest time in seconds between checks of the settings generation of the server. None to rely on the
+            times to live only.
+
+        Returns
+        -------
+        SettingsCache
+        """
+        self._cache = SettingsCache(ttls, generation_interval)
+        return self._cache
+
+    def disable_cache(self):
+        self._cache = None
+
+    def _on_connect(self, first):
+        self._rx_buffer.clear()
+        self._keys = None
+        if self._cache is not None:  # the server may have restarted with other settings
+            self._cache.invalidate()
+        if self._binary:
+            self._socket.sendall(b'OVEN OV:BINR\r')
+            reply = self._read_reply(time.monotonic() + self._timeout).decode('utf-8').strip('\r')
+            parts = reply.split(' ')
+            if len(parts) == 4 and parts[0] == 'BINR' and parts[1] == str(oven_protocol.VERSION):
+                self._binary_keys = {key: i for i, key in enumerate(parts[2].split(',')) if key}
+                self._binary_commands = {name: i for i, name in enumerate(parts[3].split(',')) if name}
+                self._keys = list(self._binary_keys)
+                return
+            log.warning('Binary protocol not supported by the oven server at %s, using ASCII: %s', self._ip4_address,
+                        reply)
+            self._binary = False
+
+        self._socket.sendall(b'OVEN OV:KEYS\r')
+        reply = self._read_reply(time.monotonic() + self._timeout).decode('utf-8').strip('\r')
+        if not reply.startswith('ERROR'):
+            self._keys = reply.split()
+
+    def _binary_exchange(self, messages):
+        """
+        Send messages as binary frames in a single write and read all their responses, matched by request id.
+
+        Parameters
+        ----------
+        messages : list of tuple of (str, str, object)
+            assembly key, command from custom communications protocol (e.g. 'PS:VOLT ?'), and parameter of setters or
+            None.
+
+        Returns
+        -------
+        list
+            result of every message, in order: None, float, bool, or str.
+        str
+            If the responses could not be read, return an error string.
+        """
+        out = [None] * len(messages)
+        pending = {}  # request id: position in out
+        frames = []
+        for i, (asm_key, msg, param) in enumerate(messages):
+            parts = msg.split()
+            asm_key = asm_key.upper()
+            if asm_key == 'OVEN':
+                asm_index = oven_protocol.OVEN_INDEX
+            else:
+                asm_index = self._binary_keys.get(asm_key)
+            command_id = self._binary_commands.get(parts[0].upper())
+            if asm_index is None:
+                out[i] = 'ERROR: HeaterAssembly name ' + asm_key + ' not found'
+                self._keys = None
+                continue
+            if command_id is None:
+                out[i] = 'ERROR: bad command ' + asm_key + ' ' + msg
+                continue
+            self._request_id = (self._request_id + 1) % 2 ** 32
+            pending[self._request_id] = i
+            frames.append(oven_protocol.pack_request(
+                self._request_id, asm_index, command_id, parts[1:] == ['?'], None if param == '' else param))
+        if not frames:
+            return out
+
+        msg = b''.join(frames)
+        with self._lock:
+            t0 = time.perf_counter()
+            received = 0
+            try:
+                self._socket.sendall(msg)
+                deadline = time.monotonic() + self._timeout
+                while pending:
+                    response = oven_protocol.unpack_response(self._rx_buffer)
+                    if response is None:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise socket.timeout('binary response not complete')
+                        self._socket.settimeout(remaining)
+                        chunk = self._socket.recv(4096)
+                        if not chunk:
+                            raise ConnectionError('connection closed by oven')
+                        self._rx_buffer += chunk
+                        continue
+                    request_id, result, size = response
+                    del self._rx_buffer[:size]
+                    received += size
+                    if request_id in pending:
+                        out[pending.pop(request_id)] = result
+            except socket.timeout:
+                self._rx_buffer.clear()
+                self._stats.record('BINARY', time.perf_counter() - t0, len(msg), received, timeout=True)
+                return 'ERROR: No response from oven for ' + str(len(frames)) + ' binary requests'
+            except (OSError, AttributeError):
+                self._stats.record('BINARY', time.perf_counter() - t0, error=True)
+                return 'ERROR: Connection lost. Try using the connect() method first.'
+            self._stats.record('BINARY', time.perf_counter() - t0, len(msg), received)
+        return out
 
     @property
     def idn(self):
+        keys = self.keys
+        with self.pipeline() as p:
+            for name in keys:
+                p.query(name, 'PS:IDN')
+                p.query(name, 'DQ:IDN')
+        if isinstance(p.replies, str):
+            return p.replies
+
         msg = 'Oven with assemblies:\n'
-        for name in self.get_assemblies_keys():
+        for i, name in enumerate(keys):
             msg += '    ' + name + '\n'
 
-            msg += 'Power supply: ' + self.get_supply_idn(name) + '\n'
-            msg += 'Temp DAQ: ' + self.get_daq_idn(name) + '\n'
+            msg += 'Power supply: ' + p.replies[2 * i] + '\n'
+            msg += 'Temp DAQ: ' + p.replies[2 * i + 1] + '\n'
 
         return msg
 
-    def _query_(self, asm_key, msg):
+    def _resolve_key(self, asm_key):
+        """
+        Returns
+        -------
+        tuple of (str, None)
+            the assembly key. If asm_key is an int, the key at that index in the list of assemblies.
+        tuple of (None, str)
+            If the index is not valid, None and an error string.
+        """
+        if type(asm_key) is int:
+            keys = self.keys
+            if not -len(keys) <= asm_key < len(keys):  # the oven may have more assemblies than cached
+                keys = self.get_assemblies_keys()
+                if isinstance(keys, str):
+                    return None, keys
+            try:
+                return keys[asm_key], None
+            except IndexError:
+                return None, 'ERROR: index ' + str(asm_key) + ' not valid.'
+        return asm_key, None
+
+    def _check_reply(self, out):
+        """
+        Forget the cached assembly keys if the oven did not find an assembly. Returns out unchanged.
+        """
+        if isinstance(out, bytes):
+            if out.startswith(b'ERROR: HeaterAssembly name '):
+                self._keys = None
+        elif isinstance(out, str) and out.startswith('ERROR: HeaterAssembly name '):
+            self._keys = None
+        return out
+
+    def pipeline(self):
+        """
+        Pipelined mode: queue any number of queries and commands, then send them all in a single message and read all
+        the replies in a single round trip, instead of waiting for the reply of every message before sending the next.
+
+            with oven.pipeline() as p:
+                p.query('ASM1', 'DQ:TEMP')
+                p.command('ASM1', 'PD:SETP', 150)
+                p.query('ASM2', 'DQ:TEMP')
+            temp1, err, temp2 = p.replies
+
+        Returns
+        -------
+        OvenPipeline
+        """
+        return OvenPipeline(self)
+
+    def _query_(self, asm_key, msg, param=None):
         """
         Send a query to the ethernet device and receives response.
 
@@ -554,22 +1066,46 @@ class Oven(SocketEthernetDevice):
             the list of assemblies in the oven.
         msg : str
             command from custom communications protocol.
+        param : str, int, float, None
+            parameter of queries that take one, like TM:HIST.
 
         Returns
         -------
         str
             Returns response as string or error string.
         """
-        if type(asm_key) is int:
-            try:
-                asm_key = self.get_assemblies_keys()[asm_key]
-            except IndexError:
-                return 'ERROR: index ' + str(asm_key) + ' not valid.'
+        asm_key, err = self._resolve_key(asm_key)
+        if err is not None:
+            return err
 
-        qry = asm_key + ' ' + msg + '\r'
+        cache = self._cache
+        command = None if cache is None else cache.command(msg, param)
+        if command is not None:
+            if cache.generation_due():
+                generation = self._send_query_('OVEN', 'OV:GENR')
+                cache.set_generation(None if str(generation).startswith('ERROR') else str(generation))
+            hit, out = cache.get(asm_key, command)
+            if hit:
+                return out
+
+        out = self._send_query_(asm_key, msg, param)
+        if command is not None:
+            cache.put(asm_key, command, out)
+        return out
+
+    def _send_query_(self, asm_key, msg, param=None):
+        """
+        Send a query to the oven, without going through the cache. asm_key has to be a key, not an index. See
+        _query_().
+        """
+        if self._binary:
+            out = self._binary_exchange([(asm_key, msg, param)])
+            return out if isinstance(out, str) else self._check_reply(out[0])
+
+        qry = asm_key + ' ' + msg + ('' if param is None else ' ' + str(param)) + '\r'
         out = self._query(qry.encode('utf-8'))
         try:
-            return out.decode('utf-8').strip('\r')
+            return self._check_reply(out.decode('utf-8').strip('\r'))
         except AttributeError:
             return out
 
@@ -594,23 +1130,99 @@ class Oven(SocketEthernetDevice):
         str
             Else, return error string.
         """
-        if type(asm_key) is int:
-            try:
-                asm_key = self.get_assemblies_keys()[asm_key]
-            except IndexError:
-                return 'ERROR: index ' + str(asm_key) + ' not valid.'
-
-        cmd = asm_key + ' ' + msg + ' ' + str(param) + '\r'
-        err = self._query(cmd.encode('utf-8'))
-        if err != b'NOERROR\r':
+        asm_key, err = self._resolve_key(asm_key)
+        if err is not None:
             return err
 
+        if self._binary:
+            out = self._binary_exchange([(asm_key, msg, param)])
+            out = out if isinstance(out, str) else self._check_reply(out[0])
+        else:
+            cmd = asm_key + ' ' + msg + ' ' + str(param) + '\r'
+            err = self._query(cmd.encode('utf-8'))
+            out = None if err == b'NOERROR\r' else self._check_reply(err)
+        if self._cache is not None:
+            self._cache.invalidate(asm_key)
+        return out
+
     # Oven
     def get_assemblies_keys(self):
         """
+        Ask the oven for the keys of its assemblies, and refresh the cached keys. See the keys property.
+
         :return list of str: keys of all the heater assemblies used by the oven.
+        :return str: If an error occurs, return the error string.
+        """
+        qry = self._query_('OVEN', 'OV:KEYS')
+        if qry.startswith('ERROR'):
+            return qry
+        self._keys = qry.split()
+        return list(self._keys)
+
+    def get_loop_stats(self):
+        """
+        Timing statistics of the control loop of every assembly. See _parse_loop_stats().
+        """
+        return _parse_loop_stats(self._query_('OVEN', 'OV:LOOP'))
+
+    def snapshot(self):
+        """
+        State of every assembly in a single round trip: temperature, supply setpoint and actual voltage and current,
+        channel state, PID setpoint and gains, and regulation flag. See _parse_snapshot().
+        """
+        return _parse_snapshot(self._query_('OVEN', 'OV:SNAP'))
+
+    def get_history(self, asm_key, since=0.0):
+        """
+        Control updates recorded by the oven server after a given time, for example to fill the gap left by a lost
+        connection. Fetched in chunks of at most HISTORY_CHUNK samples.
+
+        Parameters
+        ----------
+        asm_key : str or int
+            assembly key, or its index in the list of assemblies.
+        since : float
+            time.time() value. Only updates after it are returned. 0 for the full history.
+
+        Returns
+        -------
+        numpy.ndarray
+            samples with fields 'time', 'temp', 'volts', 'setpoint', 'p', 'i', and 'd'. See telemetry_history.py.
+        str
+            If an error occurs, return the error string.
+        """
+        chunks = []
+        while True:
+            reply = self._query_(asm_key, 'TM:HIST', repr(float(since)))
+            if not isinstance(reply, str) or reply.startswith('ERROR'):
+                return reply
+            chunk = parse_history(reply)
+            chunks.append(chunk)
+            if len(chunk) < HISTORY_CHUNK:
+                return np.concatenate(chunks)
+            since = chunk['time'][-1]
+
+    def subscribe(self, asm_key=None, decimation=1):
+        """
+        Open a telemetry connection to the oven. The server pushes a record after every PID update, so there is no
+        need to poll the temperatures.
+
+            telemetry = oven.subscribe('ASM1', decimation=5)
+            for key, record in telemetry:
+                print(key, record['temp'])
+
+        Parameters
+        ----------
+        asm_key : str, None
+            assembly to receive the telemetry from. None for all the assemblies.
+        decimation : int
+            receive only one of every decimation updates.
+
+        Returns
+        -------
+        OvenTelemetry
         """
-        return self._query_('OVEN', 'OV:KEYS').split()
+        return OvenTelemetry(self.ip4_address, self.port, asm_key, decimation)
 
     # Power supply
     # ------------
@@ -624,14 +1236,20 @@ class Oven(SocketEthernetDevice):
         return self._command_(asm_key, 'PS:STOP')
 
     def stop_all_supplies(self):
-        for asm_key in self.get_assemblies_keys():
+        keys = self.get_assemblies_keys()  # not the cached keys, to also stop assemblies that became ready since
+        if isinstance(keys, str):
+            return keys
+        for asm_key in keys:
             self._command_(asm_key, 'PS:STOP')
 
     def ready_supply(self, asm_key):
         return self._command_(asm_key, 'PS:REDY')
 
     def ready_all_supplies(self):
-        for asm_key in self.get_assemblies_keys():
+        keys = self.get_assemblies_keys()
+        if isinstance(keys, str):
+            return keys
+        for asm_key in keys:
             self._command_(asm_key, 'PS:REDY')
 
     def get_supply_actual_voltage(self, asm_key):
@@ -862,3 +1480,936 @@ class Oven(SocketEthernetDevice):
 
     def ready_assembly(self, asm_key):
         return self._command_(asm_key, 'AM:REDY')
+
+
+def _parse_reply(qry, data_type):
+    """
+    Change a reply string from the oven server into its correct type.
+
+    Parameters
+    ----------
+    qry : str
+        reply from the oven server.
+    data_type : type
+        callable object of int, float or bool.
+
+    Returns
+    -------
+    int, float, bool
+        the reply in its correct type.
+    str
+        if the reply cannot be changed, return the reply unchanged. Usually an error string.
+    """
+    if data_type is bool:
+        if qry == 'False':
+            return False
+        elif qry == 'True':
+            return True
+        return qry
+    try:
+        return data_type(qry)
+    except ValueError:
+        return qry
+
+
+def _parse_loop_stats(qry):
+    """
+    Change the reply to OVEN OV:LOOP into a dictionary.
+
+    Parameters
+    ----------
+    qry : str
+        reply from the oven server: 'ASM1 count=10 overruns=0 ... jitter_max_ms=0.250; ASM2 ...'.
+
+    Returns
+    -------
+    dictionary of str: dict
+        statistics of every assembly: 'count', 'overruns', 'missed', and 'errors' as int, and 'jitter_mean',
+        'jitter_p99', 'jitter_max', 'duration_mean', and 'duration_max' in seconds, None if there were no updates.
+    str
+        If the reply cannot be parsed, return the reply unchanged. Usually an error string.
+    """
+    if qry.startswith('ERROR'):
+        return qry
+    out = {}
+    try:
+        for part in qry.split(';'):
+            words = part.split()
+            if not words:
+                continue
+            stats = {}
+            for word in words[1:]:
+                name, value = word.split('=')
+                if name.endswith('_ms'):
+                    stats[name[:-3]] = None if value == '-' else float(value) / 1000
+                else:
+                    stats[name] = int(value)
+            out[words[0]] = stats
+    except ValueError:
+        return qry
+    return out
+
+
+def _parse_snapshot(qry):
+    """
+    Change the reply to OVEN OV:SNAP into a dictionary.
+
+    Parameters
+    ----------
+    qry : str
+        reply from the oven server: 'ASM1 temp=25.0 setpoint_voltage=0.0 ... regulating=False; ASM2 ERROR: ...'.
+
+    Returns
+    -------
+    dictionary of str: dict or str
+        the values of every assembly, keyed as in HeaterAssembly.get_snapshot(), or an error string for assemblies
+        that could not be read.
+    str
+        If the reply cannot be parsed, return the reply unchanged. Usually an error string.
+    """
+    if qry.startswith('ERROR'):
+        return qry
+    out = {}
+    try:
+        for part in qry.split(';'):
+            key, _, values = part.strip().partition(' ')
+            if not key:
+                continue
+            if values.startswith('ERROR'):
+                out[key] = values
+                continue
+            out[key] = {}
+            for word in values.split():
+                name, value = word.split('=')
+                out[key][name] = _parse_reply(value, bool) if value in ('True', 'False') else float(value)
+    except ValueError:
+        return qry
+    return out
+
+
+class AsyncOven(AsyncSocketEthernetDevice):
+    """
+    asyncio version of the Oven client. Every method is a coroutine and has to be awaited. Connect with
+    'await oven.connect()' or 'async with oven:'. Several ovens can be driven from a single event loop concurrently.
+    """
+    def __init__(self, ip4_address, port=65432, ):
+        self._keys = None  # see Oven.keys
+        super().__init__(ip4_address, port, terminator=b'\r')
+
+    @property
+    def keys(self):
+        """
+        Keys of the heater assemblies, cached by connect() and get_assemblies_keys(). See Oven.keys.
+        """
+        return list(self._keys or [])
+
+    def invalidate_keys(self):
+        self._keys = None
+
+    _check_reply = Oven._check_reply
+
+    async def connect(self, attempts=11, initial_delay=0.1, max_delay=5):
+        """
+        See AsyncSocketEthernetDevice.connect(). Also fetches the assembly keys.
+        """
+        self._keys = None
+        await super().connect(attempts, initial_delay, max_delay)
+        await self.get_assemblies_keys()
+
+    async def _resolve_key(self, asm_key):
+        """
+        See Oven._resolve_key()
+        """
+        if type(asm_key) is int:
+            keys = self._keys or []
+            if not -len(keys) <= asm_key < len(keys):
+                keys = await self.get_assemblies_keys()
+                if isinstance(keys, str):
+                    return None, keys
+            try:
+                return keys[asm_key], None
+            except IndexError:
+                return None, 'ERROR: index ' + str(asm_key) + ' not valid.'
+        return asm_key, None
+
+    async def get_idn(self):
+        msg = 'Oven with assemblies:\n'
+        if self._keys is None:
+            await self.get_assemblies_keys()
+        for name in self.keys:
+            msg += '    ' + name + '\n'
+
+            msg += 'Power supply: ' + await self.get_supply_idn(name) + '\n'
+            msg += 'Temp DAQ: ' + await self.get_daq_idn(name) + '\n'
+
+        return msg
+
+    async def _query_(self, asm_key, msg):
+        """
+        See Oven._query_()
+        """
+        asm_key, err = await self._resolve_key(asm_key)
+        if err is not None:
+            return err
+
+        qry = asm_key + ' ' + msg + '\r'
+        out = await self._query(qry.encode('utf-8'))
+        try:
+            return self._check_reply(out.decode('utf-8').strip('\r'))
+        except AttributeError:
+            return out
+
+    async def _command_(self, asm_key, msg, param=''):
+        """
+        See Oven._command_()
+        """
+        asm_key, err = await self._resolve_key(asm_key)
+        if err is not None:
+            return err
+
+        cmd = asm_key + ' ' + msg + ' ' + str(param) + '\r'
+        err = await self._query(cmd.encode('utf-8'))
+        if err != b'NOERROR\r':
+            return self._check_reply(err)
+
+    # Oven
+    async def get_assemblies_keys(self):
+        """
+        See Oven.get_assemblies_keys()
+        """
+        qry = await self._query_('OVEN', 'OV:KEYS')
+        if qry.startswith('ERROR'):
+            return qry
+        self._keys = qry.split()
+        return list(self._keys)
+
+    async def get_loop_stats(self):
+        return _parse_loop_stats(await self._query_('OVEN', 'OV:LOOP'))
+
+    async def snapshot(self):
+        return _parse_snapshot(await self._query_('OVEN', 'OV:SNAP'))
+
+    async def get_history(self, asm_key, since=0.0):
+        """
+        See Oven.get_history()
+        """
+        chunks = []
+        while True:
+            reply = await self._query_(asm_key, 'TM:HIST ' + repr(float(since)))
+            if not isinstance(reply, str) or reply.startswith('ERROR'):
+                return reply
+            chunk = parse_history(reply)
+            chunks.append(chunk)
+            if len(chunk) < HISTORY_CHUNK:
+                return np.concatenate(chunks)
+            since = chunk['time'][-1]
+
+    # Power supply
+    # ------------
+    async def get_supply_idn(self, asm_key):
+        return await self._query_(asm_key, 'PS:IDN')
+
+    async def reset_supply(self, asm_key):
+        return await self._command_(asm_key, 'PS:RSET')
+
+    async def stop_supply(self, asm_key):
+        return await self._command_(asm_key, 'PS:STOP')
+
+    async def stop_all_supplies(self):
+        keys = await self.get_assemblies_keys()
+        if isinstance(keys, str):
+            return keys
+        for asm_key in keys:
+            await self._command_(asm_key, 'PS:STOP')
+
+    async def ready_supply(self, asm_key):
+        return await self._command_(asm_key, 'PS:REDY')
+
+    async def ready_all_supplies(self):
+        keys = await self.get_assemblies_keys()
+        if isinstance(keys, str):
+            return keys
+        for asm_key in keys:
+            await self._command_(asm_key, 'PS:REDY')
+
+    async def get_supply_actual_voltage(self, asm_key):
+        return _parse_reply(await self._query_(asm_key, 'PS:VOLT ?'), float)
+
+    async def get_supply_setpoint_voltage(self, asm_key):
+        return _parse_reply(await self._query_(asm_key, 'PS:VSET ?'), float)
+
+    async def set_supply_voltage(self, asm_key, volts):
+        return await self._command_(asm_key, 'PS:VSET', volts)
+
+    async def get_supply_actual_current(self, asm_key):
+        return _parse_reply(await self._query_(asm_key, 'PS:AMPS ?'), float)
+
+    async def get_supply_setpoint_current(self, asm_key):
+        return _parse_reply(await self._query_(asm_key, 'PS:ASET ?'), float)
+
+    async def set_supply_current(self, asm_key, amps):
+        return await self._command_(asm_key, 'PS:ASET', amps)
+
+    async def get_supply_voltage_limit(self, asm_key):
+        return _parse_reply(await self._query_(asm_key, 'PS:VLIM ?'), float)
+
+    async def set_supply_voltage_limit(self, asm_key, volts):
+        return await self._command_(asm_key, 'PS:VLIM', volts)
+
+    async def get_supply_current_limit(self, asm_key):
+        return _parse_reply(await self._query_(asm_key, 'PS:ALIM ?'), float)
+
+    async def set_supply_current_limit(self, asm_key, amps):
+        return await self._command_(asm_key, 'PS:ALIM', amps)
+
+    async def get_supply_channel_state(self, asm_key):
+        return _parse_reply(await self._query_(asm_key, 'PS:CHIO ?'), bool)
+
+    async def set_supply_channel_state(self, asm_key, state):
+        return await self._command_(asm_key, 'PS:CHIO', int(state))
+
+    async def get_supply_channel(self, asm_key):
+        return _parse_reply(await self._query_(asm_key, 'PS:CHAN ?'), int)
+
+    async def set_supply_channel(self, asm_key, new_chan):
+        return await self._command_(asm_key, 'PS:CHAN', new_chan)
+
+    # DAQ
+    # ---
+    async def get_daq_idn(self, asm_key):
+        return await self._query_(asm_key, 'DQ:IDN')
+
+    async def get_daq_temp(self, asm_key):
+        return _parse_reply(await self._query_(asm_key, 'DQ:TEMP ?'), float)
+
+    async def get_daq_channel(self, asm_key):
+        return _parse_reply(await self._query_(asm_key, 'DQ:CHAN ?'), int)
+
+    async def set_daq_channel(self, asm_key, new_chan):
+        return await self._command_(asm_key, 'DQ:CHAN', new_chan)
+
+    async def get_daq_tc_type(self, asm_key):
+        return await self._query_(asm_key, 'DQ:TCTY ?')
+
+    async def set_daq_tc_type(self, asm_key, tc_type):
+        return await self._command_(asm_key, 'DQ:TCTY', tc_type)
+
+    async def get_daq_units(self, asm_key):
+        return await self._query_(asm_key, 'DQ:UNIT ?')
+
+    async def set_daq_units(self, asm_key, units):
+        return await self._command_(asm_key, 'DQ:UNIT', units)
+
+    # PID Settings
+    # ------------
+    async def get_pid_idn(self, asm_key):
+        return await self._query_(asm_key, 'PD:IDN')
+
+    async def reset_pid(self, asm_key):
+        return await self._command_(asm_key, 'PD:RSET')
+
+    async def get_pid_limits(self, asm_key):
+        return await self._query_(asm_key, 'PD:LIMS ?')
+
+    async def reset_pid_limits(self, asm_key):
+        return await self._command_(asm_key, 'PD:RLIM')
+
+    async def get_pid_kpro(self, asm_key):
+        return _parse_reply(await self._query_(asm_key, 'PD:KPRO ?'), float)
+
+    async def set_pid_kpro(self, asm_key, new_k):
+        return await self._command_(asm_key, 'PD:KPRO', new_k)
+
+    async def get_pid_kint(self, asm_key):
+        return _parse_reply(await self._query_(asm_key, 'PD:KINT ?'), float)
+
+    async def set_pid_kint(self, asm_key, new_k):
+        return await self._command_(asm_key, 'PD:KINT', new_k)
+
+    async def get_pid_kder(self, asm_key):
+        return _parse_reply(await self._query_(asm_key, 'PD:KDER ?'), float)
+
+    async def set_pid_kder(self, asm_key, new_k):
+        return await self._command_(asm_key, 'PD:KDER', new_k)
+
+    async def get_pid_setpoint(self, asm_key):
+        return _parse_reply(await self._query_(asm_key, 'PD:SETP ?'), float)
+
+    async def set_pid_setpoint(self, asm_key, new_temp):
+        return await self._command_(asm_key, 'PD:SETP', new_temp)
+
+    async def get_pid_sample_time(self, asm_key):
+        return _parse_reply(await self._query_(asm_key, 'PD:SAMP ?'), float)
+
+    async def set_pid_sample_time(self, asm_key, new_t):
+        return await self._command_(asm_key, 'PD:SAMP', new_t)
+
+    async def get_pid_regulation(self, asm_key):
+        return _parse_reply(await self._query_(asm_key, 'PD:REGT ?'), bool)
+
+    async def set_pid_regulation(self, asm_key, regt):
+        return await self._command_(asm_key, 'PD:REGT', int(regt))
+
+    # Heater
+    async def get_heater_MAX_temp(self, asm_key):
+        return await self._query_(asm_key, 'HT:TMAX ?')
+
+    async def set_heater_MAX_temp(self, asm_key, new_temp):
+        return await self._command_(asm_key, 'HT:TMAX', new_temp)
+
+    async def get_heater_MAX_volts(self, asm_key):
+        return await self._query_(asm_key, 'HT:VMAX ?')
+
+    async def set_heater_MAX_volts(self, asm_key, new_volts):
+        return await self._command_(asm_key, 'HT:VMAX', new_volts)
+
+    async def get_heater_MAX_current(self, asm_key):
+        return await self._query_(asm_key, 'HT:AMAX ?')
+
+    async def set_heater_MAX_current(self, asm_key, new_amps):
+        return await self._command_(asm_key, 'HT:AMAX', new_amps)
+
+    # Assembly
+    async def get_assembly_MAX_voltage(self, asm_key):
+        return _parse_reply(await self._query_(asm_key, 'AM:MAXV'), float)
+
+    async def get_assembly_MAX_current(self, asm_key):
+        return _parse_reply(await self._query_(asm_key, 'AM:MAXA'), float)
+
+    async def stop(self, asm_key):
+        return await self._command_(asm_key, 'AM:STOP')
+
+    async def reset_assembly(self, asm_key):
+        return await self._command_(asm_key, 'AM:RSET')
+
+    async def ready_assembly(self, asm_key):
+        return await self._command_(asm_key, 'AM:REDY')
+
+
+class OvenPipeline:
+    def __init__(self, oven):
+        """
+        Queries and commands for an Oven, sent all at once. See Oven.pipeline().
+
+        Parameters
+        ----------
+        oven : Oven
+        """
+        self._oven = oven
+        self._messages = []
+        self._is_query = []
+        self._errors = {}  # position: error found before sending
+        self._written = set()  # assembly keys of the commands, whose cached settings are dropped
+        self._replies = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.execute()
+
+    def __len__(self):
+        return len(self._is_query)
+
+    def _add(self, asm_key, msg, param, is_query):
+        asm_key, err = self._oven._resolve_key(asm_key)
+        if err is not None:
+            self._errors[len(self._is_query)] = err
+        else:
+            self._messages.append((asm_key, msg, param))
+            if not is_query:
+                self._written.add(asm_key)
+        self._is_query.append(is_query)
+        return len(self._is_query) - 1
+
+    def query(self, asm_key, msg):
+        """
+        Queue a query. Same arguments as Oven._query_().
+
+        Returns
+        -------
+        int
+            position of the reply in the list returned by execute().
+        """
+        return self._add(asm_key, msg, None, True)
+
+    def command(self, asm_key, msg, param=''):
+        """
+        Queue a command. Same arguments as Oven._command_().
+
+        Returns
+        -------
+        int
+            position of the reply in the list returned by execute().
+        """
+        return self._add(asm_key, msg, param, False)
+
+    @property
+    def replies(self):
+        """
+        Result of the last execute(), or None if it was not called yet.
+        """
+        return self._replies
+
+    def execute(self):
+        """
+        Send all the queued messages in a single write and read all the replies, then empty the queue.
+
+        Returns
+        -------
+        list
+            one item per queued message, in order: the reply string for queries (float, bool, or str if the oven uses
+            the binary protocol), and None or an error string for commands.
+        str
+            If the replies could not be read, return an error string.
+        """
+        messages, is_query, errors, written = self._messages, self._is_query, self._errors, self._written
+        self._messages, self._is_query, self._errors, self._written = [], [], {}, set()
+
+        raw = []
+        if messages and self._oven.binary:
+            raw = self._oven._binary_exchange(messages)
+        elif messages:
+            msg = ''.join(key + ' ' + m + ('' if p is None else ' ' + str(p)) + '\r' for key, m, p in messages)
+            raw = self._oven._query_batch(msg.encode('utf-8'), len(messages), separator=b'\r')
+            if not isinstance(raw, str):
+                raw = [reply.decode('utf-8') for reply in raw]
+        if self._oven.cache is not None:
+            for asm_key in written:
+                self._oven.cache.invalidate(asm_key)
+        if isinstance(raw, str):
+            self._replies = raw
+            return raw
+
+        replies = []
+        raw = iter(raw)
+        for i, query in enumerate(is_query):
+            if i in errors:
+                replies.append(errors[i])
+                continue
+            reply = next(raw)
+            if not query and reply == 'NOERROR':
+                reply = None
+            replies.append(reply)
+        self._replies = replies
+        return replies
+
+
+def _parse_telemetry(line):
+    """
+    Change a telemetry line pushed by the oven server into a dictionary.
+
+    Parameters
+    ----------
+    line : str
+        '#TM ASM1 time=1700000000.000 temp=25.0 volts=1.5 setpoint=60.0' or '#TM ASM1 time=1700000000.000 ERROR: ...'
+
+    Returns
+    -------
+    tuple of (str, dict)
+        the assembly key, and a dictionary with 'time', 'temp', 'volts', 'setpoint', and 'error', which is None unless
+        the update failed.
+    """
+    _, key, time_, rest = (line.strip() + ' ').split(' ', 3)
+    record = {'time': float(time_.partition('=')[2]), 'temp': None, 'volts': None, 'setpoint': None, 'error': None}
+    if rest.startswith('ERROR'):
+        record['error'] = rest.strip()
+        return key, record
+    for word in rest.split():
+        name, value = word.split('=')
+        record[name] = _parse_reply(value, float)
+    return key, record
+
+
+class OvenTelemetry(SocketEthernetDevice):
+    def __init__(self, ip4_address, port=65432, asm_key=None, decimation=1):
+        """
+        Connection to an oven server receiving the telemetry pushed after every PID update. Uses its own connection,
+        so that the records never get mixed with the replies of an Oven. If the connection is lost, read() connects
+        again and the subscriptions are sent again. See Oven.subscribe().
+
+        Parameters
+        ----------
+        ip4_address : str
+            IP v4 address of the BeagleBoneBlack that is controlling the oven.
+        port : int
+            port number. Default to 65432
+        asm_key : str, None
+            assembly to receive the telemetry from. None for all the assemblies. More can be added with subscribe().
+        decimation : int
+            receive only one of every decimation updates.
+        """
+        self._subs = {}
+        self._records = collections.deque()
+        super().__init__(ip4_address, port, terminator=b'\r')
+        err = self.subscribe(asm_key, decimation)
+        if err is not None:
+            print(err)
+
+    def __iter__(self):
+        """
+        Yield the records as they arrive. Stops if the connection is lost and cannot be re-established, or after
+        disconnect().
+        """
+        while True:
+            try:
+                record = self.read(timeout=1)
+            except OSError:
+                return
+            if record is not None:
+                yield record
+
+    def _on_connect(self, first):
+        self._rx_buffer.clear()
+        for key, decimation in self._subs.items():
+            err = self._request((key or 'OVEN') + ' TM:SUBS ' + str(decimation))
+            if err is not None:
+                print(err)
+
+    def _request(self, msg):
+        """
+        Send a subscription command and wait for its reply. Records arriving before the reply are kept for read().
+
+        Returns
+        -------
+        None
+            If succesful, return None.
+        str
+            Else, return error string.
+        """
+        with self._lock:
+            try:
+                self._drain()
+                self._socket.sendall((msg + '\r').encode('utf-8'))
+                deadline = time.monotonic() + self._timeout
+                while True:
+                    line = self._read_reply(deadline).decode('utf-8').strip('\r')
+                    if not line.startswith('#TM'):
+                        break
+                    self._records.append(_parse_telemetry(line))
+            except socket.timeout:
+                return 'ERROR: No response from oven for ' + msg
+            except (OSError, AttributeError):
+                return 'ERROR: Command not sent. Try using the connect() method first.'
+        if line != 'NOERROR':
+            return line
+
+    def subscribe(self, asm_key=None, decimation=1):
+        """
+        Parameters
+        ----------
+        asm_key : str, None
+            assembly to receive the telemetry from. None for all the assemblies.
+        decimation : int
+            receive only one of every decimation updates.
+
+        Returns
+        -------
+        None
+            If succesful, return None.
+        str
+            Else, return error string.
+        """
+        err = self._request((asm_key or 'OVEN') + ' TM:SUBS ' + str(decimation))
+        if err is None:
+            self._subs[asm_key] = decimation
+        return err
+
+    def unsubscribe(self, asm_key=None):
+        """
+        Stop receiving the telemetry of an assembly, or of all of them if asm_key is None.
+        """
+        err = self._request((asm_key or 'OVEN') + ' TM:UNSB')
+        if err is None:
+            if asm_key is None:
+                self._subs.clear()
+            else:
+                self._subs.pop(asm_key, None)
+        return err
+
+    def read(self, timeout=None):
+        """
+        Wait for the next telemetry record.
+
+        Parameters
+        ----------
+        timeout : float, None
+            maximum time to wait in seconds. If None, use the timeout of the connection.
+
+        Returns
+        -------
+        tuple of (str, dict)
+            the assembly key and the record. See _parse_telemetry().
+        None
+            If no record arrived before the timeout, or the connection was lost and has just been re-established.
+
+        Raises
+        ------
+        OSError
+            If the connection is lost and cannot be re-established, or was closed with disconnect().
+        """
+        if self._records:
+            return self._records.popleft()
+        if timeout is None:
+            timeout = self._timeout
+        with self._lock:
+            if not self._is_connected:
+                raise ConnectionError('telemetry connection closed. Try using the connect() method first.')
+            try:
+                # a record split across the deadline is completed by the next read
+                line = self._read_reply(time.monotonic() + timeout, keep_partial=True).decode('utf-8').strip('\r')
+            except socket.timeout:
+                return None
+            except OSError:  # includes ConnectionError. connect() subscribes again, see _on_connect()
+                self._socket.close()
+                self._is_connected = False
+                self.connect()
+                return None
+        if not line.startswith('#TM'):  # reply to a command sent by someone else on this connection
+            return None
+        try:
+            return _parse_telemetry(line)
+        except ValueError:
+            return None
+
+
+class OvenFleet:
+    def __init__(self, addresses, port=65432, binary=False, max_workers=None, stop_timeout=5.0):
+        """
+        Several ovens driven together. Operations on the fleet run on every oven at the same time, from a thread pool,
+        and return the result of every oven, so a broadcast takes as long as the slowest oven instead of the sum of all
+        of them. Errors, exceptions, and ovens that are not connected are reported as error strings in the results
+        instead of stopping the operation on the other ovens.
+
+            with OvenFleet(['10.176.42.10', '10.176.42.11']) as fleet:
+                fleet.ready_all()
+                fleet.set_pid_setpoint('ASM1', 150)
+                temps = fleet.map('get_daq_temp', 'ASM1')
+                fleet.stop()
+
+        Every oven has a second connection used only by stop(), so that an emergency stop does not wait for the queries
+        of other threads on the main connection.
+
+        Parameters
+        ----------
+        addresses : list of str, dictionary of str: str
+            IP v4 addresses of the ovens, or a dictionary mapping oven names to addresses. If a list is given, the ovens
+            are named by their address.
+        port : int
+            port number of every oven.
+        binary : bool
+            use the binary protocol on the main connections. See Oven.
+        max_workers : int, None
+            number of threads running the operations. Defaults to one per oven.
+        stop_timeout : float
+            longest time in seconds stop() waits for every oven to confirm, and timeout of the stop connections.
+        """
+        if not isinstance(addresses, dict):
+            addresses = {address: address for address in addresses}
+        self._addresses = dict(addresses)
+        self._port = port
+        self._binary = binary
+        self._stop_timeout = stop_timeout
+        self._ovens = {}  # name: Oven
+        self._stop_ovens = {}  # name: Oven only used by stop()
+        self._pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers or max(len(self._addresses), 1), thread_name_prefix='oven fleet')
+        self.connect()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def names(self):
+        return list(self._addresses)
+
+    @property
+    def ovens(self):
+        """
+        Connected ovens, keyed by name.
+        """
+        return dict(self._ovens)
+
+    def connect(self):
+        """
+        Connect to every oven that is not connected yet, all at the same time. Called on creation.
+
+        Returns
+        -------
+        dictionary of str: None or str
+            None for every oven connected, an error string for the others.
+        """
+        def connect_one(name):
+            address = self._addresses[name]
+            if name not in self._ovens:
+                self._ovens[name] = Oven(address, self._port, self._binary)
+            if name not in self._stop_ovens:
+                self._stop_ovens[name] = Oven(address, self._port, timeout=self._stop_timeout)
+
+        futures = {name: self._pool.submit(connect_one, name) for name in self._addresses}
+        return {name: self._result(future) for name, future in futures.items()}
+
+    def close(self):
+        """
+        Disconnect from every oven and stop the threads.
+        """
+        for oven in list(self._ovens.values()) + list(self._stop_ovens.values()):
+            oven.disconnect()
+        self._ovens.clear()
+        self._stop_ovens.clear()
+        self._pool.shutdown(wait=False)
+
+    @staticmethod
+    def _result(future):
+        try:
+            return future.result()
+        except Exception as err:  # one oven failing must not hide the results of the others
+            return 'ERROR: ' + repr(err)
+
+    def map(self, operation, *args, timeout=None, **kwargs):
+        """
+        Run an operation on every oven at the same time.
+
+        Parameters
+        ----------
+        operation : str, callable
+            name of an Oven method, called as method(*args, **kwargs), or a function called as
+            operation(oven, *args, **kwargs).
+        timeout : float, None
+            longest time in seconds to wait for all the ovens. Ovens that did not finish in time get an error string,
+            but the operation keeps running on them. None to wait for all of them.
+
+        Returns
+        -------
+        dictionary of str: object
+            result of every oven, by name. Ovens that are not connected, or where the operation raised an exception,
+            get an error string.
+        """
+        calls = {}
+        for name, oven in self._ovens.items():
+            if isinstance(operation, str):
+                calls[name] = (getattr(oven, operation), args)
+            else:
+                calls[name] = (operation, (oven,) + args)
+        return self._run(calls, timeout, **kwargs)
+
+    def _run(self, calls, timeout=None, **kwargs):
+        """
+        Parameters
+        ----------
+        calls : dictionary of str: (callable, tuple)
+            function and arguments to run for every oven name. Ovens missing from calls are reported as not connected.
+
+        Returns
+        -------
+        dictionary of str: object
+            See map()
+        """
+        futures = {name: self._pool.submit(func, *args, **kwargs) for name, (func, args) in calls.items()}
+        concurrent.futures.wait(list(futures.values()), timeout)
+        out = {}
+        for name in self._addresses:
+            if name not in futures:
+                out[name] = 'ERROR: oven ' + str(name) + ' is not connected'
+            elif not futures[name].done():
+                out[name] = 'ERROR: no result from oven within ' + str(timeout) + ' s'
+            else:
+                out[name] = self._result(futures[name])
+        return out
+
+    @staticmethod
+    def errors(results):
+        """
+        Parameters
+        ----------
+        results : dictionary of str: object
+            results of an operation on the fleet.
+
+        Returns
+        -------
+        dictionary of str: str
+            the error strings in results, by oven name. Empty if every oven succeeded.
+        """
+        return {name: out for name, out in results.items() if isinstance(out, str) and out.startswith('ERROR')}
+
+    def ready_all(self):
+        return self.map('ready_all_supplies')
+
+    def set_pid_setpoint(self, asm_key, new_temp):
+        """
+        Parameters
+        ----------
+        asm_key : str, int
+            assembly key or index, the same on every oven.
+        new_temp : float, dictionary of str: float
+            setpoint of every oven, or setpoints by oven name. Ovens missing from the dictionary are not changed.
+        """
+        if not isinstance(new_temp, dict):
+            return self.map('set_pid_setpoint', asm_key, new_temp)
+        calls = {
+            name: (oven.set_pid_setpoint, (asm_key, new_temp[name]))
+            for name, oven in self._ovens.items() if name in new_temp
+        }
+        results = self._run(calls)
+        return {name: results[name] for name in self._addresses if name in new_temp}
+
+    def snapshot(self):
+        return self.map('snapshot')
+
+    def stop(self, timeout=None):
+        """
+        Emergency stop: turn off the supplies, stop the regulation, and set the setpoints to 0 (AM:STOP) of every
+        assembly of every oven, all the ovens at the same time. Each oven is stopped from its own thread over its own
+        connection, so the stop does not wait for other operations of the fleet. Returns within timeout seconds.
+
+        Parameters
+        ----------
+        timeout : float, None
+            longest time in seconds to wait for the ovens to confirm. Defaults to stop_timeout. Ovens that did not
+            confirm in time keep being stopped in the background.
+
+        Returns
+        -------
+        dictionary of str: None or str
+            None for every oven stopped, an error string for the others.
+        """
+        if timeout is None:
+            timeout = self._stop_timeout
+        deadline = time.monotonic() + timeout
+        out = {}
+
+        def stop_one(name):
+            err = 'ERROR: oven ' + str(name) + ' is not connected'
+            for oven in (self._stop_ovens.get(name), self._ovens.get(name)):
+                if oven is None:
+                    continue
+                keys = oven.get_assemblies_keys()  # also the assemblies that became ready since connecting
+                if isinstance(keys, str):
+                    err = keys
+                    continue
+                with oven.pipeline() as p:
+                    for key in keys:
+                        p.command(key, 'AM:STOP')
+                if isinstance(p.replies, str):  # connection lost, try the main connection
+                    err = p.replies
+                    continue
+                errors = [key + ' ' + reply for key, reply in zip(keys, p.replies) if reply is not None]
+                err = '; '.join(errors) if errors else None
+                break
+            out[name] = err
+
+        threads = []
+        for name in self._addresses:
+            thread = threading.Thread(target=stop_one, args=(name,), name='stop oven ' + str(name), daemon=True)
+            thread.start()
+            threads.append((name, thread))
+        for name, thread in threads:
+            thread.join(max(deadline - time.monotonic(), 0))
+        for name, thread in threads:
+            if name not in out:
+                out[name] = 'ERROR: stop of oven ' + str(name) + ' not confirmed within ' + str(timeout) + ' s'
+        return {name: out[name] for name in self._addresses}
@@ -2,15 +2,107 @@
 Created on Thursday, April 7, 2022
 @author: Sebastian Miki-Silva
 """
+import asyncio
+import inspect
 import socket
+import threading
 import time
 
+try:
+    from device_stats import command_mnemonic
+    from device_stats import get_device_stats
+except ModuleNotFoundError:
+    from automation.device_stats import command_mnemonic
+    from automation.device_stats import get_device_stats
+
+
+def retry_with_backoff(func, attempts=None, initial_delay=0.5, max_delay=30, exceptions=(OSError,), stop_event=None):
+    """
+    Call func until it succeeds. After each failed attempt, wait before retrying. The wait starts at initial_delay and
+    doubles after every failure, up to max_delay.
+
+    Parameters
+    ----------
+    func : callable
+        function without arguments to call.
+    attempts : int, None
+        Maximum number of attempts. If None, retry until func succeeds or stop_event is set.
+    initial_delay : float
+        wait in seconds after the first failed attempt.
+    max_delay : float
+        longest wait in seconds between attempts.
+    exceptions : tuple of type
+        exceptions that count as a failed attempt. Other exceptions are raised right away.
+    stop_event : threading.Event, None
+        If set, stop retrying. Waiting between attempts ends early when the event is set.
+
+    Returns
+    -------
+    object
+        the return value of func.
+
+    Raises
+    ------
+    Exception
+        the exception from the last attempt if all attempts fail or stop_event is set.
+    """
+    delay = initial_delay
+    n = 0
+    while True:
+        try:
+            return func()
+        except exceptions:
+            n += 1
+            if attempts is not None and n >= attempts:
+                raise
+            if stop_event is not None and stop_event.is_set():
+                raise
+
+        if stop_event is not None:
+            stop_event.wait(delay)
+        else:
+            time.sleep(delay)
+        delay = min(2 * delay, max_delay)
+
+
+async def async_retry_with_backoff(func, attempts=None, initial_delay=0.5, max_delay=30, exceptions=(OSError,)):
+    """
+    Coroutine counterpart of retry_with_backoff(): await func() until it succeeds, waiting without blocking the event
+    loop between attempts. See retry_with_backoff() for the parameters.
+
+    Parameters
+    ----------
+    func : callable
+        coroutine function without arguments.
+
+    Returns
+    -------
+    object
+        the return value of func.
+    """
+    delay = initial_delay
+    n = 0
+    while True:
+        try:
+            return await func()
+        except exceptions:
+            n += 1
+            if attempts is not None and n >= attempts:
+                raise
+
+        await asyncio.sleep(delay)
+        delay = min(2 * delay, max_delay)
+
 
 class SocketEthernetDevice:
     def __init__(
             self,
             ip4_address,
             port,
+            terminator=None,
+            timeout=15,
+            background_connect=False,
+            socket_factory=None,
     ):
 
         """
@@ -22,49 +114,254 @@ class SocketEthernetDevice:
             The IPv4 address of the device.
         port : int
             The port number used to connect the device. Can be any number between 49152 and 65536.
+        terminator : bytes, None
+            The bytes that mark the end of every reply from the device, for example b'\n' for SCPI instruments. If
+            given, queries return as soon as the terminator arrives. If None, a query waits a fixed amount of time and
+            returns whatever was received.
+        timeout : float
+            Maximum time in seconds to wait for a complete reply, or for a single connection attempt.
+        background_connect : bool
+            If False, connect before returning and raise OSError if the device cannot be reached. If True, return
+            right away and keep trying to connect in a background thread. Use connection_state or wait_connected() to
+            know when the device is ready.
+        socket_factory : callable, None
+            function without arguments returning a new socket-like object for every connection attempt. Used to record
+            or replay the traffic with the device (see traffic_replay.py). If None, use a TCP socket.
         """
 
         self._ip4_address = ip4_address
         self._port = port
+        self._terminator = terminator
+        self._timeout = timeout
         self._socket = None
         self._is_connected = False
+        self._rx_buffer = bytearray()
+        self._stale = False  # True after a query timed out: its late reply may still arrive, see _drain()
+        self._quiet_until = 0.0  # time.monotonic() before which nothing may be sent, see _command()
+        self._lock = threading.RLock()
+        self._connection_state = 'disconnected'
+        self._connected_event = threading.Event()
+        self._has_connected = False
+        self._stats = get_device_stats(type(self).__name__ + '@' + str(ip4_address) + ':' + str(port))
+        self._socket_factory = socket_factory
 
-        self.connect()
+        if background_connect:
+            self.connect_in_background()
+        else:
+            self.connect()
 
-    def _query(self, qry):
+    @classmethod
+    def shared(cls, ip4_address, port=None, **kwargs):
         """
-        send a query to the ethernet device and receive a response.
+        Get the session to the device at ip4_address that is shared by everything in this program, creating it on
+        first use. Use this instead of creating the object directly whenever more than one part of the program uses the
+        same physical device, such as two HeaterAssembly objects on the two channels of the same power supply. Only one
+        connection is opened per device.
 
         Parameters
         ----------
-        qry : bytes
-            The message to send through the socket connection.
+        ip4_address : str
+            The IPv4 address of the device.
+        port : int, None
+            The port number used to connect the device. If None, use the default port of the class.
+        **kwargs
+            Other parameters of the class. Only used when the session is created.
+
+        Returns
+        -------
+        SocketEthernetDevice
+            The shared object of class cls.
+        """
+        return device_registry.get(cls, ip4_address, port, **kwargs)
+
+    def _settle(self, seconds):
+        """
+        Wait for the device to settle between exchanges. Skipped behind sockets with a settle_scale of 0, like the
+        replay sockets of traffic_replay.py, so that recordings replay at full speed.
+        """
+        scale = getattr(self._socket, 'settle_scale', 1.0)
+        if scale:
+            time.sleep(seconds * scale)
+
+    def _wait_quiet(self):
+        """
+        Wait until the device has settled after the last command sent on this session, so that the next message is not
+        merged with it: unterminated commands are only told apart by the pause that follows them. Called with the lock
+        held, just before sending.
+        """
+        remaining = self._quiet_until - time.monotonic()
+        if remaining > 0:
+            time.sleep(remaining)
+
+    def _read_reply(self, deadline, keep_partial=False):
+        """
+        Receive bytes from the socket until a full reply, ending with the terminator, is available. Replies split
+        across several packets are joined together. Bytes received after the terminator are kept for the next reply.
+
+        Parameters
+        ----------
+        deadline : float
+            time.monotonic() value after which to stop waiting for the reply.
+        keep_partial : bool
+            If True, keep a partial reply on timeout, so that the next call completes it. Used for streams, where the
+            deadline is only a polling interval. If False, a partial reply is the late answer to a query that already
+            failed: it is discarded, and the session is marked stale so that the rest of it is drained before the next
+            query.
 
         Returns
         -------
         bytes
-            Returns the raw reply of the ethernet device as bytes.
+            The reply, including the terminator.
 
         Raises
         ------
-        OSError
-            If there is an error with the socket object, raise OSError. Might be fixed by using self.connect()
+        socket.timeout
+            If the deadline passes before the terminator arrives.
+        ConnectionError
+            If the device closes the connection.
         """
+        term = self._terminator
+        start = 0
+        while True:
+            idx = self._rx_buffer.find(term, start)
+            if idx != -1:
+                end = idx + len(term)
+                reply = bytes(self._rx_buffer[:end])
+                del self._rx_buffer[:end]
+                return reply
+
+            start = max(len(self._rx_buffer) - len(term) + 1, 0)
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                if not keep_partial:
+                    self._rx_buffer.clear()
+                    self._stale = True
+                raise socket.timeout('reply terminator not received')
+
+            self._socket.settimeout(remaining)
+            try:
+                chunk = self._socket.recv(4096)
+            except socket.timeout:
+                if not keep_partial:
+                    self._rx_buffer.clear()
+                    self._stale = True
+                raise
+            if not chunk:
+                raise ConnectionError('connection closed by device')
+            self._rx_buffer += chunk
 
+    def _drain(self):
+        """
+        Discard whatever the device sent after a query timed out, without waiting, so that the late reply is not read
+        as the answer to the next query. Does nothing unless the session is stale. Called with the lock held.
+        """
+        if not self._stale:
+            return
+        self._socket.settimeout(0)
         try:
-            self._socket.sendall(qry)
-            time.sleep(0.3)
-            self._socket.settimeout(15)
-            reply = self._socket.recv(4096)
-            time.sleep(0.3)
-        except TimeoutError:
-            return 'ERROR: No response from device for query ' + str(qry)
-        except OSError:
-            return 'ERROR: Query not sent. Try using the connect() method first.'
+            while self._socket.recv(4096):
+                pass
+        except (BlockingIOError, InterruptedError, socket.timeout):
+            pass
+        self._rx_buffer.clear()
+        self._stale = False
+
+    def _query(self, qry):
+        """
+        send a query to the ethernet device and receive a response. If the device has a reply terminator, return as
+        soon as the full reply has arrived.
+
+        Parameters
+        ----------
+        qry : bytes
+            The message to send through the socket connection.
+
+        Returns
+        -------
+        bytes
+            Returns the raw reply of the ethernet device as bytes.
+        str
+            If there is no reply before the timeout, or the socket is not connected, return an error string. Might be
+            fixed by using self.connect()
+        """
 
+        with self._lock:
+            t0 = time.perf_counter()
+            try:
+                self._drain()
+                self._wait_quiet()
+                self._socket.sendall(qry)
+                if self._terminator is None:
+                    self._settle(0.3)
+                    self._socket.settimeout(self._timeout)
+                    reply = self._socket.recv(4096)
+                    self._settle(0.3)
+                else:
+                    reply = self._read_reply(time.monotonic() + self._timeout)
+            except socket.timeout:
+                self._stats.record(command_mnemonic(qry), time.perf_counter() - t0, len(qry), timeout=True)
+                return 'ERROR: No response from device for query ' + str(qry)
+            except ConnectionError:
+                self._stats.record(command_mnemonic(qry), time.perf_counter() - t0, len(qry), error=True)
+                return 'ERROR: Connection closed by device. Try using the connect() method first.'
+            except (OSError, AttributeError):
+                self._stats.record(command_mnemonic(qry), time.perf_counter() - t0, error=True)
+                return 'ERROR: Query not sent. Try using the connect() method first.'
+            self._stats.record(command_mnemonic(qry), time.perf_counter() - t0, len(qry), len(reply))
 
         return reply
 
+    def _query_batch(self, qry, n_replies, separator=b';'):
+        """
+        send a message containing several queries and receive the replies to all of them in a single round trip. The
+        device may answer with all the replies in one line separated by the separator, or with one line per query.
+
+        Parameters
+        ----------
+        qry : bytes
+            The message containing all the queries. Dependent on each individual device.
+        n_replies : int
+            Number of replies expected, usually the number of queries in qry.
+        separator : bytes
+            The bytes separating the replies inside a single line.
+
+        Returns
+        -------
+        list of bytes
+            The reply to each query, in order, without separators or terminators.
+        str
+            If there is no complete reply before the timeout, or the socket is not connected, return an error string.
+        """
+        if self._terminator is None:
+            return 'ERROR: batch queries need a reply terminator.'
+
+        with self._lock:
+            t0 = time.perf_counter()
+            received = 0
+            try:
+                self._drain()
+                self._wait_quiet()
+                self._socket.sendall(qry)
+                deadline = time.monotonic() + self._timeout
+                replies = []
+                while len(replies) < n_replies:
+                    line = self._read_reply(deadline)
+                    received += len(line)
+                    line = line[:-len(self._terminator)]
+                    replies += [part.strip() for part in line.split(separator)]
+            except socket.timeout:
+                self._stats.record(command_mnemonic(qry), time.perf_counter() - t0, len(qry), received, timeout=True)
+                return 'ERROR: No response from device for query ' + str(qry)
+            except ConnectionError:
+                self._stats.record(command_mnemonic(qry), time.perf_counter() - t0, len(qry), received, error=True)
+                return 'ERROR: Connection closed by device. Try using the connect() method first.'
+            except (OSError, AttributeError):
+                self._stats.record(command_mnemonic(qry), time.perf_counter() - t0, error=True)
+                return 'ERROR: Query not sent. Try using the connect() method first.'
+            self._stats.record(command_mnemonic(qry), time.perf_counter() - t0, len(qry), received)
+
+        return replies
+
     def _command(self, cmd):
         """
         send a command to the ethernet device. Does not receive any response.
@@ -80,11 +377,19 @@ class SocketEthernetDevice:
             Returns None if the command is succesfully sent.
         """
 
-        try:
-            out = self._socket.sendall(cmd)
-            time.sleep(0.3)
-        except OSError:
-            return 'ERROR: Socket not found. Command not sent. Try using the connect() method first.'
+        with self._lock:
+            t0 = time.perf_counter()
+            try:
+                self._wait_quiet()
+                out = self._socket.sendall(cmd)
+            except (OSError, AttributeError):
+                self._stats.record(command_mnemonic(cmd), time.perf_counter() - t0, error=True)
+                return 'ERROR: Socket not found. Command not sent. Try using the connect() method first.'
+            self._stats.record(command_mnemonic(cmd), time.perf_counter() - t0, len(cmd))
+            # the device needs a pause after a command before the next message. The next sender on this session waits
+            # for it in _wait_quiet(); nobody holds the lock meanwhile, so the other channel of a supply is not blocked
+            # by a command that has nothing more to send
+            self._quiet_until = time.monotonic() + 0.3 * getattr(self._socket, 'settle_scale', 1.0)
 
         return out
 
@@ -110,6 +415,30 @@ class SocketEthernetDevice:
     #     else:
     #         raise AttributeError('ERROR: port cannot be changed while connection is on.')
 
+    @property
+    def terminator(self):
+        return self._terminator
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    @property
+    def lock(self):
+        """
+        Re-entrant lock held during every exchange with the device. Hold it with 'with device.lock:' to run several
+        queries and commands without other threads interleaving their own.
+        """
+        return self._lock
+
+    @property
+    def stats(self):
+        """
+        DeviceStats with the latency, bytes, timeouts, and reconnects of every exchange with the device. Shared by all
+        the objects talking to the same address and port.
+        """
+        return self._stats
+
     @property
     def idn(self):
         """
@@ -122,10 +451,43 @@ class SocketEthernetDevice:
         """
         pass
 
-    def connect(self):
+    @property
+    def connection_state(self):
         """
-        Establish socket connection to the ip address of the current SocketEthernetDevice. Attempt to connect 10
-        times before raising an error.
+        One of 'disconnected', 'connecting', 'connected', or 'failed'. Queries and commands only work when the state is
+        'connected'.
+        """
+        return self._connection_state
+
+    @property
+    def is_connected(self):
+        return self._connection_state == 'connected'
+
+    def _on_connect(self, first):
+        """
+        Placeholder for setup that has to run every time the connection is established, before the device is marked
+        as connected. Models that need to talk to the device on startup should re-write it.
+
+        Parameters
+        ----------
+        first : bool
+            True the first time this object connects to the device.
+        """
+        pass
+
+    def connect(self, attempts=11, initial_delay=0.1, max_delay=5):
+        """
+        Establish socket connection to the ip address of the current SocketEthernetDevice. If an attempt fails, wait
+        and try again. The wait doubles after every failed attempt, up to max_delay.
+
+        Parameters
+        ----------
+        attempts : int, None
+            Maximum number of attempts before raising an error. If None, keep trying until the device answers.
+        initial_delay : float
+            wait in seconds after the first failed attempt.
+        max_delay : float
+            longest wait in seconds between attempts.
 
         Returns
         -------
@@ -135,34 +497,494 @@ class SocketEthernetDevice:
         Raises
         ------
         OSError
-            If 10 attempts to connect fail, raise OSError.
+            If all the attempts to connect fail, raise OSError.
         """
-        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._connection_state = 'connecting'
+        self._connected_event.clear()
+        failures = []
+
+        def attempt():
+            if self._socket_factory is None:
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            else:
+                sock = self._socket_factory()
+            sock.settimeout(self._timeout)
+            try:
+                sock.connect((self._ip4_address, self._port))
+            except OSError:
+                sock.close()
+                if not failures:
+                    print('Failed to connect to', self._ip4_address, 'Reattempting...')
+                failures.append(1)
+                raise
+            return sock
+
         try:
-            sock.connect((self._ip4_address, self._port))
+            sock = retry_with_backoff(attempt, attempts, initial_delay, max_delay)
+        except OSError:
+            self._stats.record_connect(False, len(failures))
+            self._connection_state = 'failed'
+            raise OSError('ERROR: Could not connect to' + str(self._ip4_address))
+
+        self._stats.record_connect(self._has_connected, len(failures))
+        with self._lock:
             self._socket = sock
             self._is_connected = True
+            self._rx_buffer.clear()
+            self._stale = False
             print('Connection to', self._ip4_address, 'was succesful.')
-            return
-        except OSError:
-            print('Failed to connect. Reattempting...')
-            for i in range(10):
-                try:
-                    sock.connect((self._ip4_address, self._port))
-                    self._socket = sock
-                    self._is_connected = True
-                    print('Connection to', self._ip4_address, 'was succesful.')
-                    return
-                except OSError:
-                    print('attempt', i+1, 'failed')
-                    continue
-        raise OSError('ERROR: Could not connect to' + str(self._ip4_address))
+            self._on_connect(not self._has_connected)
+            self._has_connected = True
+        self._connection_state = 'connected'
+        self._connected_event.set()
+
+    def connect_in_background(self, attempts=None, initial_delay=0.5, max_delay=30):
+        """
+        Start connecting to the device in a background thread and return right away. See connect() for the
+        parameters. If all attempts fail, connection_state is set to 'failed'.
+
+        Returns
+        -------
+        threading.Thread
+            The thread running connect().
+        """
+        def run():
+            try:
+                self.connect(attempts, initial_delay, max_delay)
+            except OSError as err:
+                print(err)
+
+        self._connection_state = 'connecting'
+        thread = threading.Thread(target=run, name='connect ' + str(self._ip4_address), daemon=True)
+        thread.start()
+        return thread
+
+    def wait_connected(self, timeout=None):
+        """
+        Wait until the device is connected.
+
+        Parameters
+        ----------
+        timeout : float, None
+            Maximum time to wait in seconds. If None, wait forever.
+
+        Returns
+        -------
+        bool
+            True if the device is connected.
+        """
+        return self._connected_event.wait(timeout)
 
     def disconnect(self):
         """
         Close socket connection.
         """
-        self._socket.close()
+        with self._lock:
+            self._socket.close()
+            self._is_connected = False
+            self._connection_state = 'disconnected'
+            self._connected_event.clear()
+
+
+class DeviceRegistry:
+    def __init__(self):
+        """
+        Hands out a single session per physical device, keyed by IPv4 address and port. Every part of the program
+        that asks for the same device gets the same object, so only one connection is opened and all the exchanges
+        with the device are serialized by its lock.
+        """
+        self._lock = threading.Lock()
+        self._devices = {}
+        self._creation_locks = {}
+
+    @staticmethod
+    def _default_port(cls):
+        try:
+            return inspect.signature(cls.__init__).parameters['port'].default
+        except KeyError:
+            return None
+
+    def get(self, cls, ip4_address, port=None, **kwargs):
+        """
+        Get the session to a device, creating it on first use. Devices are created outside the registry lock, so a
+        slow connection to one device does not hold up requests for other devices.
+
+        Parameters
+        ----------
+        cls : type
+            class of the device. Usually a subclass of SocketEthernetDevice.
+        ip4_address : str
+            The IPv4 address of the device.
+        port : int, None
+            The port number used to connect the device. If None, use the default port of cls.
+        **kwargs
+            Other parameters of cls. Only used when the session is created.
+
+        Returns
+        -------
+        object
+            The shared instance of cls.
+
+        Raises
+        ------
+        TypeError
+            If the device was already registered with a different class.
+        """
+        if port is None:
+            port = self._default_port(cls)
+        key = (ip4_address, port)
+
+        with self._lock:
+            creation_lock = self._creation_locks.setdefault(key, threading.Lock())
+
+        with creation_lock:
+            with self._lock:
+                device = self._devices.get(key)
+            if device is None:
+                if port is inspect.Parameter.empty or port is None:
+                    device = cls(ip4_address, **kwargs)
+                else:
+                    device = cls(ip4_address, port=port, **kwargs)
+                with self._lock:
+                    self._devices[key] = device
+
+        if not isinstance(device, cls):
+            raise TypeError('ERROR: device at ' + str(key) + ' is already registered as ' + type(device).__name__)
+        return device
+
+    def release(self, device):
+        """
+        Remove a device from the registry and disconnect it.
+
+        Parameters
+        ----------
+        device : SocketEthernetDevice
+            A device handed out by this registry.
+        """
+        with self._lock:
+            for key, dev in list(self._devices.items()):
+                if dev is device:
+                    del self._devices[key]
+        device.disconnect()
+
+    def close_all(self):
+        """
+        Disconnect every registered device and empty the registry.
+        """
+        with self._lock:
+            devices = list(self._devices.values())
+            self._devices.clear()
+        for device in devices:
+            device.disconnect()
+
+    @property
+    def devices(self):
+        with self._lock:
+            return dict(self._devices)
+
+
+device_registry = DeviceRegistry()
+
+
+class AsyncSocketEthernetDevice:
+    def __init__(
+            self,
+            ip4_address,
+            port,
+            terminator=None,
+            timeout=15,
+    ):
+        """
+        An ethernet-controlled device driven by an asyncio event loop. This is the asyncio counterpart of
+        SocketEthernetDevice: a single event loop can talk to many devices concurrently instead of blocking on each
+        socket in turn. The connection is not opened on creation. Use 'await device.connect()' or
+        'async with device:'.
+
+        Parameters
+        ----------
+        ip4_address : str
+            The IPv4 address of the device.
+        port : int
+            The port number used to connect the device. Can be any number between 49152 and 65536.
+        terminator : bytes, None
+            The bytes that mark the end of every reply from the device. If None, a query waits a fixed amount of time
+            and returns whatever was received.
+        timeout : float
+            Maximum time in seconds to wait for a complete reply.
+        """
+        self._ip4_address = ip4_address
+        self._port = port
+        self._terminator = terminator
+        self._timeout = timeout
+        self._reader = None
+        self._writer = None
+        self._lock = None
+        self._stale = False  # True after a reply timed out or overflowed, see _drain()
+        self._quiet_until = 0.0  # time.monotonic() before which nothing may be sent, see _command()
+        self._is_connected = False
+        self._has_connected = False
+        self._stats = get_device_stats(type(self).__name__ + '@' + str(ip4_address) + ':' + str(port))
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.disconnect()
+
+    async def _read_reply(self):
+        """
+        Wait for the next full reply from the device.
+
+        Returns
+        -------
+        bytes
+            The reply, including the terminator.
+
+        Raises
+        ------
+        asyncio.TimeoutError
+            If the full reply does not arrive before the timeout.
+        asyncio.LimitOverrunError
+            If the reply is longer than the buffer limit of the stream.
+        ConnectionError
+            If the device closes the connection.
+        """
+        try:
+            if self._terminator is None:
+                await asyncio.sleep(0.3)
+                return await asyncio.wait_for(self._reader.read(4096), self._timeout)
+            return await asyncio.wait_for(self._reader.readuntil(self._terminator), self._timeout)
+        except asyncio.IncompleteReadError:
+            raise ConnectionError('connection closed by device')
+        except (asyncio.TimeoutError, asyncio.LimitOverrunError):
+            self._stale = True  # the rest of the reply would be read as the next one
+            raise
+
+    async def _drain(self):
+        """
+        Discard whatever is left of a reply that timed out or overflowed, and whatever the device sends shortly after,
+        so that it is not read as the answer to the next query. Does nothing unless the session is stale. Called with
+        the lock held.
+        """
+        if not self._stale:
+            return
+        try:
+            while await asyncio.wait_for(self._reader.read(4096), 0.01):
+                pass
+        except asyncio.TimeoutError:
+            pass
+        self._stale = False
+
+    async def _wait_quiet(self):
+        """
+        Wait until the device has settled after the last command, see SocketEthernetDevice._wait_quiet(). Called with
+        the lock held, just before sending.
+        """
+        remaining = self._quiet_until - time.monotonic()
+        if remaining > 0:
+            await asyncio.sleep(remaining)
+
+    async def _query(self, qry):
+        """
+        send a query to the ethernet device and wait for the response without blocking the event loop. Queries to the
+        same device are sent one at a time so that every reply is matched to its query.
+
+        Parameters
+        ----------
+        qry : bytes
+            The message to send through the socket connection.
+
+        Returns
+        -------
+        bytes
+            Returns the raw reply of the ethernet device as bytes.
+        str
+            If there is no reply before the timeout, or the device is not connected, return an error string.
+        """
+        if not self._is_connected:
+            return 'ERROR: Query not sent. Try using the connect() method first.'
+
+        async with self._lock:
+            t0 = time.perf_counter()
+            try:
+                await self._drain()
+                await self._wait_quiet()
+                self._writer.write(qry)
+                await self._writer.drain()
+                reply = await self._read_reply()
+            except asyncio.TimeoutError:
+                self._stats.record(command_mnemonic(qry), time.perf_counter() - t0, len(qry), timeout=True)
+                return 'ERROR: No response from device for query ' + str(qry)
+            except asyncio.LimitOverrunError:
+                self._stats.record(command_mnemonic(qry), time.perf_counter() - t0, len(qry), error=True)
+                return 'ERROR: Reply from device too long for query ' + str(qry)
+            except ConnectionError:
+                self._stats.record(command_mnemonic(qry), time.perf_counter() - t0, len(qry), error=True)
+                return 'ERROR: Connection closed by device. Try using the connect() method first.'
+            except OSError:
+                self._stats.record(command_mnemonic(qry), time.perf_counter() - t0, error=True)
+                return 'ERROR: Query not sent. Try using the connect() method first.'
+            self._stats.record(command_mnemonic(qry), time.perf_counter() - t0, len(qry), len(reply))
+            return reply
+
+    async def _query_batch(self, qry, n_replies, separator=b';'):
+        """
+        send a message containing several queries and receive the replies to all of them in a single round trip. See
+        SocketEthernetDevice._query_batch().
+
+        Returns
+        -------
+        list of bytes
+            The reply to each query, in order, without separators or terminators.
+        str
+            If there is no complete reply before the timeout, or the device is not connected, return an error string.
+        """
+        if self._terminator is None:
+            return 'ERROR: batch queries need a reply terminator.'
+        if not self._is_connected:
+            return 'ERROR: Query not sent. Try using the connect() method first.'
+
+        async with self._lock:
+            t0 = time.perf_counter()
+            received = 0
+            try:
+                await self._drain()
+                await self._wait_quiet()
+                self._writer.write(qry)
+                await self._writer.drain()
+                replies = []
+                while len(replies) < n_replies:
+                    line = await self._read_reply()
+                    received += len(line)
+                    line = line[:-len(self._terminator)]
+                    replies += [part.strip() for part in line.split(separator)]
+            except asyncio.TimeoutError:
+                self._stats.record(command_mnemonic(qry), time.perf_counter() - t0, len(qry), received, timeout=True)
+                return 'ERROR: No response from device for query ' + str(qry)
+            except asyncio.LimitOverrunError:
+                self._stats.record(command_mnemonic(qry), time.perf_counter() - t0, len(qry), received, error=True)
+                return 'ERROR: Reply from device too long for query ' + str(qry)
+            except ConnectionError:
+                self._stats.record(command_mnemonic(qry), time.perf_counter() - t0, len(qry), received, error=True)
+                return 'ERROR: Connection closed by device. Try using the connect() method first.'
+            except OSError:
+                self._stats.record(command_mnemonic(qry), time.perf_counter() - t0, error=True)
+                return 'ERROR: Query not sent. Try using the connect() method first.'
+            self._stats.record(command_mnemonic(qry), time.perf_counter() - t0, len(qry), received)
+
+        return replies
+
+    async def _command(self, cmd):
+        """
+        send a command to the ethernet device. Does not receive any response.
+
+        Parameters
+        ----------
+        cmd : bytes
+            Python btyes containing the command. Dependent on each individual device.
+
+        Returns
+        -------
+        None
+            Returns None if the command is succesfully sent.
+        str
+            Else, return error string.
+        """
+        if not self._is_connected:
+            return 'ERROR: Socket not found. Command not sent. Try using the connect() method first.'
+
+        async with self._lock:
+            t0 = time.perf_counter()
+            try:
+                await self._wait_quiet()
+                self._writer.write(cmd)
+                await self._writer.drain()
+            except OSError:
+                self._stats.record(command_mnemonic(cmd), time.perf_counter() - t0, error=True)
+                return 'ERROR: Socket not found. Command not sent. Try using the connect() method first.'
+            self._stats.record(command_mnemonic(cmd), time.perf_counter() - t0, len(cmd))
+            # the next message waits for the device to settle, see _wait_quiet()
+            self._quiet_until = time.monotonic() + 0.3
+
+    @property
+    def ip4_address(self):
+        return self._ip4_address
+
+    @property
+    def port(self):
+        return self._port
+
+    @property
+    def terminator(self):
+        return self._terminator
+
+    @property
+    def timeout(self):
+        return self._timeout
+
+    @property
+    def is_connected(self):
+        return self._is_connected
+
+    @property
+    def stats(self):
+        return self._stats
+
+    async def connect(self, attempts=11, initial_delay=0.1, max_delay=5):
+        """
+        Open the connection to the ip address of the device. If an attempt fails, wait and try again. The wait doubles
+        after every failed attempt, up to max_delay, as in SocketEthernetDevice.connect().
+
+        Parameters
+        ----------
+        attempts : int, None
+            Maximum number of attempts before raising an error. If None, keep trying until the device answers.
+        initial_delay : float
+            wait in seconds after the first failed attempt.
+        max_delay : float
+            longest wait in seconds between attempts.
+
+        Raises
+        ------
+        OSError
+            If all the attempts to connect fail, raise OSError.
+        """
+        failures = []
+
+        async def attempt():
+            try:
+                return await asyncio.wait_for(asyncio.open_connection(self._ip4_address, self._port), self._timeout)
+            except (OSError, asyncio.TimeoutError):
+                if not failures:
+                    print('Failed to connect to', self._ip4_address, 'Reattempting...')
+                failures.append(1)
+                raise
+
+        try:
+            self._reader, self._writer = await async_retry_with_backoff(
+                attempt, attempts, initial_delay, max_delay, (OSError, asyncio.TimeoutError))
+        except (OSError, asyncio.TimeoutError):
+            self._stats.record_connect(False, len(failures))
+            raise OSError('ERROR: Could not connect to' + str(self._ip4_address))
+
+        self._lock = asyncio.Lock()
+        self._stale = False
+        self._is_connected = True
+        self._stats.record_connect(self._has_connected, len(failures))
+        self._has_connected = True
+        print('Connection to', self._ip4_address, 'was succesful.')
+
+    async def disconnect(self):
+        """
+        Close the connection.
+        """
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except OSError:
+                pass
         self._is_connected = False
 
 #
@@ -0,0 +1,397 @@
+"""
+Simulated temperature DAQ for running HeaterAssembly and pid_controller_server.py without MCC hardware or the MCC
+libraries. SimulatedDaq has the same temperature API as MccDeviceLinux and MccDeviceWindows (get_temp, get_temp_scan,
+thermocouple types, and units). Its readings come from ThermalPlant, a lumped thermal model of all the channels at once
+heated by the power of (simulated) power supplies.
+
+    sim = SupplySimulator('spd3303x', load_resistance=20).start()
+    ps = Spd3303x(*sim.address)
+    plant = ThermalPlant(n_nodes=8)
+    plant.add_heater(0, supply_power(sim, 1))  # channel 1 of the supply heats thermocouple channel 0
+    daq = SimulatedDaq(plant)
+    asm = HeaterAssembly((ps, 1), (daq, 0))
+"""
+import math
+import threading
+import time
+
+import numpy as np
+
+
+class ThermalPlant:
+    def __init__(
+            self,
+            n_nodes=8,
+            heat_capacity=200.0,
+            ambient_resistance=2.0,
+            coupling=None,
+            ambient_temp=25.0,
+            noise=0.02,
+            time_scale=1.0,
+            max_step=0.05,
+    ):
+        """
+        Lumped thermal model of n_nodes bodies, one per DAQ channel. Every node has a heat capacity, loses heat to the
+        ambient through a thermal resistance, exchanges heat with the other nodes, and is heated by the power of its
+        heaters:
+
+            C_i dT_i/dt = P_i - (T_i - T_ambient) / R_i - sum_j G_ij (T_i - T_j)
+
+        All the nodes are advanced together with numpy, so the cost of a reading does not depend on how many channels
+        are read.
+
+        Parameters
+        ----------
+        n_nodes : int
+            number of bodies.
+        heat_capacity : float, array_like
+            heat capacity of every node in J/K.
+        ambient_resistance : float, array_like
+            thermal resistance between every node and the ambient in K/W.
+        coupling : array_like, None
+            n_nodes x n_nodes matrix of thermal conductances between nodes in W/K. None for no coupling.
+        ambient_temp : float
+            ambient temperature in Celsius. All the nodes start at this temperature.
+        noise : float
+            standard deviation in Celsius of the noise added to every reading.
+        time_scale : float
+            simulated seconds per real second. Larger values make the oven heat up faster.
+        max_step : float
+            longest integration step in simulated seconds.
+        """
+        self._n = n_nodes
+        self._capacity = np.broadcast_to(np.asarray(heat_capacity, dtype=float), (n_nodes,)).copy()
+        self._g_ambient = 1 / np.broadcast_to(np.asarray(ambient_resistance, dtype=float), (n_nodes,))
+        if coupling is None:
+            self._laplacian = np.zeros((n_nodes, n_nodes))
+        else:
+            g = np.asarray(coupling, dtype=float)
+            self._laplacian = np.diag(g.sum(axis=1)) - g
+        self.ambient_temp = ambient_temp
+        self.noise = noise
+        self.time_scale = time_scale
+        self._max_step = max_step
+        self._temps = np.full(n_nodes, float(ambient_temp))
+        self._heaters = []  # (node, callable returning watts)
+        self._lock = threading.Lock()
+        self._last = time.monotonic()
+        self._rng = np.random.default_rng()
+
+    @property
+    def n_nodes(self):
+        return self._n
+
+    def add_heater(self, node, power):
+        """
+        Heat a node with the power returned by a function.
+
+        Parameters
+        ----------
+        node : int
+            node heated, usually the DAQ channel of the heater's thermocouple.
+        power : callable
+            function without arguments returning the heater power in W. See supply_power().
+        """
+        if not 0 <= node < self._n:
+            raise ValueError('node ' + str(node) + ' not valid. The plant has ' + str(self._n) + ' nodes.')
+        with self._lock:
+            self._heaters.append((node, power))
+
+    def set_temperatures(self, temps):
+        with self._lock:
+            self._temps[:] = temps
+            self._last = time.monotonic()
+
+    def _power(self):
+        power = np.zeros(self._n)
+        for node, source in self._heaters:
+            try:
+                power[node] += max(float(source()), 0.0)
+            except (TypeError, ValueError):  # a supply returning an error string does not heat
+                pass
+        return power
+
+    def step(self, dt, power=None):
+        """
+        Advance the model dt simulated seconds with constant heater power.
+
+        Parameters
+        ----------
+        dt : float
+            simulated seconds.
+        power : array_like, None
+            power of every node in W. If None, ask the heaters.
+        """
+        if power is None:
+            power = self._power()
+        n_steps = max(int(math.ceil(dt / self._max_step)), 1)
+        h = dt / n_steps
+        temps = self._temps
+        for i in range(n_steps):
+            flow = power - self._g_ambient * (temps - self.ambient_temp) - self._laplacian @ temps
+            temps = temps + h * flow / self._capacity
+        self._temps = temps
+
+    def advance(self):
+        """
+        Advance the model up to the current time.
+
+        Returns
+        -------
+        numpy.ndarray
+            temperature of every node in Celsius, without noise.
+        """
+        with self._lock:
+            now = time.monotonic()
+            dt = (now - self._last) * self.time_scale
+            self._last = now
+            if dt > 0:
+                self.step(dt)
+            return self._temps.copy()
+
+    def read(self, nodes=None):
+        """
+        Advance the model and read the temperature of some nodes, with noise.
+
+        Parameters
+        ----------
+        nodes : slice, list of int, None
+            nodes to read. None for all of them.
+
+        Returns
+        -------
+        numpy.ndarray
+            temperatures in Celsius.
+        """
+        temps = self.advance()
+        if nodes is not None:
+            temps = temps[nodes]
+        if self.noise:
+            temps = temps + self._rng.normal(0, self.noise, np.shape(temps))
+        return temps
+
+
+def supply_power(supply, channel):
+    """
+    Function returning the power delivered by a power supply channel, to be used with ThermalPlant.add_heater().
+
+    Parameters
+    ----------
+    supply : SupplySimulator, PowerSupply
+        a SupplySimulator is read directly, without going through the network. Any other power supply is queried with
+        get_actual_voltage() and get_actual_current().
+    channel : int
+        channel of the power supply, starting from 1.
+
+    Returns
+    -------
+    callable
+        function without arguments returning the power in W.
+    """
+    if hasattr(supply, 'channels'):
+        def power():
+            volts, amps, _ = supply.channels[channel - 1].measure()
+            return volts * amps
+    else:
+        def power():
+            return supply.get_actual_voltage(channel) * supply.get_actual_current(channel)
+    return power
+
+
+class SimulatedDaq:
+    # Seebeck coefficients in V/K used to turn temperatures into thermocouple voltages.
+    seebeck = {'J': 52e-6, 'K': 41e-6, 'T': 43e-6, 'E': 68e-6, 'R': 10e-6, 'S': 10e-6, 'B': 6e-6, 'N': 39e-6}
+
+    def __init__(self, plant=None, default_units='celsius', ip4_address='127.0.0.1', tc_types=None, latency=0.0):
+        """
+        Drop-in replacement for MccDeviceLinux and MccDeviceWindows as the temperature DAQ of a HeaterAssembly.
+
+        Parameters
+        ----------
+        plant : ThermalPlant, None
+            model giving the temperature of every channel. If None, a ThermalPlant with 8 nodes is created.
+        default_units : {'c', 'celsius', 'f', 'fahrenheit', 'k', 'kelvin', 'v', 'volts', 'r', 'raw'}
+            default units to use for temperature measurements
+        ip4_address : str
+            address reported by ip4_address. Only used for display.
+        tc_types : list of str, None
+            thermocouple type of every channel. Defaults to 'K' for all channels.
+        latency : float
+            time in seconds every reading takes, to mimic the DAQ.
+        """
+        if plant is None:
+            plant = ThermalPlant()
+        self._plant = plant
+        self._ip4_address = ip4_address
+        self._latency = latency
+        if tc_types is None:
+            tc_types = ['K'] * plant.n_nodes
+        self._tc_types = [tc.upper() for tc in tc_types]
+        self._default_units = None
+        self.default_units = default_units
+
+    @property
+    def plant(self):
+        return self._plant
+
+    def _convert(self, temps, channels, units):
+        units = units.lower()
+        if units in ('c', 'celsius'):
+            return temps
+        if units in ('f', 'fahrenheit'):
+            return temps * 9 / 5 + 32
+        if units in ('k', 'kelvin'):
+            return temps + 273.15
+        coefficients = np.array([self.seebeck[self._tc_types[ch]] for ch in channels])
+        return temps * coefficients  # 'v', 'volts', 'r', and 'raw': thermocouple voltage referenced to 0 C
+
+    def check_valid_units(self, units):
+        """
+        See MccDeviceLinux.check_valid_units()
+        """
+        if units is None:
+            return
+        elif type(units) is not str:
+            return 'ERROR: input type should be string. Type ' + str(type(units)) + ' not supported.'
+
+        units_set = {'c', 'celsius', 'f', 'fahrenheit', 'k', 'kelvin', 'r', 'raw', 'v', 'volts', 'voltage'}
+
+        if units.lower() not in units_set:
+            return 'ERROR: units ' + str(units) + ' not supported'
+
+    def check_valid_temp_channel(self, channel):
+        """
+        See MccDeviceLinux.check_valid_temp_channel()
+        """
+        if type(channel) is not int:
+            return 'ERROR: channel input must be int. type ' + str(type(channel)) + ' not supported.'
+
+        if not (0 <= channel < self.number_temp_channels):
+            return 'ERROR: channel ' + str(channel) + ' not valid. This unit has ' + str(
+                self.number_temp_channels) + ' channels, starting from channel 0.'
+
+    def get_temp(self, channel_n=0, units=None, averaged=True):
+        """
+        Reads the temperature of a channel in the desired units.
+
+        Parameters
+        ----------
+        channel_n : int
+            the number of the channel from which to read the temperature. defaults to channel 0.
+        units : str, None
+            check docstring for self.check_valid_units for valid input units.
+        averaged : bool
+            Not used. Exists only for compatibility with MccDeviceWindows.
+
+        Returns
+        -------
+        float
+            If succesful, reading as a float in the specified units.
+        str
+            Else, return error string
+        """
+        err1 = self.check_valid_units(units)
+        if err1 is not None:
+            return err1
+        err2 = self.check_valid_temp_channel(channel_n)
+        if err2 is not None:
+            return err2
+
+        if units is None:
+            units = self._default_units
+        if self._latency:
+            time.sleep(self._latency)
+        temps = self._plant.read([channel_n])
+        return float(self._convert(temps, [channel_n], units)[0])
+
+    def get_temp_scan(self, low_channel=0, high_channel=7, units=None, averaged=True):
+        """
+        Reads the temperature of a range of channels delimited by the low_channel and the high_channel (inclusive), all
+        at once.
+
+        Returns
+        -------
+        list of float
+            The index of a value corresponds to its respective channel, starting from low_channel.
+        str
+            If an error occurs, return error string
+        """
+        err1 = self.check_valid_units(units)
+        err2 = self.check_valid_temp_channel(low_channel)
+        err3 = self.check_valid_temp_channel(high_channel)
+        if err1 is not None:
+            return err1
+        if err2 is not None:
+            return err2
+        if err3 is not None:
+            return err3
+
+        if units is None:
+            units = self._default_units
+        if self._latency:
+            time.sleep(self._latency)
+        channels = list(range(low_channel, high_channel + 1))
+        temps = self._plant.read(slice(low_channel, high_channel + 1))
+        return self._convert(temps, channels, units).tolist()
+
+    def get_temp_all_channels(self, units=None, averaged=True):
+        return self.get_temp_scan(0, self.number_temp_channels - 1, units)
+
+    def get_thermocouple_type(self, channel):
+        """
+        Returns
+        -------
+        str
+            If succesful, return TC-type as a string. Else, return an error string.
+        """
+        err = self.check_valid_temp_channel(channel)
+        if err is not None:
+            return err
+        return self._tc_types[channel]
+
+    def set_thermocouple_type(self, channel, new_tc):
+        """
+        Parameters
+        ----------
+        channel : int
+            temperature channel to set the TC-type
+        new_tc : {'j', 'k', 't', 'e', 'r', 's', 'b', 'n'}
+            Not case-sensitive.
+
+        Returns
+        -------
+        None
+            If succesful, return None
+        str
+            Else, return an error string
+        """
+        err = self.check_valid_temp_channel(channel)
+        if err is not None:
+            return err
+        if type(new_tc) is not str or new_tc.upper() not in self.seebeck:
+            return 'ERROR: TC Type ' + str(new_tc) + ' not supported'
+        self._tc_types[channel] = new_tc.upper()
+
+    @property
+    def idn(self):
+        return 'Simulated temperature DAQ'
+
+    @property
+    def ip4_address(self):
+        return str(self._ip4_address)
+
+    @property
+    def number_temp_channels(self):
+        return self._plant.n_nodes
+
+    @property
+    def default_units(self):
+        return self._default_units
+
+    @default_units.setter
+    def default_units(self, new_units):
+        err = self.check_valid_units(new_units)
+        if err is None:
+            self._default_units = new_units
+        else:
+            print(err)
@@ -2,8 +2,10 @@
 Created on Thursday, April 7, 2022
 @author: Sebastian Miki-Silva
 """
+import asyncio
 import numpy as np
 import serial
+import socket
 import time
 from serial import Serial
 from sys import platform
@@ -17,7 +19,11 @@ except ModuleNotFoundError:
 
 try:
     from connection_type import SocketEthernetDevice
+    from connection_type import AsyncSocketEthernetDevice
+    from device_stats import command_mnemonic
+    from device_stats import get_device_stats
     from device_type import PowerSupply
+    from device_type import PowerSupplySnapshot
     try:
         from device_type import MccDeviceWindows
     except (ImportError, NameError):
@@ -29,7 +35,11 @@ try:
 
 except ModuleNotFoundError:
     from automation.connection_type import SocketEthernetDevice
+    from automation.connection_type import AsyncSocketEthernetDevice
+    from automation.device_stats import command_mnemonic
+    from automation.device_stats import get_device_stats
     from automation.device_type import PowerSupply
+    from automation.device_type import PowerSupplySnapshot
     try:
         from automation.device_type import MccDeviceWindows
     except (ImportError, NameError):
@@ -40,11 +50,20 @@ except ModuleNotFoundError:
         pass
 
 
+def _settle(device, seconds):
+    """
+    Wait for a serial device to settle between exchanges. The wait is scaled by device.settle_scale, which is 0 behind
+    the replay transport of traffic_replay.py so that recordings replay at full speed.
+    """
+    if device.settle_scale:
+        time.sleep(seconds * device.settle_scale)
+
+
 # ======================================================================================================================
 # Gaussmeters
 # ======================================================================================================================
 class Gm3:
-    def __init__(self, port, tmout=3):
+    def __init__(self, port, tmout=3, serial_factory=None):
         """
         Parameters
         ----------
@@ -52,8 +71,13 @@ class Gm3:
             Device port name. Can be found on device manager. Example: COM3
         tmout : float
             read timeout in seconds. Time that read() will wait for response before exiting.
+        serial_factory : callable, None
+            called with the keyword arguments of serial.Serial and returning a serial-like object. Used to record or
+            replay the traffic with the gaussmeter (see traffic_replay.py). If None, use serial.Serial.
         """
-        self._ser = Serial(
+        if serial_factory is None:
+            serial_factory = Serial
+        self._ser = serial_factory(
             port=port,
             baudrate=115200,
             bytesize=8,
@@ -61,6 +85,8 @@ class Gm3:
             stopbits=1,
             timeout=tmout
         )
+        self.settle_scale = getattr(self._ser, 'settle_scale', 1.0)  # scales the waits between exchanges
+        self._stats = get_device_stats('Gm3@' + str(port))
 
         self.flush_buffer()
 
@@ -81,12 +107,15 @@ class Gm3:
             the stream of bytes from the gaussmeter.
         """
         for i in range(10):
+            t0 = time.perf_counter()
             self._ser.write(bytes.fromhex(qry * 6))  # only first byte matters
             out = self._ser.read(read_size)
-            time.sleep(0.01)
+            self._stats.record(qry, time.perf_counter() - t0, 6, len(out), timeout=len(out) != read_size)
+            _settle(self, 0.01)
             if len(out) == read_size:
                 return out
-            time.sleep(0.3)
+            self._stats.record_retry(qry)
+            _settle(self, 0.3)
             self.flush_buffer()
 
         return 'ERROR: could not sent query: ' + str(qry)
@@ -133,6 +162,10 @@ class Gm3:
     def flush_buffer(self):
         self._ser.write(bytes.fromhex('FF' * 6))
 
+    @property
+    def stats(self):
+        return self._stats
+
     def autozero(self):
         pass
 
@@ -196,7 +229,7 @@ class Gm3:
         i = 0
         for i in range(n):
             sum_ += self.get_zfield()
-            time.sleep(0.2)
+            _settle(self, 0.2)
             i += 1
 
         return abs(sum_ / i)
@@ -204,19 +237,19 @@ class Gm3:
     @property
     def idn(self):
         out = self._query_('01', 21)
-        time.sleep(0.05)
+        _settle(self, 0.05)
         while out[-1] != 7:
             out += self._query_('08', 21)
-            time.sleep(0.05)
+            _settle(self, 0.05)
         return str(out)
 
     @property
     def settings(self):
         out = self._query_('02', 21)
-        time.sleep(0.05)
+        _settle(self, 0.05)
         while out[-1] != 7:
             out += self._query_('08', 21)
-            time.sleep(0.05)
+            _settle(self, 0.05)
         return str(out)
 
 
@@ -283,7 +316,9 @@ class Spd3303x(SocketEthernetDevice, PowerSupply):
             port=5025,
             channel_voltage_limits=None,
             channel_current_limits=None,
-            zero_on_startup=True
+            zero_on_startup=True,
+            background_connect=False,
+            socket_factory=None,
     ):
         """
         Parameters
@@ -301,6 +336,10 @@ class Spd3303x(SocketEthernetDevice, PowerSupply):
             channel 2, and so on.
         zero_on_startup : bool
             If True, run a routine to set turn off the output of both channels and set the set
+        background_connect : bool
+            If True, return right away and keep trying to connect in the background. See SocketEthernetDevice.
+        socket_factory : callable, None
+            Used to record or replay the traffic with the power supply. See SocketEthernetDevice.
 
 
         Note that all channel voltage limits are software-based since the power supply does not have any built-in limit
@@ -313,11 +352,6 @@ class Spd3303x(SocketEthernetDevice, PowerSupply):
             'number_of_channels': 2,
         }
 
-        SocketEthernetDevice.__init__(
-            self,
-            ip4_address=ip4_address,
-            port=port
-        )
         PowerSupply.__init__(
             self,
             MAX_voltage=physical_parameters['MAX_voltage_limit'],
@@ -327,8 +361,17 @@ class Spd3303x(SocketEthernetDevice, PowerSupply):
             channel_current_limits=channel_current_limits,
             zero_on_startup=zero_on_startup,
         )
+        SocketEthernetDevice.__init__(
+            self,
+            ip4_address=ip4_address,
+            port=port,
+            terminator=b'\n',
+            background_connect=background_connect,
+            socket_factory=socket_factory,
+        )
 
-        if self._zero_on_startup:
+    def _on_connect(self, first):
+        if first and self._zero_on_startup:
             self.zero_all_channels()
 
     def _query_(self, qry):
@@ -357,6 +400,27 @@ class Spd3303x(SocketEthernetDevice, PowerSupply):
         """
         return self._command(cmd.encode('utf-8'))
 
+    def _query_batch_(self, qrys):
+        """
+        Send several queries in a single message, separated by ';', and receive all the replies in one round trip.
+
+        Parameters
+        ----------
+        qrys : list of str
+            The queries to send. Check manual for valid queries.
+
+        Returns
+        -------
+        list of str
+            The reply to each query, in the same order as qrys.
+        str
+            If an error occurs, return the error string
+        """
+        out = self._query_batch(';'.join(qrys).encode('utf-8'), len(qrys))
+        if type(out) is str:
+            return out
+        return [reply.decode('utf-8') for reply in out]
+
     # Methods
     # -------
     def get_channel_state(self, channel):
@@ -558,6 +622,61 @@ class Spd3303x(SocketEthernetDevice, PowerSupply):
         qry = 'measure:current? ' + 'CH' + str(channel)
         return float(self._query_(qry))
 
+    def get_snapshot(self):
+        """
+        Query the setpoints, actual readings, and output states of both channels in a single round trip. The channel
+        states are taken from the system status, as in get_channel_state().
+
+        Returns
+        -------
+        PowerSupplySnapshot
+            If succesful, return the snapshot of both channels.
+        str
+            Else, return error string
+        """
+        out = self._query_batch_(self._snapshot_queries(self.number_of_channels))
+        if type(out) is str:
+            return out
+        return self._parse_snapshot(out, self.number_of_channels)
+
+    @staticmethod
+    def _snapshot_queries(number_of_channels):
+        """
+        Queries sent by get_snapshot(). Shared with AsyncSpd3303x.
+        """
+        qrys = []
+        for chan in range(1, number_of_channels+1):
+            ch = 'CH' + str(chan)
+            qrys += [ch + ':voltage?', ch + ':current?', 'measure:voltage? ' + ch, 'measure:current? ' + ch]
+        qrys.append('system:status?')
+        return qrys
+
+    @staticmethod
+    def _parse_snapshot(out, number_of_channels):
+        """
+        Change the replies to _snapshot_queries() into a PowerSupplySnapshot. Shared with AsyncSpd3303x.
+
+        Returns
+        -------
+        PowerSupplySnapshot
+            If succesful, return the snapshot of both channels.
+        str
+            Else, return error string
+        """
+        try:
+            values = [float(reply) for reply in out[:-1]]
+            status = f'{int(out[-1], 16):0>10b}'
+        except ValueError:
+            return 'ERROR: could not parse snapshot reply ' + str(out)
+
+        return PowerSupplySnapshot(
+            setpoint_voltage=values[0::4],
+            setpoint_current=values[1::4],
+            actual_voltage=values[2::4],
+            actual_current=values[3::4],
+            channel_state=[bool(int(status[-4-chan])) for chan in range(1, number_of_channels+1)],
+        )
+
     # Properties
     # ----------
     @property
@@ -696,12 +815,242 @@ class Spd3303x(SocketEthernetDevice, PowerSupply):
         self.set_current_limit(2, amps)
 
 
+class AsyncSpd3303x(AsyncSocketEthernetDevice, PowerSupply):
+    """
+    asyncio version of Spd3303x. Every method that talks to the power supply is a coroutine and has to be awaited.
+    The software channel limits work as in Spd3303x. Connect with 'await ps.connect()' or 'async with ps:'.
+    """
+
+    def __init__(
+            self,
+            ip4_address,
+            port=5025,
+            channel_voltage_limits=None,
+            channel_current_limits=None,
+            zero_on_startup=True
+    ):
+        """
+        Parameters
+        ----------
+        ip4_address : str
+            IPv4 address of the power supply.
+        port : int
+            port used for communication. Siglent recommends to use 5025 for the SPD3303X power supply.
+        channel_voltage_limits : list
+            Set an upper limit on the set voltage of the channels. Entry 0 represents channel 1, entry 1 represents
+            channel 2, and so on.
+        channel_current_limits : list
+            Set an upper limit on the set current of the channels. Entry 0 represents channel 1, entry 1 represents
+            channel 2, and so on.
+        zero_on_startup : bool
+            If True, turn off the output of both channels and set the setpoints to 0 once connected.
+        """
+        AsyncSocketEthernetDevice.__init__(
+            self,
+            ip4_address=ip4_address,
+            port=port,
+            terminator=b'\n',
+        )
+        PowerSupply.__init__(
+            self,
+            MAX_voltage=32,
+            MAX_current=3.3,
+            number_of_channels=2,
+            channel_voltage_limits=channel_voltage_limits,
+            channel_current_limits=channel_current_limits,
+            zero_on_startup=zero_on_startup,
+        )
+
+    async def connect(self, attempts=11, initial_delay=0.1, max_delay=5):
+        await AsyncSocketEthernetDevice.connect(self, attempts, initial_delay, max_delay)
+        if self._zero_on_startup:
+            await self.zero_all_channels()
+
+    async def _query_(self, qry):
+        out = await self._query(qry.encode('utf-8'))
+        try:
+            return out.decode('utf-8').strip()
+        except AttributeError:
+            return out
+
+    async def _command_(self, cmd):
+        return await self._command(cmd.encode('utf-8'))
+
+    async def _query_batch_(self, qrys):
+        out = await self._query_batch(';'.join(qrys).encode('utf-8'), len(qrys))
+        if type(out) is str:
+            return out
+        return [reply.decode('utf-8') for reply in out]
+
+    async def _query_float_(self, qry):
+        out = await self._query_(qry)
+        try:
+            return float(out)
+        except ValueError:
+            return out
+
+    # Methods
+    # -------
+    async def get_system_status(self):
+        """
+        Returns
+        -------
+        str
+            10-digit binary number as a string representing the status of the system. See Spd3303x.system_status
+        """
+        reply_hex_str = await self._query_('system:status?')
+        try:
+            return f'{int(reply_hex_str, 16):0>10b}'
+        except ValueError:
+            return reply_hex_str
+
+    async def get_channel_state(self, channel):
+        err = self.check_valid_channel(channel)
+        if err is not None:
+            return err
+
+        out = (await self.get_system_status())[-4-channel]
+        try:
+            return bool(int(out))
+        except ValueError:
+            return out
+
+    async def set_channel_state(self, channel, state):
+        err = self.check_valid_channel(channel)
+        if err is not None:
+            return err
+
+        if type(state) is not bool and type(state) is not int:
+            return 'ERROR: type ' + str(type(state)) + ' not supported. Input True or 1 for ON, or False or 0 for OFF'
+
+        state_str = 'ON' if state else 'OFF'
+        return await self._command_('Output CH' + str(channel) + ',' + state_str)
+
+    async def get_setpoint_voltage(self, channel):
+        err = self.check_valid_channel(channel)
+        if err is not None:
+            return err
+        return await self._query_float_('CH' + str(channel) + ':voltage?')
+
+    async def set_voltage(self, channel, volts):
+        err = self.check_valid_channel(channel)
+        if err is not None:
+            return err
+
+        if volts > self.get_voltage_limit(channel):
+            return 'ERROR: CH' + str(channel) + ' voltage not set. New voltage is higher than limit'
+
+        return await self._command_('CH' + str(channel) + ':voltage ' + str(round(volts, 3)))
+
+    async def get_actual_voltage(self, channel):
+        err = self.check_valid_channel(channel)
+        if err is not None:
+            return err
+        return await self._query_float_('measure:voltage? CH' + str(channel))
+
+    async def get_setpoint_current(self, channel):
+        err = self.check_valid_channel(channel)
+        if err is not None:
+            return err
+        return await self._query_float_('CH' + str(channel) + ':current?')
+
+    async def set_current(self, channel, amps):
+        err = self.check_valid_channel(channel)
+        if err is not None:
+            return err
+
+        if amps > self.get_current_limit(channel):
+            return 'ERROR: CH' + str(channel) + ' current not set. New current is higher than limit'
+
+        return await self._command_('CH' + str(channel) + ':current ' + str(round(amps, 3)))
+
+    async def get_actual_current(self, channel):
+        err = self.check_valid_channel(channel)
+        if err is not None:
+            return err
+        return await self._query_float_('measure:current? CH' + str(channel))
+
+    async def set_voltage_limit(self, channel, volts):
+        err = self.check_valid_channel(channel)
+        if err is not None:
+            return err
+
+        if volts > self._MAX_voltage or volts <= 0:
+            return 'Voltage limit not set. New voltage limit is not allowed by the power supply.'
+        elif volts < await self.get_setpoint_voltage(channel):
+            return 'Voltage limit not set. New voltage limit is lower than present channel setpoint voltage.'
+        self._channel_voltage_limits[channel - 1] = volts
+
+    async def set_current_limit(self, channel, amps):
+        err = self.check_valid_channel(channel)
+        if err is not None:
+            return err
+
+        if amps > self._MAX_current or amps <= 0:
+            return 'Current limit not set. New current limit is not allowed by the power supply.'
+        elif amps < await self.get_setpoint_current(channel):
+            return 'Current limit not set. New current limit is lower than present channel setpoint current.'
+        self._channel_current_limits[channel - 1] = amps
+
+    async def set_all_channels_voltage_limit(self, volts):
+        for chan in range(1, self.number_of_channels+1):
+            err = await self.set_voltage_limit(chan, volts)
+            if err is not None:
+                return err
+
+    async def set_all_channels_current_limit(self, amps):
+        for chan in range(1, self.number_of_channels+1):
+            err = await self.set_current_limit(chan, amps)
+            if err is not None:
+                return err
+
+    async def zero_all_channels(self):
+        for chan in range(1, self.number_of_channels+1):
+            for err in [
+                await self.set_voltage(channel=chan, volts=0),
+                await self.set_current(channel=chan, amps=0),
+                await self.set_channel_state(channel=chan, state=False),
+            ]:
+                if err is not None:
+                    return err
+
+    async def get_snapshot(self):
+        """
+        See Spd3303x.get_snapshot()
+
+        Returns
+        -------
+        PowerSupplySnapshot
+            If succesful, return the snapshot of both channels.
+        str
+            Else, return error string
+        """
+        out = await self._query_batch_(Spd3303x._snapshot_queries(self.number_of_channels))
+        if type(out) is str:
+            return out
+        return Spd3303x._parse_snapshot(out, self.number_of_channels)
+
+    async def get_idn(self):
+        return await self._query_('*IDN?')
+
+    async def get_ip4_address(self):
+        return await self._query_('IP?')
+
+
 class Mr50040(SocketEthernetDevice, PowerSupply):
+    error_check_modes = ('query', 'piggyback', 'status', 'batch')
+    ERROR_QUEUE_BIT = 0x04  # status byte bit set while the error queue is not empty
+    SNAPSHOT_QUERIES = ('voltage?', 'current?', 'measure:voltage?', 'measure:current?', 'output?')
+    SNAPSHOT_TYPES = (float, float, float, float, int)
+
     def __init__(
             self,
             ip4_address=None,
             port=5025,
-            zero_on_startup=True
+            zero_on_startup=True,
+            background_connect=False,
+            error_check='query',
+            socket_factory=None,
     ):
         """
         Parameters
@@ -713,18 +1062,22 @@ class Mr50040(SocketEthernetDevice, PowerSupply):
             devices, can use any between 49152 and 65536.
         zero_on_startup : bool
             If True, run a routine to set turn off the output of both channels and set the set
-        """
+        background_connect : bool
+            If True, return right away and keep trying to connect in the background. See SocketEthernetDevice.
+        socket_factory : callable, None
+            Used to record or replay the traffic with the power supply. See SocketEthernetDevice.
+        error_check : str
+            How errors are checked after every query and command. See the error_check property.
+        """
+        self.error_check = error_check
+        self._unchecked_commands = []  # commands sent in 'batch' mode whose error reply has not been read yet
+        self._batch_errors = []
         physical_parameters = {
             'MAX_voltage_limit': 500,
             'MAX_current_limit': 40,
             'number_of_channels': 1,
         }
 
-        SocketEthernetDevice.__init__(
-            self,
-            ip4_address=ip4_address,
-            port=port
-        )
         PowerSupply.__init__(
             self,
             MAX_voltage=physical_parameters['MAX_voltage_limit'],
@@ -734,9 +1087,162 @@ class Mr50040(SocketEthernetDevice, PowerSupply):
             channel_current_limits=None,  # not used by this class. Limit is enforced by hardware.
             zero_on_startup=zero_on_startup,
         )
+        SocketEthernetDevice.__init__(
+            self,
+            ip4_address=ip4_address,
+            port=port,
+            terminator=b'\n',
+            background_connect=background_connect,
+            socket_factory=socket_factory,
+        )
 
-        if self._zero_on_startup is True and ip4_address is not None:
+    def _on_connect(self, first):
+        # the error replies of the old connection are lost. Keep an error for each command, for flush_commands()
+        self._batch_errors += [c + ': ERROR: Connection lost. Command might not have been applied.'
+                               for c in self._unchecked_commands]
+        self._unchecked_commands = []
+        if first and self._zero_on_startup is True and self._ip4_address is not None:
             self.zero_all_channels()
+            self.flush_commands()
+
+    @property
+    def error_check(self):
+        """
+        How errors are checked after every query and command:
+
+        - 'query': send system:error? in its own message after every query and command. Two round trips each.
+        - 'piggyback': append system:error? to the same message. One round trip each.
+        - 'status': append *stb? to the same message and only ask for the error if the error queue bit is set.
+        - 'batch': commands are sent right away with system:error? appended, but the replies are only read by the
+          next query or by flush_commands(). Errors are kept, with the command that caused them, until
+          flush_commands() is called. Commands whose reply was lost to a reconnection are reported as errors too.
+          Meant to be flushed once per control loop iteration.
+        """
+        return self._error_check
+
+    @error_check.setter
+    def error_check(self, mode):
+        if mode not in self.error_check_modes:
+            raise ValueError('error_check should be one of ' + str(self.error_check_modes) + ', not ' + str(mode))
+        if getattr(self, '_error_check', None) == 'batch' and mode != 'batch':
+            self.flush_commands()
+        self._error_check = mode
+
+    def _parse_error_check(self, reply):
+        """
+        Change the reply to the error check appended to a message into an error string.
+
+        Parameters
+        ----------
+        reply : str
+            reply to system:error?, or to *stb? in 'status' mode.
+
+        Returns
+        -------
+        None
+            If there was no error.
+        str
+            Else, return an error string
+        """
+        if self._error_check == 'status':
+            try:
+                if int(reply) & self.ERROR_QUEUE_BIT == 0:
+                    return None
+            except ValueError:
+                return 'ERROR: could not parse error reply ' + str(reply)
+            reply = self.get_error()
+        return self._parse_error_reply(reply)
+
+    @staticmethod
+    def _parse_error_reply(reply):
+        """
+        Change a reply to system:error? into an error string. Shared with AsyncMr50040.
+
+        Returns
+        -------
+        None
+            If there was no error.
+        str
+            Else, return an error string
+        """
+        try:
+            code, err = reply.split(',', 1)
+            if int(code) == 0:
+                return None
+        except ValueError:
+            return 'ERROR: could not parse error reply ' + str(reply)
+        return 'ERROR: ' + str(err)
+
+    @staticmethod
+    def _parse_replies(out, data_types):
+        """
+        Change the replies of a batch query into their types. Shared with AsyncMr50040.
+
+        Returns
+        -------
+        list
+            The reply to each query, changed into its type.
+        str
+            If a reply cannot be parsed, return an error string
+        """
+        try:
+            return [data_type(reply) for data_type, reply in zip(data_types, out)]
+        except ValueError:
+            return 'ERROR: could not parse reply ' + str(out)
+
+    @staticmethod
+    def _parse_snapshot(out):
+        """
+        Change the replies to SNAPSHOT_QUERIES into a PowerSupplySnapshot. Shared with AsyncMr50040.
+        """
+        return PowerSupplySnapshot(
+            setpoint_voltage=[out[0]],
+            setpoint_current=[out[1]],
+            actual_voltage=[out[2]],
+            actual_current=[out[3]],
+            channel_state=[bool(out[4])],
+        )
+
+    def _read_unchecked(self):
+        """
+        Read the error replies of the commands sent in 'batch' mode and keep the errors with the command that caused
+        them. Has to be called holding the lock.
+        """
+        deadline = time.monotonic() + self._timeout
+        while self._unchecked_commands:
+            cmd = self._unchecked_commands.pop(0)
+            try:
+                reply = self._read_reply(deadline).decode('utf-8').strip()
+            except socket.timeout:
+                self._batch_errors.append(cmd + ': ERROR: No response from device')
+                continue
+            except (OSError, AttributeError):  # includes ConnectionError
+                self._batch_errors.append(cmd + ': ERROR: Connection lost. Command might not have been applied.')
+                self._batch_errors += [c + ': ERROR: Connection lost.' for c in self._unchecked_commands]
+                self._unchecked_commands = []
+                return
+            err = self._parse_error_check(reply)
+            if err is not None:
+                self._batch_errors.append(cmd + ': ' + err)
+
+    def flush_commands(self):
+        """
+        Read the error replies of all the commands sent since the last call in 'batch' mode.
+
+        Returns
+        -------
+        None
+            If all the commands were succesful.
+        str
+            Else, return the error strings, one line per failed command, starting with the command that caused it.
+        """
+        with self._lock:
+            self._read_unchecked()
+            errors = self._batch_errors
+            self._batch_errors = []
+        if errors:
+            return '\n'.join(errors)
+        return None
 
     def get_error_code(self):
         """
@@ -747,7 +1253,7 @@ class Mr50040(SocketEthernetDevice, PowerSupply):
         int
             error code as an int. Refer to MR50040 programming manual to see the meaning of error code.
         """
-        return int(self._query('system:error?\n'.encode('utf-8')).decode('utf-8').split(',')[0])
+        return int(self.get_error().split(',')[0])
 
     def get_error(self):
         """
@@ -759,13 +1265,15 @@ class Mr50040(SocketEthernetDevice, PowerSupply):
         str
             format: '<code>,<message>'
         """
-        return self._query('system:error?\n'.encode('utf-8')).decode('utf-8').strip()
+        with self._lock:
+            self._read_unchecked()
+            return self._query('system:error?\n'.encode('utf-8')).decode('utf-8').strip()
 
     def _query_(self, qry, data_type):
         """
         query the device through a socket connection using the self._query method from the SocketEthernetDevice
         master class. After querying, check for errors directly to the power supply. If an error occured, return the
-        error message.
+        error message. See the error_check property for the ways errors are checked.
 
         Parameters:
         -----------
@@ -784,11 +1292,25 @@ class Mr50040(SocketEthernetDevice, PowerSupply):
         int
             Requested value as an int. Usually for True/False requests or status bytes.
         """
-        qry += '\n'
-        out = self._query(qry.encode('utf-8')).decode('utf-8').strip()
-        code, err = self.get_error().split(',')
-        if int(code) != 0:
-            return str(out) + '\nERROR: ' + str(err)
+        with self._lock:  # keep the error check next to the query that caused it
+            if self._error_check == 'query':
+                out = self._query((qry + '\n').encode('utf-8'))
+                if type(out) is str:
+                    return out
+                out = out.decode('utf-8').strip()
+                err = self._parse_error_reply(self.get_error())
+            else:
+                self._read_unchecked()
+                check = '*stb?' if self._error_check == 'status' else ':system:error?'
+                reply = self._query((qry + ';' + check + '\n').encode('utf-8'))
+                if type(reply) is str:
+                    return reply
+                replies = reply.decode('utf-8').strip().split(';')
+                out = ';'.join(replies[:-1])  # empty if the query failed and only the error check answered
+                err = self._parse_error_check(replies[-1])
+
+        if err is not None:
+            return str(out) + '\n' + err
         else:
             return data_type(out)
 
@@ -796,22 +1318,75 @@ class Mr50040(SocketEthernetDevice, PowerSupply):
         """
         send a command to the device through a socket connection using the self._command method from the
         SocketEthernetDevice master class. After sending the command, check for errors directly to the power supply.
-        If an error occured, return the error message.
+        If an error occured, return the error message. See the error_check property for the ways errors are checked.
+
         Returns
         -------
         None
-            If succesful, return None
+            If succesful, return None. Always None in 'batch' mode, errors are returned by flush_commands().
         str
             Else, return an error string
         """
-        cmd += '\n'
-        out = self._command(cmd.encode('utf-8'))
-        time.sleep(0.3)
-        code, err = self.get_error().strip().split(',')
-        if int(code) != 0:
-            return 'ERROR: ' + str(err)
-        else:
-            return out
+        with self._lock:  # keep the error check next to the command that caused it
+            if self._error_check == 'query':
+                # system:error? is answered only after the command is done, so no extra wait is needed.
+                out = self._command((cmd + '\n').encode('utf-8'))
+                if out is not None:
+                    return out
+                return self._parse_error_reply(self.get_error())
+
+            check = '*stb?' if self._error_check == 'status' else ':system:error?'
+            msg = (cmd + ';' + check + '\n').encode('utf-8')
+            if self._error_check == 'batch':
+                t0 = time.perf_counter()
+                try:
+                    self._drain()
+                    self._socket.sendall(msg)
+                except (OSError, AttributeError):
+                    return 'ERROR: Socket not found. Command not sent. Try using the connect() method first.'
+                self._stats.record(command_mnemonic(msg), time.perf_counter() - t0, len(msg))
+                self._unchecked_commands.append(cmd)
+                return None
+
+            reply = self._query(msg)
+            if type(reply) is str:
+                return reply
+            return self._parse_error_check(reply.decode('utf-8').strip())
+
+    def _query_batch_(self, qrys, data_types):
+        """
+        Send several queries in a single message and receive all the replies in one round trip. The queries are
+        separated by ';:' so that each one starts from the root of the SCPI command tree. The error check is appended
+        to the same message and its reply is the last one, so errors are checked without a second round trip.
+
+        Parameters
+        ----------
+        qrys : list of str
+            messages to send as strings. No need to add \n.
+        data_types : list of type
+            callable objects of int, float, or str used to change each reply into its correct type.
+
+        Returns
+        -------
+        list
+            The reply to each query, in the same order as qrys.
+        str
+            If an error occurs, return the error string
+        """
+        check = '*stb?' if self._error_check == 'status' else 'system:error?'
+        qry = ';:'.join(list(qrys) + [check]) + '\n'
+        with self._lock:  # keep the error check next to the queries that caused it
+            if self._error_check == 'batch':
+                self._read_unchecked()
+            out = self._query_batch(qry.encode('utf-8'), len(qrys) + 1)
+            if type(out) is str:
+                return out
+            out = [reply.decode('utf-8') for reply in out]
+            err = self._parse_error_check(out.pop())
+
+        if err is not None:
+            return str(out) + '\n' + err
+        return self._parse_replies(out, data_types)
 
     def get_status_byte(self):
         """
@@ -1009,6 +1584,22 @@ class Mr50040(SocketEthernetDevice, PowerSupply):
     def get_actual_power(self):
         return self._query_('measure:power?', float)
 
+    def get_snapshot(self):
+        """
+        Query the setpoints, actual readings, and output state in a single round trip.
+
+        Returns
+        -------
+        PowerSupplySnapshot
+            If succesful, return the snapshot of the output.
+        str
+            If an error occurs, return the error string
+        """
+        out = self._query_batch_(self.SNAPSHOT_QUERIES, self.SNAPSHOT_TYPES)
+        if type(out) is str:
+            return out
+        return self._parse_snapshot(out)
+
     def get_voltage_limit(self, channel=1):
         """
         This is a voltage limit enforced by the power supply.
@@ -1129,6 +1720,187 @@ class Mr50040(SocketEthernetDevice, PowerSupply):
         return self.get_actual_power()
 
 
+class AsyncMr50040(AsyncSocketEthernetDevice, PowerSupply):
+    """
+    asyncio version of Mr50040. Every method that talks to the power supply is a coroutine and has to be awaited.
+    Connect with 'await mr.connect()' or 'async with mr:'.
+    """
+    def __init__(
+            self,
+            ip4_address=None,
+            port=5025,
+            zero_on_startup=True
+    ):
+        """
+        Parameters
+        ----------
+        ip4_address : str
+            IPv4 address of the power supply.
+        port : int
+            port used for communication.
+        zero_on_startup : bool
+            If True, turn off the output and set the setpoints to 0 once connected.
+        """
+        AsyncSocketEthernetDevice.__init__(
+            self,
+            ip4_address=ip4_address,
+            port=port,
+            terminator=b'\n',
+        )
+        PowerSupply.__init__(
+            self,
+            MAX_voltage=500,
+            MAX_current=40,
+            number_of_channels=1,
+            channel_voltage_limits=None,  # not used by this class. Limit is enforced by hardware.
+            channel_current_limits=None,  # not used by this class. Limit is enforced by hardware.
+            zero_on_startup=zero_on_startup,
+        )
+
+    async def connect(self, attempts=11, initial_delay=0.1, max_delay=5):
+        await AsyncSocketEthernetDevice.connect(self, attempts, initial_delay, max_delay)
+        if self._zero_on_startup:
+            await self.zero_all_channels()
+
+    async def get_error_code(self):
+        return int((await self.get_error()).split(',')[0])
+
+    async def get_error(self):
+        out = await self._query('system:error?\n'.encode('utf-8'))
+        try:
+            return out.decode('utf-8').strip()
+        except AttributeError:
+            return out
+
+    async def _query_(self, qry, data_type):
+        """
+        See Mr50040._query_(). system:error? is sent in the same message, as in the 'piggyback' error check of
+        Mr50040, so that other coroutines cannot send anything between the query and its error check.
+        """
+        reply = await self._query((qry + ';:system:error?\n').encode('utf-8'))
+        if type(reply) is str:
+            return reply
+        replies = reply.decode('utf-8').strip().split(';')
+        out = ';'.join(replies[:-1])  # empty if the query failed and only the error check answered
+        err = Mr50040._parse_error_reply(replies[-1])
+        if err is not None:
+            return str(out) + '\n' + err
+        return data_type(out)
+
+    async def _command_(self, cmd):
+        """
+        See Mr50040._command_(). system:error? is sent in the same message, see _query_().
+        """
+        reply = await self._query((cmd + ';:system:error?\n').encode('utf-8'))
+        if type(reply) is str:
+            return reply
+        return Mr50040._parse_error_reply(reply.decode('utf-8').strip())
+
+    async def _query_batch_(self, qrys, data_types):
+        """
+        See Mr50040._query_batch_()
+        """
+        qry = ';:'.join(list(qrys) + ['system:error?']) + '\n'
+        out = await self._query_batch(qry.encode('utf-8'), len(qrys) + 1)
+        if type(out) is str:
+            return out
+
+        out = [reply.decode('utf-8') for reply in out]
+        err = Mr50040._parse_error_reply(out.pop())
+        if err is not None:
+            return str(out) + '\n' + err
+        return Mr50040._parse_replies(out, data_types)
+
+    async def get_status_byte(self):
+        return await self._query_('*stb?', int)
+
+    async def get_channel_state(self, channel=1):
+        out = await self._query_('output?', int)
+        try:
+            return bool(out)
+        except ValueError:
+            return out
+
+    async def set_channel_state(self, channel=1, state=None):
+        if state is None:
+            return 'ERROR: keyword argument state parameter missing'
+        try:
+            return await self._command_('output ' + str(int(state)))
+        except ValueError:
+            return 'ERROR: type ' + str(type(state)) + ' not supported, state should be a bool'
+
+    async def get_setpoint_voltage(self, channel=1):
+        return await self._query_('voltage?', float)
+
+    async def set_voltage(self, channel=1, volts=None):
+        if volts is None:
+            raise TypeError('ERROR: volts parameter missing')
+        return await self._command_('voltage ' + str(volts))
+
+    async def get_actual_voltage(self, channel=1):
+        return await self._query_('measure:voltage?', float)
+
+    async def get_setpoint_current(self, channel=1):
+        return await self._query_('current?', float)
+
+    async def set_current(self, channel=1, amps=None):
+        if amps is None:
+            raise TypeError('ERROR: amps parameter missing')
+        return await self._command_('current ' + str(amps))
+
+    async def get_actual_current(self, channel=1):
+        return await self._query_('measure:current?', float)
+
+    async def get_setpoint_power(self):
+        return await self._query_('power?', float)
+
+    async def get_actual_power(self):
+        return await self._query_('measure:power?', float)
+
+    async def get_voltage_limit(self, channel=1):
+        return await self._query_('voltage:max?', float)
+
+    async def set_voltage_limit(self, channel=1, volts=None):
+        if volts is None:
+            return 'ERROR: volts parameter missing'
+        return await self._command_('voltage:max ' + str(volts))
+
+    async def get_current_limit(self, channel=1):
+        return await self._query_('current:max?', float)
+
+    async def set_current_limit(self, channel=1, amps=None):
+        if amps is None:
+            return 'ERROR: amps parameter missing'
+        return await self._command_('current:max ' + str(amps))
+
+    async def set_all_channels_voltage_limit(self, volts):
+        return await self.set_voltage_limit(1, volts)
+
+    async def set_all_channels_current_limit(self, amps):
+        return await self.set_current_limit(1, amps)
+
+    async def zero_all_channels(self):
+        for err in [
+            await self.set_voltage(volts=0),
+            await self.set_current(amps=0),
+            await self.set_channel_state(state=False),
+        ]:
+            if err is not None:
+                return err
+
+    async def get_snapshot(self):
+        """
+        See Mr50040.get_snapshot()
+        """
+        out = await self._query_batch_(Mr50040.SNAPSHOT_QUERIES, Mr50040.SNAPSHOT_TYPES)
+        if type(out) is str:
+            return out
+        return Mr50040._parse_snapshot(out)
+
+    async def get_idn(self):
+        return await self._query_('*IDN?', str)
+
+
 # ======================================================================================================================
 # Temperature DAQs
 # ======================================================================================================================
@@ -1243,7 +2015,7 @@ if platform == 'win32':
             ul.d_out(board_num=self._board_number, port_type=enums.DigitalPortType.AUXPORT, data_value=val)
 
 
-if platform == 'linux' or platform == 'linux2':
+if (platform == 'linux' or platform == 'linux2') and 'MccDeviceLinux' in globals():  # needs uldaq
     class ETcLinux(MccDeviceLinux):
         def __init__(self, ip4_address, port=54211, default_units='celsius'):
             super().__init__(ip4_address, port, default_units)
@@ -1262,7 +2034,9 @@ class Model8742(SocketEthernetDevice):
             self,
             ip4_address,
             port=23,
-            number_of_channels=4
+            number_of_channels=4,
+            background_connect=False,
+            socket_factory=None,
     ):
         """
         Parameters
@@ -1272,14 +2046,20 @@ class Model8742(SocketEthernetDevice):
             Model8742 uses Telnet therefore need to use port 23.
         number_of_channels : int
             number of physical motor channels
+        background_connect : bool
+            If True, return right away and keep trying to connect in the background. See SocketEthernetDevice.
+        socket_factory : callable, None
+            Used to record or replay the traffic with the controller. See SocketEthernetDevice.
 
         """
-        SocketEthernetDevice.__init__(self, ip4_address=ip4_address, port=port)
+        self._number_of_channels = number_of_channels
+        SocketEthernetDevice.__init__(self, ip4_address=ip4_address, port=port, terminator=b'\r\n',
+                                      background_connect=background_connect, socket_factory=socket_factory)
+
+    def _on_connect(self, first):
         if self._ip4_address is not None:
             self._socket.recv(4096)  # Receive connection acknowledgement
 
-        self._number_of_channels = number_of_channels
-
     def _query_(self, qry):
         qry += '\r'
         reply = self._query(qry.encode('utf-8'))
@@ -1546,38 +2326,174 @@ class Model8742(SocketEthernetDevice):
         self.set_velocity(chan=4, vel=new_vel)
 
 
+class AsyncModel8742(AsyncSocketEthernetDevice):
+    """
+    asyncio version of the Newport picomotor controller Model8742. Every method that talks to the controller is a
+    coroutine and has to be awaited. Motion commands wait for the motion to finish without blocking the event loop,
+    so several controllers can move at the same time.
+    """
+    def __init__(
+            self,
+            ip4_address,
+            port=23,
+            number_of_channels=4
+    ):
+        """
+        Parameters
+        ----------
+        ip4_address : str
+        port : int
+            Model8742 uses Telnet therefore need to use port 23.
+        number_of_channels : int
+            number of physical motor channels
+        """
+        AsyncSocketEthernetDevice.__init__(self, ip4_address=ip4_address, port=port, terminator=b'\r\n')
+        self._number_of_channels = number_of_channels
+
+    async def connect(self, attempts=11, initial_delay=0.1, max_delay=5):
+        await AsyncSocketEthernetDevice.connect(self, attempts, initial_delay, max_delay)
+        try:
+            await asyncio.wait_for(self._reader.read(4096), 1)  # Receive connection acknowledgement
+        except asyncio.TimeoutError:
+            pass
+
+    async def _query_(self, qry):
+        qry += '\r'
+        reply = await self._query(qry.encode('utf-8'))
+        try:
+            return reply.decode('utf-8')
+        except AttributeError:
+            return reply
+
+    async def _command_(self, cmd=None):
+        cmd += '\r'
+        return await self._command(cmd.encode('utf-8'))
+
+    async def _wait_motion_done(self, chan, poll_interval=0.05):
+        while not await self.is_motion_done(chan=chan):
+            await asyncio.sleep(poll_interval)
+
+    async def restart_controller(self):
+        await self._command_('RS')
+
+    async def save_settings(self):
+        await self._command_('SM')
+
+    async def load_settings(self):
+        await self._command_('*RCL1')
+
+    async def is_motion_done(self, chan):
+        return bool(int(await self._query_(str(chan) + 'MD?')))
+
+    async def get_instant_position(self, chan):
+        return int(await self._query_(str(chan) + 'TP?'))
+
+    async def get_setpoint_position(self, chan):
+        return int(await self._query_(str(chan) + 'PA?'))
+
+    async def get_velocity(self, chan):
+        return int(await self._query_(str(chan) + 'VA?'))
+
+    async def get_acceleration(self, chan):
+        return int(await self._query_(str(chan) + 'AC?'))
+
+    async def hard_stop_all(self):
+        await self._command_('AB')
+
+    async def soft_stop(self, chan=''):
+        await self._command_(str(chan) + 'ST')
+
+    async def set_origin(self, chan):
+        await self._command_(str(chan) + 'DH' + '0')
+
+    async def set_position(self, chan, position):
+        await self._command_(str(chan) + 'PA' + str(position))
+        await self._wait_motion_done(chan)
+
+    async def displace(self, chan, dis):
+        await self._command_(str(chan) + 'PR' + str(dis))
+        await self._wait_motion_done(chan)
+
+    async def move_indefinetely(self, chan, direction):
+        await self._wait_motion_done(chan)
+        await asyncio.sleep(0.5)
+
+        direct_dict = {
+            '+': '+',
+            'pos': '+',
+            'positive': '+',
+            '-': '-',
+            'neg': '-',
+            'negative': '-'
+        }
+
+        await self._command_(str(chan) + 'MV' + str(direct_dict[direction]))
+
+    async def set_velocity(self, chan, vel):
+        await self._command_(str(chan) + 'VA' + str(vel))
+
+    async def set_acceleration(self, chan, acc):
+        await self._command_(str(chan) + 'AC' + str(acc))
+
+    async def get_idn(self):
+        return await self._query_('*IDN?')
+
+    async def get_mac_address(self):
+        return await self._query_('MACADDR?')
+
+    async def get_hostname(self):
+        return await self._query_('HOSTNAME?')
+
+    @property
+    def number_of_channels(self):
+        return self._number_of_channels
+
+
 class Vxm:
-    def __init__(self, port, tmout=10):
-        self._ser = serial.Serial(port=port, baudrate=9600, bytesize=8, parity=serial.PARITY_NONE, stopbits=1,
-                                  timeout=tmout)
+    def __init__(self, port, tmout=10, serial_factory=None):
+        if serial_factory is None:
+            serial_factory = serial.Serial
+        self._ser = serial_factory(port=port, baudrate=9600, bytesize=8, parity=serial.PARITY_NONE, stopbits=1,
+                                   timeout=tmout)
+        self.settle_scale = getattr(self._ser, 'settle_scale', 1.0)  # scales the waits between exchanges
+        self._stats = get_device_stats('Vxm@' + str(port))
         self.initialize()
 
 
     def _query_(self, qry):
         qry += ',R'
+        t0 = time.perf_counter()
         self._ser.write(qry.encode('utf-8'))
         out = self._ser.read_until(b'^')
-        time.sleep(0.3)
+        self._stats.record(command_mnemonic(qry[:2]), time.perf_counter() - t0, len(qry), len(out),
+                           timeout=not out.endswith(b'^'))
+        _settle(self, 0.3)
         self._ser.write('C'.encode('utf-8'))
         return out
 
     def _command_(self, cmd):
+        t0 = time.perf_counter()
         self._ser.write(cmd.encode('utf-8'))
-        time.sleep(0.3)
+        _settle(self, 0.3)
         self._ser.write('C'.encode('utf-8'))
+        self._stats.record(command_mnemonic(cmd[:2]), time.perf_counter() - t0, len(cmd) + 1)
+
+    @property
+    def stats(self):
+        return self._stats
 
     def initialize(self):
         """
         Initialize remote connection to motor controller.
         """
         self._ser.write('F'.encode('utf-8'))
-        time.sleep(0.1)
+        _settle(self, 0.1)
         self._ser.write('N'.encode('utf-8'))
-        time.sleep(0.1)
+        _settle(self, 0.1)
         self._ser.write('C'.encode('utf-8'))
-        time.sleep(0.1)
+        _settle(self, 0.1)
         self._ser.write('C'.encode('utf-8'))
-        time.sleep(0.1)
+        _settle(self, 0.1)
 
     def disconnect(self):
         self._ser.write('Q'.encode('utf-8'))
@@ -1648,9 +2564,12 @@ class Srs100:
     def __init__(
             self,
             port,
-            read_timeout=3
+            read_timeout=3,
+            serial_factory=None,
     ):
-        s = serial.Serial(
+        if serial_factory is None:
+            serial_factory = serial.Serial
+        s = serial_factory(
             port=port,
             baudrate=28800,
             bytesize=8,
@@ -1661,6 +2580,8 @@ class Srs100:
         self._port = port
         self._read_timeout = read_timeout
         self._serial_port = s
+        self.settle_scale = getattr(s, 'settle_scale', 1.0)  # scales the waits between exchanges
+        self._stats = get_device_stats('Srs100@' + str(port))
         self._filament_state = False
         self._cdem_state = False
         self._noise_floor = 0
@@ -1681,10 +2602,14 @@ class Srs100:
         str
             the requested query or error string
         """
+        key = qry[:2]
         qry += '\r'
+        t0 = time.perf_counter()
         self._serial_port.write(data=qry.encode('utf-8'))
-        time.sleep(0.3)
-        return self._serial_port.read_until(expected='\n\r'.encode('utf-8')).decode('utf-8').strip()
+        _settle(self, 0.3)
+        out = self._serial_port.read_until(expected='\n\r'.encode('utf-8'))
+        self._stats.record(key, time.perf_counter() - t0, len(qry), len(out), timeout=not out.endswith(b'\n\r'))
+        return out.decode('utf-8').strip()
 
     def _command_noresponse_(self, cmd):
         """
@@ -1704,9 +2629,12 @@ class Srs100:
         None
             Else, return None
         """
+        key = cmd[:2]
         cmd += '\r'
+        t0 = time.perf_counter()
         self._serial_port.write(data=cmd.encode('utf-8'))
-        time.sleep(0.3)
+        _settle(self, 0.3)
+        self._stats.record(key, time.perf_counter() - t0, len(cmd))
         return self.get_error_message_all()
 
     def _command_(self, cmd):
@@ -1741,6 +2669,10 @@ class Srs100:
     def flush_buffers(self):
         return self._command_('IN0')
 
+    @property
+    def stats(self):
+        return self._stats
+
     # Error handling
     # --------------
     def _create_error_msg(self, byte, lst):
@@ -2208,7 +3140,7 @@ class Srs100:
         n_points = int(self._query_('AP?')) + 1  # final data point is the total pressure
 
         self._serial_port.write('SC1\r'.encode('utf-8'))
-        time.sleep(0.3)
+        _settle(self, 0.3)
         out = np.asarray([])
         for i in range(n_points):
             raw = self._serial_port.read(4)
@@ -2252,7 +3184,7 @@ class Srs100:
         n_points = int(self._query_('HP?')) + 1  # final data point is the total pressure
 
         self._serial_port.write('HS1\r'.encode('utf-8'))
-        time.sleep(0.3)
+        _settle(self, 0.3)
         out = np.asarray([])
         for i in range(n_points):
             raw = self._serial_port.read(4)  # receive each data point individually.
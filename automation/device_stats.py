@@ -0,0 +1,354 @@
+"""
+Latency and throughput statistics for the devices. Every transport (SocketEthernetDevice, AsyncSocketEthernetDevice,
+and the serial drivers) records each exchange with its device here, keyed by device and command mnemonic. Use
+snapshot_all() to see where the time of a slow control loop goes.
+"""
+import math
+import threading
+import time
+
+
+class LatencyHistogram:
+    """
+    Histogram of latencies with logarithmic bins. Bin 0 holds everything faster than min_latency, and every following
+    bin is bins_per_decade times narrower than a decade. The last bin holds everything slower.
+    """
+    def __init__(self, min_latency=1e-5, decades=6, bins_per_decade=4):
+        """
+        Parameters
+        ----------
+        min_latency : float
+            upper edge of the first bin, in seconds.
+        decades : int
+            number of decades covered by the histogram, starting at min_latency.
+        bins_per_decade : int
+            number of bins per decade.
+        """
+        self._min_latency = min_latency
+        self._bins_per_decade = bins_per_decade
+        self._counts = [0] * (decades * bins_per_decade + 2)
+        self._log_min = math.log10(min_latency)
+
+    def add(self, latency):
+        if latency < self._min_latency:
+            i = 0
+        else:
+            i = min(int((math.log10(latency) - self._log_min) * self._bins_per_decade) + 1, len(self._counts) - 1)
+        self._counts[i] += 1
+
+    @property
+    def edges(self):
+        """
+        Upper edge of every bin in seconds. The last bin has no upper edge.
+        """
+        return [self._min_latency * 10 ** (i / self._bins_per_decade) for i in range(len(self._counts) - 1)]
+
+    @property
+    def counts(self):
+        return list(self._counts)
+
+    def percentile(self, q):
+        """
+        Estimate of a latency percentile, as the upper edge of the bin containing it.
+
+        Parameters
+        ----------
+        q : float
+            percentile between 0 and 100.
+
+        Returns
+        -------
+        float
+            latency in seconds. inf if the percentile falls into the last bin.
+        None
+            If the histogram is empty.
+        """
+        total = sum(self._counts)
+        if total == 0:
+            return None
+        target = q / 100 * total
+        seen = 0
+        edges = self.edges
+        for i, count in enumerate(self._counts):
+            seen += count
+            if seen >= target and count:
+                return edges[i] if i < len(edges) else math.inf
+        return math.inf
+
+
+class CommandStats:
+    """
+    Statistics of a single command mnemonic of a device.
+    """
+    __slots__ = ('count', 'errors', 'timeouts', 'retries', 'bytes_sent', 'bytes_received', 'total_time',
+                 'max_time', 'histogram')
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.retries = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.histogram = LatencyHistogram()
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'retries': self.retries,
+            'bytes_sent': self.bytes_sent,
+            'bytes_received': self.bytes_received,
+            'mean_time': self.total_time / self.count if self.count else None,
+            'max_time': self.max_time,
+            'p50_time': self.histogram.percentile(50),
+            'p99_time': self.histogram.percentile(99),
+            'histogram': self.histogram.counts,
+        }
+
+
+class DeviceStats:
+    """
+    Statistics of a single device. Recording only takes a lock and updates a few counters, so it is cheap enough to
+    run on every exchange.
+    """
+    def __init__(self, name):
+        """
+        Parameters
+        ----------
+        name : str
+            name of the device, usually '<class name>@<address>'.
+        """
+        self._name = name
+        self._lock = threading.Lock()
+        self._commands = {}
+        self._reconnects = 0
+        self._connect_failures = 0
+        self._created = time.time()
+
+    @property
+    def name(self):
+        return self._name
+
+    def _get_command(self, command):
+        try:
+            return self._commands[command]
+        except KeyError:
+            return self._commands.setdefault(command, CommandStats())
+
+    def record(self, command, latency, sent=0, received=0, timeout=False, error=False):
+        """
+        Record one exchange with the device.
+
+        Parameters
+        ----------
+        command : str
+            command mnemonic. See command_mnemonic().
+        latency : float
+            time in seconds from sending the message until the reply was received, or the command was done.
+        sent : int
+            number of bytes sent.
+        received : int
+            number of bytes received.
+        timeout : bool
+            True if the device did not answer in time.
+        error : bool
+            True if the exchange failed for any other reason.
+        """
+        with self._lock:
+            cmd = self._get_command(command)
+            cmd.count += 1
+            cmd.bytes_sent += sent
+            cmd.bytes_received += received
+            cmd.total_time += latency
+            if latency > cmd.max_time:
+                cmd.max_time = latency
+            cmd.histogram.add(latency)
+            if timeout:
+                cmd.timeouts += 1
+            if error:
+                cmd.errors += 1
+
+    def record_retry(self, command):
+        with self._lock:
+            self._get_command(command).retries += 1
+
+    def record_connect(self, reconnect, failures):
+        """
+        Record a succesful connection to the device.
+
+        Parameters
+        ----------
+        reconnect : bool
+            True if the device was connected before.
+        failures : int
+            number of failed attempts before the connection succeeded.
+        """
+        with self._lock:
+            self._reconnects += int(reconnect)
+            self._connect_failures += failures
+
+    def timer(self, command):
+        """
+        Context manager recording the time spent inside it as an exchange with the device. Use it for devices that are
+        not accessed through bytes, like the MCC DAQ's. Exceptions are recorded as errors.
+
+            with stats.timer('T_IN'):
+                out = ai_device.t_in(...)
+        """
+        return _Timer(self, command)
+
+    def reset(self):
+        with self._lock:
+            self._commands = {}
+            self._reconnects = 0
+            self._connect_failures = 0
+            self._created = time.time()
+
+    def snapshot(self):
+        """
+        Returns
+        -------
+        dict
+            copy of the statistics of the device. Keys: 'name', 'since', 'reconnects', 'connect_failures', 'totals', and
+            'commands', which maps every command mnemonic to the dictionary returned by CommandStats.snapshot().
+        """
+        with self._lock:
+            commands = {key: cmd.snapshot() for key, cmd in self._commands.items()}
+            reconnects = self._reconnects
+            connect_failures = self._connect_failures
+            since = self._created
+
+        totals = {
+            key: sum(cmd[key] for cmd in commands.values())
+            for key in ('count', 'errors', 'timeouts', 'retries', 'bytes_sent', 'bytes_received')
+        }
+        return {
+            'name': self._name,
+            'since': since,
+            'reconnects': reconnects,
+            'connect_failures': connect_failures,
+            'totals': totals,
+            'commands': commands,
+        }
+
+
+class _Timer:
+    __slots__ = ('_stats', '_command', '_t0')
+
+    def __init__(self, stats, command):
+        self._stats = stats
+        self._command = command
+
+    def __enter__(self):
+        self._t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._stats.record(self._command, time.perf_counter() - self._t0, error=exc_type is not None)
+        return False
+
+
+def command_mnemonic(msg):
+    """
+    Key used to group the statistics of a message: the message without its arguments and terminator, in uppercase.
+    For messages with several commands separated by ';', the key of every command is kept.
+
+    Examples: b'CH1:voltage 1.5\\n' -> 'CH1:VOLTAGE', b'voltage?;:system:error?\\n' -> 'VOLTAGE?;:SYSTEM:ERROR?'
+
+    Parameters
+    ----------
+    msg : bytes, str
+
+    Returns
+    -------
+    str
+    """
+    if isinstance(msg, (bytes, bytearray)):
+        msg = msg.decode('utf-8', 'replace')
+    parts = []
+    for part in msg.strip().split(';'):
+        words = part.split()
+        parts.append(words[0].upper() if words else '')
+    return ';'.join(parts)
+
+
+_registry_lock = threading.Lock()
+_registry = {}
+
+
+def get_device_stats(name):
+    """
+    Get the statistics of a device, creating them if needed. Objects talking to the same device share them.
+
+    Parameters
+    ----------
+    name : str
+        name of the device, usually '<class name>@<address>'.
+
+    Returns
+    -------
+    DeviceStats
+    """
+    try:
+        return _registry[name]
+    except KeyError:
+        with _registry_lock:
+            return _registry.setdefault(name, DeviceStats(name))
+
+
+def snapshot_all():
+    """
+    Returns
+    -------
+    dict of str: dict
+        snapshot of the statistics of every device, keyed by device name.
+    """
+    with _registry_lock:
+        devices = list(_registry.values())
+    return {stats.name: stats.snapshot() for stats in devices}
+
+
+def reset_all():
+    with _registry_lock:
+        devices = list(_registry.values())
+    for stats in devices:
+        stats.reset()
+
+
+def format_snapshot(snapshot=None):
+    """
+    Format a snapshot as a text table with one line per device and command: count, mean, p50, p99, and max latency in
+    milliseconds, timeouts, errors, retries, and bytes sent and received.
+
+    Parameters
+    ----------
+    snapshot : dict, None
+        result of snapshot_all(). If None, take a new snapshot.
+
+    Returns
+    -------
+    str
+    """
+    if snapshot is None:
+        snapshot = snapshot_all()
+
+    def ms(value):
+        if value is None:
+            return '-'
+        return '{:.2f}'.format(value * 1000)
+
+    lines = ['device command count mean_ms p50_ms p99_ms max_ms timeouts errors retries sent received']
+    for name, dev in snapshot.items():
+        lines.append(name + ' (reconnects: ' + str(dev['reconnects']) + ', failed connects: '
+                     + str(dev['connect_failures']) + ')')
+        for key, cmd in dev['commands'].items():
+            lines.append(' '.join([
+                name, key, str(cmd['count']), ms(cmd['mean_time']), ms(cmd['p50_time']), ms(cmd['p99_time']),
+                ms(cmd['max_time']), str(cmd['timeouts']), str(cmd['errors']), str(cmd['retries']),
+                str(cmd['bytes_sent']), str(cmd['bytes_received']),
+            ]))
+    return '\n'.join(lines)
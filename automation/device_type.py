@@ -4,8 +4,14 @@ Created on Thursday, April 7, 2022
 """
 
 
+import time
 from sys import platform
 
+try:
+    from device_stats import get_device_stats
+except ModuleNotFoundError:
+    from automation.device_stats import get_device_stats
+
 try:
     import mcculw  # Python MCC library for windows
     from mcculw import ul
@@ -18,7 +24,7 @@ try:
     from uldaq import DaqDevice
     from uldaq import AiDevice
 except ModuleNotFoundError:
-    pass
+    DaqDevice = None
 
 
 # TODO: Add proper error handling. This includes receiving error from power supply.
@@ -403,6 +409,42 @@ class PowerSupply:
                 return err3
             print('Channel', chan, 'zeroed.')
 
+    def get_snapshot(self):
+        """
+        Get the setpoints, actual readings, and output states of all the channels. This placeholder queries each value
+        separately. Models that support several queries in a single message should re-write it to use a single round
+        trip.
+
+        Returns
+        -------
+        PowerSupplySnapshot
+            If succesful, return the snapshot of all channels.
+        str
+            Else, return an error string.
+        """
+        values = {
+            'setpoint_voltage': [],
+            'setpoint_current': [],
+            'actual_voltage': [],
+            'actual_current': [],
+            'channel_state': [],
+        }
+        getters = {
+            'setpoint_voltage': self.get_setpoint_voltage,
+            'setpoint_current': self.get_setpoint_current,
+            'actual_voltage': self.get_actual_voltage,
+            'actual_current': self.get_actual_current,
+            'channel_state': self.get_channel_state,
+        }
+        for chan in range(1, self.number_of_channels+1):
+            for name, getter in getters.items():
+                out = getter(chan)
+                if type(out) is str:
+                    return out
+                values[name].append(out)
+
+        return PowerSupplySnapshot(**values)
+
     # Properties
     # ----------
     @property
@@ -464,6 +506,74 @@ class PowerSupply:
     #     self._number_of_channels = n
 
 
+class PowerSupplySnapshot:
+    def __init__(
+            self,
+            setpoint_voltage,
+            setpoint_current,
+            actual_voltage,
+            actual_current,
+            channel_state,
+            timestamp=None,
+    ):
+        """
+        The state of all the channels of a power supply at a single point in time. Every attribute is a list where the
+        0th item corresponds to channel 1, the 1st item to channel 2, and so on.
+
+        Parameters
+        ----------
+        setpoint_voltage : list of float
+            setpoint voltage of each channel in Volts.
+        setpoint_current : list of float
+            setpoint current of each channel in Amps.
+        actual_voltage : list of float
+            measured output voltage of each channel in Volts.
+        actual_current : list of float
+            measured output current of each channel in Amps.
+        channel_state : list of bool
+            output state of each channel. True for ON, False for OFF.
+        timestamp : float, None
+            time.time() at which the snapshot was taken. If None, the current time is used.
+        """
+        self.setpoint_voltage = setpoint_voltage
+        self.setpoint_current = setpoint_current
+        self.actual_voltage = actual_voltage
+        self.actual_current = actual_current
+        self.channel_state = channel_state
+        self.timestamp = time.time() if timestamp is None else timestamp
+
+    def __repr__(self):
+        out = 'PowerSupplySnapshot(timestamp=' + str(self.timestamp) + ')'
+        for i in range(self.number_of_channels):
+            out += '\n    chan' + str(i+1) + ': ' + str(self.get_channel(i+1))
+        return out
+
+    def get_channel(self, channel):
+        """
+        Parameters
+        ----------
+        channel : int
+            channel number, starting from 1.
+
+        Returns
+        -------
+        dict of str: float or bool
+            the values of a single channel, keyed by attribute name.
+        """
+        i = channel - 1
+        return {
+            'setpoint_voltage': self.setpoint_voltage[i],
+            'setpoint_current': self.setpoint_current[i],
+            'actual_voltage': self.actual_voltage[i],
+            'actual_current': self.actual_current[i],
+            'channel_state': self.channel_state[i],
+        }
+
+    @property
+    def number_of_channels(self):
+        return len(self.setpoint_voltage)
+
+
 # ======================================================================================================================
 if platform == 'win32':
     class MccDeviceWindows:
@@ -501,6 +611,7 @@ if platform == 'win32':
             self._port = port
             self._default_units = default_units
             self._is_connected = False
+            self._stats = get_device_stats('MccDeviceWindows@' + str(board_number))
 
             if self._ip4_address is not None and self._port is not None:
                 self.connect()
@@ -809,12 +920,13 @@ if platform == 'win32':
             if units is None:
                 units = self._default_units
 
-            out = ul.t_in(
-                board_num=self._board_number,
-                channel=channel_n,
-                scale=self.get_TempScale_units(units.lower()),
-                options=filter_on_off
-            )
+            with self._stats.timer('T_IN'):
+                out = ul.t_in(
+                    board_num=self._board_number,
+                    channel=channel_n,
+                    scale=self.get_TempScale_units(units.lower()),
+                    options=filter_on_off
+                )
 
             return out
 
@@ -1111,7 +1223,7 @@ if platform == 'win32':
             return self.get_temp(channel_n=7)
 
 
-if platform == 'linux' or platform == 'linux2':
+if (platform == 'linux' or platform == 'linux2') and DaqDevice is not None:
     class MccDeviceLinux(DaqDevice):
         def __init__(
                 self,
@@ -1134,6 +1246,7 @@ if platform == 'linux' or platform == 'linux2':
             d = uldaq.get_net_daq_device_descriptor(ip4_address, port, ifc_name=None, timeout=2)
             super().__init__(d)
             self._default_units = default_units
+            self._stats = get_device_stats('MccDeviceLinux@' + str(ip4_address) + ':' + str(port))
 
             self.connect()
 
@@ -1240,7 +1353,8 @@ if platform == 'linux' or platform == 'linux2':
             if units is None:
                 units = self._default_units
 
-            return self.get_ai_device().t_in(channel=channel_n, scale=self.get_TempScale_unit(units.lower()))
+            with self._stats.timer('T_IN'):
+                return self.get_ai_device().t_in(channel=channel_n, scale=self.get_TempScale_unit(units.lower()))
 
         def get_temp_scan(self, low_channel=0, high_channel=7, units=None):
             """
@@ -1278,8 +1392,9 @@ if platform == 'linux' or platform == 'linux2':
             if units is None:
                 units = self._default_units
 
-            return self.get_ai_device().t_in_list(low_chan=low_channel, high_chan=high_channel,
-                                                  scale=self.get_TempScale_unit(units.lower()))
+            with self._stats.timer('T_IN_LIST'):
+                return self.get_ai_device().t_in_list(low_chan=low_channel, high_chan=high_channel,
+                                                      scale=self.get_TempScale_unit(units.lower()))
 
         def get_thermocouple_type(self, channel):
             """
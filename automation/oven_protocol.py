@@ -0,0 +1,182 @@
+"""
+Binary framing of the oven server protocol, shared by pid_controller_server.py and the Oven client.
+
+A connection starts in the ASCII protocol ('<assembly key> XX:YYYY <parameter>\r'). Sending 'OVEN OV:BINR\r' switches
+it to binary. The server answers in ASCII with the tables used by the binary frames, then both sides only send frames:
+
+    BINR <version> <assembly keys separated by ','> <commands separated by ','>\r
+
+The assembly index of a request is the position of its key in that list, or OVEN_INDEX for OVEN commands. The command
+id is the position of the 'XX:YYYY' command in its list.
+
+Request frame, little-endian, followed by length bytes of UTF-8 text:
+
+    request id (uint32), assembly index (uint16), command id (uint16), flags (uint8), parameter (float64),
+    length (uint16)
+
+Flags: FLAG_QUERY for queries ('?'), FLAG_PARAM if the float64 parameter is used, FLAG_TEXT if the text is the
+parameter instead.
+
+Response frame, little-endian, followed by length bytes of UTF-8 text:
+
+    request id (uint32), reply type (uint8), value (float64), length (uint16)
+
+Reply types: REPLY_NONE (no error), REPLY_FLOAT and REPLY_BOOL (in value), REPLY_TEXT and REPLY_ERROR (in the text).
+
+Every response carries the request id of its request, so responses can be matched to requests even if they arrive out
+of order, and they do: the server answers the commands kept in memory right away, and those that talk to an instrument
+when the worker of their assembly is done, so a client must not rely on the order of the responses.
+"""
+import struct
+
+
+VERSION = 1
+OVEN_INDEX = 0xFFFF
+MAX_TEXT = 0xFFFF  # longest text of a frame, in bytes
+
+FLAG_QUERY = 0x01
+FLAG_PARAM = 0x02
+FLAG_TEXT = 0x04
+
+REPLY_NONE = 0
+REPLY_FLOAT = 1
+REPLY_BOOL = 2
+REPLY_TEXT = 3
+REPLY_ERROR = 4
+
+REQUEST = struct.Struct('<IHHBdH')
+RESPONSE = struct.Struct('<IBdH')
+
+
+def pack_request(request_id, asm_index, command_id, query=False, param=None):
+    """
+    Parameters
+    ----------
+    request_id : int
+        any number below 2**32, returned in the response.
+    asm_index : int
+        index of the assembly key, or OVEN_INDEX.
+    command_id : int
+        index of the command.
+    query : bool
+        True for queries. param is ignored.
+    param : float, int, bool, str, None
+        parameter of setters. None for commands without parameter.
+
+    Returns
+    -------
+    bytes
+    """
+    text = b''
+    value = 0.0
+    if query:
+        flags = FLAG_QUERY
+    elif param is None:
+        flags = 0
+    elif isinstance(param, str):
+        flags = FLAG_TEXT
+        text = param.encode('utf-8')
+    else:
+        flags = FLAG_PARAM
+        value = float(param)
+    if len(text) > MAX_TEXT:
+        raise ValueError('text parameter longer than ' + str(MAX_TEXT) + ' bytes')
+    return REQUEST.pack(request_id, asm_index, command_id, flags, value, len(text)) + text
+
+
+def unpack_request(buffer, offset=0):
+    """
+    Parameters
+    ----------
+    buffer : bytes, bytearray
+    offset : int
+        position of the frame in buffer.
+
+    Returns
+    -------
+    tuple of (int, int, int, bool, float or str or None, int)
+        request id, assembly index, command id, query flag, parameter, and size of the frame in bytes.
+    None
+        If the frame is not complete yet.
+    """
+    if len(buffer) - offset < REQUEST.size:
+        return None
+    request_id, asm_index, command_id, flags, value, length = REQUEST.unpack_from(buffer, offset)
+    size = REQUEST.size + length
+    if len(buffer) - offset < size:
+        return None
+
+    if flags & FLAG_TEXT:
+        param = bytes(buffer[offset + REQUEST.size:offset + size]).decode('utf-8', 'replace')
+    elif flags & FLAG_PARAM:
+        param = value
+    else:
+        param = None
+    return request_id, asm_index, command_id, bool(flags & FLAG_QUERY), param, size
+
+
+def pack_response(request_id, out):
+    """
+    Parameters
+    ----------
+    request_id : int
+        request id of the request answered.
+    out : object
+        result of the command. None, float, int, and bool are sent as values, everything else as text. Strings
+        starting with 'ERROR' are sent as errors.
+
+    Returns
+    -------
+    bytes
+    """
+    text = b''
+    value = 0.0
+    if out is None:
+        kind = REPLY_NONE
+    elif isinstance(out, bool):
+        kind = REPLY_BOOL
+        value = float(out)
+    elif isinstance(out, (int, float)):
+        kind = REPLY_FLOAT
+        value = float(out)
+    else:
+        out = str(out)
+        kind = REPLY_ERROR if out.startswith('ERROR') else REPLY_TEXT
+        text = out.encode('utf-8')
+        if len(text) > MAX_TEXT:
+            kind = REPLY_ERROR
+            text = b'ERROR: reply longer than ' + str(MAX_TEXT).encode('utf-8') + b' bytes'
+    return RESPONSE.pack(request_id, kind, value, len(text)) + text
+
+
+def unpack_response(buffer, offset=0):
+    """
+    Parameters
+    ----------
+    buffer : bytes, bytearray
+    offset : int
+        position of the frame in buffer.
+
+    Returns
+    -------
+    tuple of (int, object, int)
+        request id, result (None, float, bool, or str), and size of the frame in bytes.
+    None
+        If the frame is not complete yet.
+    """
+    if len(buffer) - offset < RESPONSE.size:
+        return None
+    request_id, kind, value, length = RESPONSE.unpack_from(buffer, offset)
+    size = RESPONSE.size + length
+    if len(buffer) - offset < size:
+        return None
+
+    if kind == REPLY_NONE:
+        out = None
+    elif kind == REPLY_FLOAT:
+        out = value
+    elif kind == REPLY_BOOL:
+        out = bool(value)
+    else:
+        out = bytes(buffer[offset + RESPONSE.size:offset + size]).decode('utf-8', 'replace')
+    return request_id, out, size
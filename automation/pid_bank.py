@@ -0,0 +1,351 @@
+"""
+Bank of PID controllers backed by numpy arrays. The gains, setpoints, limits, sample times, and state (integral, last
+input, last output, ...) of every loop are kept in arrays, and PidBank.update() computes the output of every loop that
+is due in a single vectorized step, so the cost of a control step barely depends on the number of heater zones:
+
+    bank = PidBank()
+    zones = [bank.add(kp=0.4, ki=0.015, kd=0.005, setpoint=60, sample_time=1, output_limits=(0, 30)) for i in range(32)]
+    volts = bank.update(temps)  # one temperature per loop, in the order they were added
+
+Every loop is also available on its own as a PidSlot, which has the interface of simple_pid.PID, to tune it or read
+its terms. Calling a slot steps that loop alone, which costs about as much as a whole update(), so a caller stepping
+its zones one at a time is better off with a simple_pid.PID per zone. The OvenServer steps the bank once per tick with
+a BankControlLoop when it has at least BANK_MIN_ZONES heaters, see pid_controller_server.py.
+
+The math is the one of simple_pid.PID (proportional on error, derivative on measurement, integral clamped to the
+output limits), with one addition against integral windup: the integral does not grow while the output is saturated
+in the direction the error pushes it.
+"""
+import threading
+import time
+
+import numpy as np
+
+
+def _clip(x, lo, hi):
+    # same as np.clip for lo <= hi, without its overhead on the small arrays of a few zones
+    return np.minimum(np.maximum(x, lo), hi)
+
+
+class PidBank:
+    def __init__(self, capacity=8, time_fn=time.monotonic):
+        """
+        Parameters
+        ----------
+        capacity : int
+            number of loops allocated up front. The arrays grow when more loops are added.
+        time_fn : callable
+            clock used for the sample times when no dt is given.
+        """
+        self._time_fn = time_fn
+        self._lock = threading.RLock()
+        self._n = 0  # loops allocated, including released ones
+        self._free = []  # indexes of released loops, reused by add()
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        def grow(name, fill, dtype=float):
+            new = np.full(capacity, fill, dtype=dtype)
+            old = getattr(self, name, None)
+            if old is not None:
+                new[:len(old)] = old
+            setattr(self, name, new)
+
+        for name in ('kp', 'ki', 'kd', 'setpoint', 'proportional', 'integral', 'derivative'):
+            grow(name, 0.0)
+        grow('sample_time', 0.0)
+        grow('out_min', -np.inf)
+        grow('out_max', np.inf)
+        grow('last_input', np.nan)  # nan until the first update
+        grow('last_output', np.nan)
+        grow('last_time', np.nan)
+        grow('auto', False, bool)  # False for released loops and loops in manual mode
+
+    def __len__(self):
+        return self._n
+
+    @property
+    def lock(self):
+        """
+        Re-entrant lock held by update(), add(), release(), and the setters of the slots. Hold it to build the inputs
+        of update() from the slot indexes while no loop is added or released.
+        """
+        return self._lock
+
+    def add(self, kp=1.0, ki=0.0, kd=0.0, setpoint=0.0, sample_time=0.01, output_limits=(None, None)):
+        """
+        Add a loop to the bank. The parameters are the ones of simple_pid.PID.
+
+        Returns
+        -------
+        PidSlot
+            the new loop. Its index is its position in the arrays passed to and returned by update().
+        """
+        with self._lock:
+            if self._free:
+                index = self._free.pop()
+            else:
+                if self._n == len(self.kp):
+                    self._allocate(2 * max(self._n, 1))
+                index = self._n
+                self._n += 1
+            slot = PidSlot(self, index)
+            self.kp[index], self.ki[index], self.kd[index] = kp, ki, kd
+            self.setpoint[index] = setpoint
+            self.sample_time[index] = 0.0 if sample_time is None else sample_time
+            self.out_min[index], self.out_max[index] = -np.inf, np.inf
+            slot.output_limits = output_limits
+            self.auto[index] = True
+            slot.reset()
+            return slot
+
+    def release(self, slot):
+        """
+        Remove a loop from the bank. Its index is given to the next loop added, and update() ignores it until then.
+        Releasing a slot again does nothing.
+        """
+        with self._lock:
+            if slot.bank is not self or slot.released:
+                return
+            slot._released = True
+            self.auto[slot.index] = False
+            self._free.append(slot.index)
+
+    def update(self, inputs, dt=None):
+        """
+        Update every loop whose sample time has passed, in one vectorized step.
+
+        Parameters
+        ----------
+        inputs : array_like
+            measurement of every loop, in index order, len(bank) values. nan for loops that should not be updated,
+            e.g. because the reading failed.
+        dt : float, array_like, None
+            time in seconds since the last update of every loop. None to use the clock of the bank. As with
+            simple_pid.PID, a loop is only updated if dt is at least its sample time.
+
+        Returns
+        -------
+        numpy.ndarray
+            output of every loop: the new output of the loops updated, the last output of the others (nan if they were
+            never updated).
+        """
+        inputs = np.asarray(inputs, dtype=float)
+        with self._lock:
+            n = self._n
+            if inputs.shape != (n,):
+                raise ValueError('expected ' + str(n) + ' inputs, got ' + str(inputs.shape))
+            now = self._time_fn()
+            if dt is None:
+                dt = now - self.last_time[:n]
+            elif np.ndim(dt) == 0:
+                dt = np.full(n, float(dt))
+            else:
+                dt = np.broadcast_to(np.asarray(dt, dtype=float), (n,))
+            first = np.isnan(self.last_output[:n])  # the first update ignores the sample time, like simple_pid
+            due = self.auto[:n] & ~np.isnan(inputs) & (first | (dt >= self.sample_time[:n]))
+            if due.all():  # the usual case: a slice instead of an index array saves the gathers and scatters
+                index = slice(0, n)
+            else:
+                index = np.flatnonzero(due)
+                if not len(index):
+                    return self.last_output[:n].copy()
+            step_dt = dt[index]
+            self._step(index, inputs[index], np.where(step_dt > 0, step_dt, 1e-16), now)
+            return self.last_output[:n].copy()
+
+    def _step(self, index, inputs, dt, now):
+        """
+        PID step of the loops at index, an index array or a slice. Called with the lock held.
+        """
+        lo, hi = self.out_min[index], self.out_max[index]
+        ki = self.ki[index]
+        error = self.setpoint[index] - inputs
+        last_input = self.last_input[index]
+        d_input = np.where(np.isnan(last_input), 0.0, inputs - last_input)
+
+        proportional = self.kp[index] * error
+        derivative = -self.kd[index] * d_input / dt
+        old_integral = self.integral[index]
+        integral = _clip(old_integral + ki * error * dt, lo, hi)
+
+        # anti-windup: hold the integral while the output is saturated and the error pushes it further out
+        unsaturated = proportional + integral + derivative
+        push = ki * error
+        hold = ((unsaturated > hi) & (push > 0)) | ((unsaturated < lo) & (push < 0))
+        integral = np.where(hold, _clip(old_integral, lo, hi), integral)
+
+        output = _clip(proportional + integral + derivative, lo, hi)
+        self.proportional[index] = proportional
+        self.integral[index] = integral
+        self.derivative[index] = derivative
+        self.last_output[index] = output
+        self.last_input[index] = inputs
+        self.last_time[index] = now
+
+
+class PidSlot:
+    def __init__(self, bank, index):
+        """
+        One loop of a PidBank, with the interface of simple_pid.PID used by HeaterAssembly: Kp, Ki, Kd, setpoint,
+        sample_time, output_limits, tunings, components, auto_mode, reset(), and __call__(input_, dt=None). Created by
+        PidBank.add().
+        """
+        self._bank = bank
+        self._index = index
+        self._released = False
+
+    def __repr__(self):
+        return 'PidSlot(index={}, Kp={}, Ki={}, Kd={}, setpoint={}, sample_time={}, output_limits={})'.format(
+            self._index, self.Kp, self.Ki, self.Kd, self.setpoint, self.sample_time, self.output_limits)
+
+    @property
+    def index(self):
+        return self._index
+
+    @property
+    def bank(self):
+        return self._bank
+
+    @property
+    def released(self):
+        """
+        True once PidBank.release() was called with the slot. Its index may then belong to another loop.
+        """
+        return self._released
+
+    def __call__(self, input_, dt=None):
+        """
+        Update the loop with a new measurement, if its sample time has passed. See simple_pid.PID.__call__().
+
+        Returns
+        -------
+        float
+            the new output, or the last output if the loop was not updated. None if it was never updated.
+        """
+        bank = self._bank
+        i = self._index
+        with bank._lock:
+            if not bank.auto[i]:
+                return self._last_output()
+            now = bank._time_fn()
+            if dt is None:
+                dt = now - bank.last_time[i] if now - bank.last_time[i] else 1e-16
+            elif dt <= 0:
+                raise ValueError('dt has negative value {}, must be positive'.format(dt))
+            if dt < bank.sample_time[i] and not np.isnan(bank.last_output[i]):
+                return float(bank.last_output[i])
+            bank._step(slice(i, i + 1), np.array([float(input_)]), np.array([float(dt)]), now)
+            return float(bank.last_output[i])
+
+    def _last_output(self):
+        out = self._bank.last_output[self._index]
+        return None if np.isnan(out) else float(out)
+
+    def reset(self):
+        """
+        Clear the integral, the derivative, and the last input and output.
+        """
+        bank = self._bank
+        i = self._index
+        with bank._lock:
+            bank.proportional[i] = bank.integral[i] = bank.derivative[i] = 0.0
+            bank.last_input[i] = bank.last_output[i] = np.nan
+            bank.last_time[i] = bank._time_fn()
+
+    @property
+    def Kp(self):
+        return float(self._bank.kp[self._index])
+
+    @Kp.setter
+    def Kp(self, value):
+        with self._bank._lock:
+            self._bank.kp[self._index] = value
+
+    @property
+    def Ki(self):
+        return float(self._bank.ki[self._index])
+
+    @Ki.setter
+    def Ki(self, value):
+        with self._bank._lock:
+            self._bank.ki[self._index] = value
+
+    @property
+    def Kd(self):
+        return float(self._bank.kd[self._index])
+
+    @Kd.setter
+    def Kd(self, value):
+        with self._bank._lock:
+            self._bank.kd[self._index] = value
+
+    @property
+    def tunings(self):
+        return self.Kp, self.Ki, self.Kd
+
+    @tunings.setter
+    def tunings(self, tunings):
+        with self._bank._lock:  # all three in the same step
+            self.Kp, self.Ki, self.Kd = tunings
+
+    @property
+    def setpoint(self):
+        return float(self._bank.setpoint[self._index])
+
+    @setpoint.setter
+    def setpoint(self, value):
+        with self._bank._lock:
+            self._bank.setpoint[self._index] = value
+
+    @property
+    def sample_time(self):
+        return float(self._bank.sample_time[self._index])
+
+    @sample_time.setter
+    def sample_time(self, seconds):
+        with self._bank._lock:
+            self._bank.sample_time[self._index] = 0.0 if seconds is None else seconds
+
+    @property
+    def output_limits(self):
+        bank = self._bank
+        lo, hi = bank.out_min[self._index], bank.out_max[self._index]
+        return None if np.isinf(lo) else float(lo), None if np.isinf(hi) else float(hi)
+
+    @output_limits.setter
+    def output_limits(self, limits):
+        lo, hi = (None, None) if limits is None else limits
+        lo = -np.inf if lo is None else lo
+        hi = np.inf if hi is None else hi
+        if lo > hi:
+            raise ValueError('lower limit must be less than upper limit')
+        bank = self._bank
+        i = self._index
+        with bank._lock:
+            bank.out_min[i], bank.out_max[i] = lo, hi
+            bank.integral[i] = np.clip(bank.integral[i], lo, hi)
+            if not np.isnan(bank.last_output[i]):
+                bank.last_output[i] = np.clip(bank.last_output[i], lo, hi)
+
+    @property
+    def components(self):
+        """
+        Proportional, integral, and derivative terms of the last output.
+        """
+        bank = self._bank
+        i = self._index
+        return float(bank.proportional[i]), float(bank.integral[i]), float(bank.derivative[i])
+
+    @property
+    def auto_mode(self):
+        return bool(self._bank.auto[self._index])
+
+    @auto_mode.setter
+    def auto_mode(self, enabled):
+        bank = self._bank
+        i = self._index
+        with bank._lock:
+            if enabled and not bank.auto[i]:  # switching to automatic: start from a clean state, like simple_pid
+                self.reset()
+            bank.auto[i] = bool(enabled)
@@ -1,6 +1,16 @@
+import collections
+import concurrent.futures
+import logging
+import queue
+import selectors
 import socket
+import sys
 from sys import platform
+import threading
 import time
+
+import numpy as np
+
 try:
     import fcntl
     import struct
@@ -9,9 +19,17 @@ except (ModuleNotFoundError, ImportError):
 
 
 try:
+    import oven_protocol
+    from connection_type import retry_with_backoff
+    from device_stats import LatencyHistogram
+    from pid_bank import PidBank
+    from telemetry_history import HISTORY_CHUNK
+    from telemetry_history import format_history
+    from server_log import ServerLog
     from device_models import Spd3303x
     from device_models import Mr50040
     from assemblies import HeaterAssembly
+    from assemblies import get_assemblies_snapshot
     from device_type import Heater
     try:
         from device_models import ETcWindows
@@ -23,9 +41,17 @@ try:
         pass
 
 except ModuleNotFoundError:
+    from automation import oven_protocol
+    from automation.connection_type import retry_with_backoff
+    from automation.device_stats import LatencyHistogram
+    from automation.pid_bank import PidBank
+    from automation.telemetry_history import HISTORY_CHUNK
+    from automation.telemetry_history import format_history
+    from automation.server_log import ServerLog
     from automation.device_models import Spd3303x
     from automation.device_models import Mr50040
     from automation.assemblies import HeaterAssembly
+    from automation.assemblies import get_assemblies_snapshot
     from automation.device_type import Heater
     try:
         from automation.device_models import ETcWindows
@@ -37,7 +63,18 @@ except ModuleNotFoundError:
         pass
 
 
-
+MAX_COMMAND_LENGTH = 4096  # longest command accepted, in bytes, without its '\r' terminator
+# Number of assemblies from which the OvenServer regulates them all with one BankControlLoop. Below it, a PidBank step
+# costs more than calling one simple_pid.PID per assembly.
+BANK_MIN_ZONES = 16
+asm_status = {}  # assembly key: 'connecting', 'ready', or 'failed'. Updated by start_assemblies()
+# Changes every time a command changes a setting, so that clients caching settings know when to drop them (OV:GENR).
+# Starts at the start time in ms, so a restarted server does not repeat a generation a client has already seen.
+settings_generation = int(time.time() * 1000)
+# run_command() is called from the selector thread and from the assembly workers at the same time
+_generation_lock = threading.Lock()
+log = logging.getLogger('oven.server')
+command_log = logging.getLogger('oven.command')
 
 
 def get_host_ip(loopback=False):
@@ -70,6 +107,230 @@ def get_host_ip(loopback=False):
         return socket.gethostbyname(socket.gethostname())
 
 
+def start_assemblies(asm_factories, asm_dict, initial_delay=1, max_delay=60):
+    """
+    Build every HeaterAssembly in its own background thread so that all the devices connect at the same time. An
+    assembly is added to asm_dict as soon as it is built, so assemblies whose devices are up can be regulated while the
+    others keep retrying. If a factory raises OSError, e.g. because a device does not answer, the failure is logged
+    and the factory is called again after a wait that doubles after every failure, up to max_delay. Any other
+    exception is a setup mistake that retrying cannot fix: it is logged and the assembly is marked as 'failed'.
+
+    Parameters
+    ----------
+    asm_factories : dictionary of str: callable
+        Maps each assembly key to a function without arguments that creates and returns the HeaterAssembly. Keys are
+        not case-sensitive.
+    asm_dict : dictionary of str: HeaterAssembly
+        dictionary used by the server. Assemblies are added to it with uppercase keys once they are built.
+    initial_delay : float
+        wait in seconds after the first failed attempt.
+    max_delay : float
+        longest wait in seconds between attempts.
+
+    Returns
+    -------
+    list of threading.Thread
+        The threads building the assemblies.
+    """
+    def attempt(key, factory):
+        try:
+            return factory()
+        except OSError as err:
+            log.warning('Assembly %s could not connect, retrying: %r', key, err)
+            raise
+
+    def build(key, factory):
+        try:
+            asm = retry_with_backoff(lambda: attempt(key, factory), None, initial_delay, max_delay)
+        except Exception:
+            asm_status[key] = 'failed'
+            log.warning('Assembly %s could not be built, giving up.', key, exc_info=True)
+            return
+        asm_dict[key] = asm
+        asm_status[key] = 'ready'
+        log.info('Assembly %s is ready.', key)
+
+    threads = []
+    for key, factory in asm_factories.items():
+        key = key.upper()
+        asm_status[key] = 'connecting'
+        thread = threading.Thread(target=build, args=(key, factory), name='start ' + key, daemon=True)
+        thread.start()
+        threads.append(thread)
+    return threads
+
+
+class CommandHandler:
+    """
+    Descriptor of a HeaterAssembly command of the server: what to call for queries, what to call for setters, and how
+    to convert the parameter of setters.
+    """
+    __slots__ = ('device', 'getter', 'setter', 'param_type', 'action', 'inline', 'query_param')
+
+    def __init__(self, device, getter, setter=None, param_type=float, action=False, inline=False, query_param=False):
+        """
+        Parameters
+        ----------
+        device : str
+            device part of the command: 'PS', 'DQ', 'PD', 'HT', or 'AM'.
+        getter : callable
+            called as getter(asm) for queries ('?' parameter). Commands without a setter call it whatever the
+            parameter, so it is also used for actions like PS:RSET.
+        setter : callable, None
+            called as setter(asm, param_type(param)) for any parameter other than '?'. None for commands that do not
+            take a parameter.
+        param_type : callable
+            converts the parameter string. Raises ValueError if the parameter is not valid.
+        action : bool
+            True if the getter changes settings, like PD:RSET. Setters count as changing settings, unless query_param
+            is True. See settings_generation.
+        inline : bool
+            True if neither the getter nor the setter talk to a device, like PD:KPRO. The OvenServer runs these
+            commands on its selector thread. The others run on the worker thread of their assembly.
+        query_param : bool
+            True if the setter is a query that takes a parameter, like TM:HIST, and does not change settings. See
+            settings_generation.
+        """
+        self.device = device
+        self.getter = getter
+        self.setter = setter
+        self.param_type = param_type
+        self.action = action
+        self.inline = inline
+        self.query_param = query_param
+
+
+def _set_regulation(asm, regt):
+    if regt == 1:
+        asm.ready_assembly()
+        return asm.set_pid_regulation(True)
+    elif regt == 0:
+        asm.set_pid_regulation(False)
+        return asm.set_supply_voltage(0)
+
+
+def _oven_keys(asm_dict, server):
+    out = ''
+    for key in list(asm_dict.keys()):
+        out += key + ' '
+    return out
+
+
+def _oven_loops(asm_dict, server):
+    if server is None:
+        return ''
+    return '; '.join(key + ' ' + loop.stats.format() for key, loop in list(server.control_loops.items()))
+
+
+def _oven_generation(asm_dict, server):
+    return str(settings_generation)
+
+
+def _oven_snapshot(asm_dict, server):
+    out = []
+    for key, snap in get_assemblies_snapshot(asm_dict).items():
+        if isinstance(snap, str):
+            out.append(key + ' ' + snap.replace(';', ','))
+        else:
+            out.append(key + ' ' + ' '.join(name + '=' + str(value) for name, value in snap.items()))
+    return '; '.join(out)
+
+
+def _oven_status(asm_dict, server):
+    out = ''
+    for key in list(asm_dict.keys()) + [k for k in asm_status if k not in asm_dict]:
+        if key not in asm_dict:
+            state = asm_status[key]
+        elif asm_dict[key].is_ready:
+            state = 'ready'
+        else:
+            state = 'not ready'
+        out += key + ':' + state + ' '
+    return out
+
+
+def build_command_table():
+    """
+    Build the table used by process_command() to dispatch the commands. Adding a command to the server only takes adding
+    it here.
+
+    Returns
+    -------
+    dictionary of str: CommandHandler
+        maps every '<device>:<command>' string, e.g. 'PS:VOLT', to its handler.
+    """
+    h = CommandHandler
+    return {
+        # Power supply
+        'PS:IDN': h('PS', lambda asm: asm.power_supply),
+        'PS:RSET': h('PS', lambda asm: asm.reset_power_supply(), action=True),
+        'PS:STOP': h('PS', lambda asm: asm.stop_supply(), action=True),
+        'PS:REDY': h('PS', lambda asm: asm.ready_power_supply(), action=True),
+        'PS:VOLT': h('PS', lambda asm: asm.get_supply_actual_voltage(), lambda asm, v: asm.set_supply_voltage(v)),
+        'PS:VSET': h('PS', lambda asm: asm.get_supply_setpoint_voltage(), lambda asm, v: asm.set_supply_voltage(v)),
+        'PS:AMPS': h('PS', lambda asm: asm.get_supply_actual_current(), lambda asm, a: asm.set_supply_current(a)),
+        'PS:ASET': h('PS', lambda asm: asm.get_supply_setpoint_current(), lambda asm, a: asm.set_supply_current(a)),
+        'PS:VLIM': h('PS', lambda asm: asm.get_supply_voltage_limit(),
+                     lambda asm, v: asm.set_supply_voltage_limit(v)),
+        'PS:ALIM': h('PS', lambda asm: asm.get_supply_current_limit(),
+                     lambda asm, a: asm.set_supply_current_limit(a)),
+        'PS:CHIO': h('PS', lambda asm: asm.get_supply_channel_state(),
+                     lambda asm, state: asm.set_supply_channel_state(state), lambda p: bool(int(p))),
+        'PS:CHAN': h('PS', lambda asm: asm.get_supply_channel(), lambda asm, ch: asm.set_supply_channel(ch), int),
+
+        # DAQ
+        'DQ:IDN': h('DQ', lambda asm: asm.daq),
+        'DQ:TEMP': h('DQ', lambda asm: asm.get_daq_temp()),
+        'DQ:CHAN': h('DQ', lambda asm: asm.get_daq_channel(), lambda asm, ch: asm.set_daq_channel(ch), int),
+        'DQ:TCTY': h('DQ', lambda asm: asm.get_daq_tc_type(), lambda asm, tc: asm.set_daq_tc_type(tc), str),
+        'DQ:UNIT': h('DQ', lambda asm: asm.get_daq_temp_units(), lambda asm, u: asm.set_daq_temp_units(u), str),
+
+        # PID settings
+        'PD:IDN': h('PD', lambda asm: asm.pid_settings, inline=True),
+        'PD:RSET': h('PD', lambda asm: asm.reset_pid(), action=True),
+        'PD:RLIM': h('PD', lambda asm: asm.reset_pid_limits(), action=True),
+        'PD:LIMS': h('PD', lambda asm: asm.get_pid_limits(), inline=True),
+        'PD:KPRO': h('PD', lambda asm: asm.pid_kp, lambda asm, k: setattr(asm, 'pid_kp', k), inline=True),
+        'PD:KINT': h('PD', lambda asm: asm.pid_ki, lambda asm, k: setattr(asm, 'pid_ki', k), inline=True),
+        'PD:KDER': h('PD', lambda asm: asm.pid_kd, lambda asm, k: setattr(asm, 'pid_kd', k), inline=True),
+        'PD:SETP': h('PD', lambda asm: asm.get_pid_setpoint(), lambda asm, t: asm.set_pid_setpoint(t), inline=True),
+        'PD:SAMP': h('PD', lambda asm: asm.get_pid_sample_time(), lambda asm, t: asm.set_pid_sample_time(t),
+                     inline=True),
+        'PD:REGT': h('PD', lambda asm: asm.get_pid_regulation(), _set_regulation, int),
+
+        # Heater settings
+        'HT:TMAX': h('HT', lambda asm: asm.get_heater_MAX_temp(), lambda asm, t: asm.set_heater_MAX_temp(t)),
+        'HT:VMAX': h('HT', lambda asm: asm.get_heater_MAX_volts(), lambda asm, v: asm.set_heater_MAX_volts(v)),
+        'HT:AMAX': h('HT', lambda asm: asm.get_heater_MAX_current(), lambda asm, a: asm.set_heater_MAX_current(a)),
+
+        # Telemetry history: the samples after a time.time() value, at most HISTORY_CHUNK of them
+        'TM:HIST': h('TM', lambda asm: format_history(asm.history.since(0, HISTORY_CHUNK)),
+                     lambda asm, t: format_history(asm.history.since(t, HISTORY_CHUNK)), inline=True,
+                     query_param=True),
+
+        # Assembly
+        'AM:STOP': h('AM', lambda asm: asm.stop(), action=True),
+        'AM:RSET': h('AM', lambda asm: asm.reset_assembly(), action=True),
+        'AM:REDY': h('AM', lambda asm: asm.ready_assembly(), action=True),
+        'AM:MAXV': h('AM', lambda asm: asm.MAX_voltage, inline=True),
+        'AM:MAXA': h('AM', lambda asm: asm.MAX_current, inline=True),
+    }
+
+
+COMMANDS = build_command_table()
+COMMAND_DEVICES = {handler.device for handler in COMMANDS.values()}
+OVEN_COMMANDS = {  # '<device>:<command>' of the OVEN key: function(asm_dict, server)
+    'OV:KEYS': _oven_keys,
+    'OV:STAT': _oven_status,
+    'OV:LOOP': _oven_loops,
+    'OV:SNAP': _oven_snapshot,
+    'OV:GENR': _oven_generation,
+}
+OVEN_DEVICE_COMMANDS = {'OV:SNAP'}  # OVEN commands that talk to the devices, run on a worker thread by OvenServer
+BINARY_COMMANDS = list(COMMANDS) + list(OVEN_COMMANDS)  # command ids of the binary protocol
+NEEDS_CONNECTION = ('PS', 'DQ', 'AM')  # devices whose commands fail until the assembly is connected
+
+
 def process_command(cmd, asm_dict):
     """
     Takes a command and tries to process it. Processing can mean to change a setting in a device of a HeaterAssembly, or
@@ -83,6 +344,9 @@ def process_command(cmd, asm_dict):
     Some commands don't take parameters.
     \r All commands need to end with a carriage return character.
 
+    The command is looked up in the COMMANDS and OVEN_COMMANDS tables, which are built once when the module is
+    imported, so the cost of a command does not depend on how many commands the server has.
+
     Paramters
     ---------
     cmd : str
@@ -95,301 +359,1088 @@ def process_command(cmd, asm_dict):
     str
         Might return requested output string or error string.
     """
-    try:
-        asm_key, dev_comm, param = cmd.split()
+    parts = parse_command(cmd)
+    if isinstance(parts, str):
+        return parts
+    return run_command(*parts, asm_dict)
+
+
+def parse_command(cmd):
+    """
+    Split a command into the parts taken by run_command().
+
+    Returns
+    -------
+    tuple of (str, str, str)
+        assembly key and command in uppercase, and the parameter in uppercase or None.
+    str
+        If the command is missing parts, return an error string.
+    """
+    parts = cmd.split()
+    if len(parts) == 3:
+        asm_key, dev_comm, param = parts
         param = param.upper()
-    except ValueError:
-        try:
-            asm_key, dev_comm = cmd.split()
-        except ValueError:
-            return 'ERROR: ' + str(cmd) + ' could not be processed. Missing assembly key or command'
+    elif len(parts) == 2:
+        asm_key, dev_comm = parts
+        param = None
+    else:
+        return 'ERROR: ' + str(cmd) + ' could not be processed. Missing assembly key or command'
+    return asm_key.upper(), dev_comm.upper(), param
+
 
-    asm_key = asm_key.upper()
-    dev_comm = dev_comm.upper()
-    dev, comm = dev_comm.split(':')
+def run_command(asm_key, dev_comm, param, asm_dict, server=None):
+    """
+    Run a command that is already split into its parts. Used by process_command(), and directly by the binary protocol
+    (see oven_protocol.py), which does not need to format and parse the command.
+
+    Parameters
+    ----------
+    asm_key : str
+        assembly key or 'OVEN', in uppercase.
+    dev_comm : str
+        command, e.g. 'PS:VOLT', in uppercase.
+    param : str, float, None
+        '?' for queries, the parameter of setters as a string or a number, or None.
+    asm_dict : dictionary of str: HeaterAssembly
+    server : OvenServer, None
+        server running the command, used by the OVEN commands that report on it, like OV:LOOP.
+
+    Returns
+    -------
+    str
+        Might return requested output string or error string.
+    """
+    global settings_generation
+    cmd = asm_key + ' ' + dev_comm + ('' if param is None else ' ' + str(param))
 
     # Oven commands
     # -------------
     if asm_key == 'OVEN':
-        if dev_comm == 'OV:KEYS':
-            out = ''
-            for key in asm_dict.keys():
-                out += key + ' '
-            return out
-        else:
+        try:
+            return OVEN_COMMANDS[dev_comm](asm_dict, server)
+        except KeyError:
             return 'ERROR: bad command' + str(cmd)
 
     try:
-        asm = asm_dict[asm_key.upper()]
+        asm = asm_dict[asm_key]
     except KeyError:
+        if asm_status.get(asm_key) == 'failed':
+            return 'ERROR: HeaterAssembly ' + asm_key + ' could not be built. See the server log'
+        if asm_key in asm_status:
+            return 'ERROR: HeaterAssembly ' + asm_key + ' is still connecting'
         return 'ERROR: HeaterAssembly name ' + asm_key + ' not found'
-    # Power supply commands
-    # ---------------------
-    try:
-        if dev == 'PS':
-            if comm == 'IDN':
-                return asm.power_supply
-            elif comm == 'RSET':
-                asm.reset_power_supply()
-            elif comm == 'STOP':
-                asm.stop_supply()
-            elif comm == 'REDY':
-                asm.ready_power_supply()
-            elif comm == 'VOLT':
-                if param == '?':
-                    return asm.get_supply_actual_voltage()
-                else:
-                    return asm.set_supply_voltage(float(param))
-            elif comm == 'VSET':
-                if param == '?':
-                    return asm.get_supply_setpoint_voltage()
-                else:
-                    return asm.set_supply_voltage(float(param))
-            elif comm == 'AMPS':
-                if param == '?':
-                    return asm.get_supply_actual_current()
-                else:
-                    return asm.set_supply_current(float(param))
-            elif comm == 'ASET':
-                if param == '?':
-                    return asm.get_supply_setpoint_current()
-                else:
-                    return asm.set_supply_current(float(param))
-            elif comm == 'VLIM':
-                if param == '?':
-                    return asm.get_supply_voltage_limit()
-                else:
-                    return asm.set_supply_voltage_limit(float(param))
-            elif comm == 'ALIM':
-                if param == '?':
-                    return asm.get_supply_current_limit()
-                else:
-                    return asm.set_supply_current_limit(float(param))
-            elif comm == 'CHIO':
-                if param == '?':
-                    return asm.get_supply_channel_state()
-                else:
-                    return asm.set_supply_channel_state(bool(int(param)))
-            elif comm == 'CHAN':
-                if param == '?':
-                    return asm.get_supply_channel()
-                else:
-                    return asm.set_supply_channel(int(param))
-            else:
-                return 'ERROR: bad command ' + str(cmd)
-
-            # DAQ commands
-        elif dev == 'DQ':
-            if comm == 'IDN':
-                return asm.daq
-            elif comm == 'TEMP':
-                return asm.get_daq_temp()
-            elif comm == 'CHAN':
-                if param == '?':
-                    return asm.get_daq_channel()
-                else:
-                    return asm.set_daq_channel(int(param))
-            elif comm == 'TCTY':
-                if param == '?':
-                    return asm.get_daq_tc_type()
-                else:
-                    return asm.set_daq_tc_type(param)
-            elif comm == 'UNIT':
-                if param == '?':
-                    return asm.get_daq_temp_units()
-                else:
-                    return asm.set_daq_temp_units(param)
-            else:
-                return 'ERROR: bad command ' + str(cmd)
-
-            # PID settings
-        elif dev == 'PD':
-            if comm == 'IDN':
-                return asm.pid_settings
-            elif comm == 'RSET':
-                return asm.reset_pid()
-            elif comm == 'RLIM':
-                return asm.reset_pid_limits()
-            elif comm == 'LIMS':
-                if param == '?':
-                    return asm.get_pid_limits()
-            elif comm == 'KPRO':
-                if param == '?':
-                    return asm.pid_kp
-                else:
-                    asm.pid_kp = float(param)
-            elif comm == 'KINT':
-                if param == '?':
-                    return asm.pid_ki
-                else:
-                    asm.pid_ki = float(param)
-            elif comm == 'KDER':
-                if param == '?':
-                    return asm.pid_kd
-                else:
-                    asm.pid_kd = float(param)
-            elif comm == 'SETP':
-                if param == '?':
-                    return asm.get_pid_setpoint()
-                else:
-                    return asm.set_pid_setpoint(float(param))
-            elif comm == 'SAMP':
-                if param == '?':
-                    return asm.get_pid_sample_time()
-                else:
-                    return asm.set_pid_sample_time(float(param))
-            elif comm == 'REGT':
-                if param == '?':
-                    return asm.get_pid_regulation()
-                elif int(param) == 1:
-                    asm.ready_assembly()
-                    return asm.set_pid_regulation(True)
-                elif int(param) == 0:
-                    asm.set_pid_regulation(False)
-                    return asm.set_supply_voltage(0)
-            else:
-                return 'ERROR: bad command ' + str(cmd)
 
-                # Heater settings
-        elif dev == 'HT':
-            if comm == 'TMAX':
-                if param == '?':
-                    return asm.get_heater_MAX_temp()
-                else:
-                    return asm.set_heater_MAX_temp(float(param))
-            elif comm == 'VMAX':
-                if param == '?':
-                    return asm.get_heater_MAX_volts()
-                else:
-                    return asm.set_heater_MAX_volts(float(param))
-            elif comm == 'AMAX':
-                if param == '?':
-                    return asm.get_heater_MAX_current()
-                else:
-                    return asm.set_heater_MAX_current(float(param))
-            else:
-                return 'ERROR: bad command ' + str(cmd)
-
-            # Assembly
-        elif dev == 'AM':
-            if comm == 'STOP':
-                return asm.stop()
-            elif comm == 'RSET':
-                return asm.reset_assembly()
-            elif comm == 'REDY':
-                return asm.ready_assembly()
-            elif comm == 'MAXV':
-                return asm.MAX_voltage
-            elif comm == 'MAXA':
-                return asm.MAX_current
-            else:
-                return 'ERROR: bad command ' + str(comm)
+    handler = COMMANDS.get(dev_comm)
+    if handler is None:
+        dev = dev_comm.partition(':')[0]
+        if dev in COMMAND_DEVICES:
+            return 'ERROR: bad command ' + str(cmd)
+        return 'ERROR: bad device ' + str(dev)
+    if handler.device in NEEDS_CONNECTION and not asm.is_ready:
+        return 'ERROR: HeaterAssembly ' + asm_key + ' is not connected'
 
-            # Bad Device
+    # Assembly commands
+    # -----------------
+    try:
+        if handler.setter is None or param == '?':
+            out = handler.getter(asm)
+            if not handler.action:
+                return out
+        elif param is None:
+            return 'ERROR: parameter missing for ' + str(cmd)
         else:
-            return 'ERROR: bad device ' + str(dev)
-
-    except NameError:
-        return 'ERROR: parameter missing for ' + str(cmd)
+            out = handler.setter(asm, handler.param_type(param))
+            if handler.query_param:
+                return out
     except ValueError:
         return 'ERROR: bad parameter ' + str(param)
-    return
 
+    if not (isinstance(out, str) and out.startswith('ERROR')):
+        with _generation_lock:
+            settings_generation += 1
+    return out
 
-def update_heaters(asm_dict, t0_dict):
+
+def log_update(logger, key, out, sample=None):
     """
-    For all HeaterAssembly object used by the Oven, check if the pid is set to regulate and check if the sampling
-    time has passed. If yes, then set the power supply to a new value based on the PID output.
-    Parameters
-    ----------
-    asm_dict : dictionary of str: HeaterAssembly
-        Should contain all the HeaterAssembly objects used by the oven. The function will iterate through this
-        dictionary checking if it should update their respective power supply.
-    t0_dict: dictionary of str: float
-        Used to keep track of the sampling time for each individual HeaterAssembly
+    Log the result of HeaterAssembly.update_supply(): the ControlSample of the update as INFO, errors as WARNING.
+    """
+    if isinstance(out, str):
+        logger.warning('%s: %s', key, out)
+    elif sample is None:
+        logger.info('%s: %s', key, out)
+    else:
+        logger.info('%s: temp=%s volts=%.3f setpoint=%s', key, sample.temp, sample.volts, sample.setpoint)
+
+
+def _encode_line(out):
+    """
+    Change the output of a command into its ASCII reply.
+    """
+    if out is None:
+        out = 'NOERROR'
+    return (str(out) + '\r').encode('utf-8')
+
+
+def format_telemetry(key, record):
+    """
+    Format a telemetry record of an AssemblyControlLoop as the line pushed to subscribers. See
+    OvenServer._push_telemetry().
 
     Returns
     -------
-    dictionary of str: float
-        the same dictionary used to keep track of sampling time. Should be used as the input for the same function
-        in the next iteration.
+    str
+        the line, including its '\r' terminator.
+    """
+    out = '#TM ' + key + ' time=' + '{:.3f}'.format(record['time'])
+    if record['error'] is not None:
+        return out + ' ' + record['error'].replace('\r', ' ') + '\r'
+    return out + ' temp=' + str(record['temp']) + ' volts=' + str(record['volts']) + ' setpoint=' \
+        + str(record['setpoint']) + '\r'
+
+
+class LoopStats:
+    """
+    Timing statistics of an AssemblyControlLoop. Jitter is how late an update started after its deadline.
     """
-    out_dict = {}
-    for key, asm in asm_dict.items():
-        if asm.get_pid_regulation() and time.time() - t0_dict[key] >= asm.get_pid_sample_time():
-            out_or_err = asm.update_supply()
-            t0_dict[key] = time.time()
-            out_dict[key] = out_or_err
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.count = 0
+            self.overruns = 0
+            self.missed = 0
+            self.errors = 0
+            self._jitter_total = 0.0
+            self.jitter_max = 0.0
+            self._jitter_histogram = LatencyHistogram()
+            self._duration_total = 0.0
+            self.duration_max = 0.0
+
+    def record(self, jitter, duration, missed=0, error=False):
+        """
+        Parameters
+        ----------
+        jitter : float
+            time in seconds between the deadline of the update and its start.
+        duration : float
+            time in seconds the update took.
+        missed : int
+            number of deadlines that passed while the update ran. Those updates are skipped.
+        error : bool
+            True if the update returned an error.
+        """
+        with self._lock:
+            self.count += 1
+            self._jitter_total += jitter
+            self.jitter_max = max(self.jitter_max, jitter)
+            self._jitter_histogram.add(jitter)
+            self._duration_total += duration
+            self.duration_max = max(self.duration_max, duration)
+            if missed:
+                self.overruns += 1
+                self.missed += missed
+            if error:
+                self.errors += 1
 
-    for key in out_dict:
-        print(key + ':', out_dict[key])
+    def snapshot(self):
+        """
+        Returns
+        -------
+        dict
+            keys: 'count', 'overruns', 'missed', 'errors', 'jitter_mean', 'jitter_p99', 'jitter_max', 'duration_mean',
+            and 'duration_max'. Times in seconds, None if there were no updates.
+        """
+        with self._lock:
+            n = self.count
+            return {
+                'count': n,
+                'overruns': self.overruns,
+                'missed': self.missed,
+                'errors': self.errors,
+                'jitter_mean': self._jitter_total / n if n else None,
+                'jitter_p99': min(self._jitter_histogram.percentile(99), self.jitter_max) if n else None,
+                'jitter_max': self.jitter_max if n else None,
+                'duration_mean': self._duration_total / n if n else None,
+                'duration_max': self.duration_max if n else None,
+            }
 
-    return t0_dict, out_dict
+    def format(self):
+        """
+        Returns
+        -------
+        str
+            the snapshot as 'name=value' pairs separated by spaces, times in milliseconds.
+        """
+        out = []
+        for name, value in self.snapshot().items():
+            if name in ('count', 'overruns', 'missed', 'errors'):
+                out.append(name + '=' + str(value))
+            elif value is None:
+                out.append(name + '_ms=-')
+            else:
+                out.append(name + '_ms=' + '{:.3f}'.format(value * 1000))
+        return ' '.join(out)
+
+
+class AssemblyControlLoop:
+    def __init__(self, key, asm, idle_interval=0.1, listener=None):
+        """
+        Thread regulating a single HeaterAssembly. Updates are scheduled at fixed deadlines on the monotonic clock,
+        one PID sample time apart, so a slow update of one assembly does not delay the others, and the sample
+        interval does not drift. If an update takes longer than a sample time, the deadlines that passed are skipped
+        and counted as an overrun.
+
+        Parameters
+        ----------
+        key : str
+            key of the assembly, used for logging (logger oven.control.<key>).
+        asm : HeaterAssembly
+        idle_interval : float
+            time in seconds between checks of the assembly while it is not regulating or not connected.
+        listener : callable, None
+            called as listener(key, record) after every update, from the thread of the loop. record is a dictionary
+            with 'time' (time.time() at the start of the update), 'temp', 'volts' (PID output), 'setpoint', and
+            'error', which is None unless the update failed. Should return quickly.
+        """
+        self._key = key
+        self._asm = asm
+        self._idle_interval = idle_interval
+        self._listener = listener
+        self._log = logging.getLogger('oven.control.' + key)
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = LoopStats()
 
+    @property
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
 
-def server_loop(asm_dict):
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='control ' + self._key, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+
+    def _run(self):
+        asm = self._asm
+        deadline = time.monotonic()
+        last = None  # start of the last update
+        while not self._stop.wait(max(deadline - time.monotonic(), 0)):
+            start = time.monotonic()
+            wall_time = time.time()
+            if not asm.is_ready or not asm.get_pid_regulation():
+                deadline = start + self._idle_interval
+                last = None
+                continue
+
+            period = asm.get_pid_sample_time()
+            if last is None:  # first update after regulation was turned on
+                deadline = start
+            scheduled = deadline
+            try:
+                out = asm.update_supply(dt=max(start - last, period) if last is not None else None)
+            except Exception as err:  # never let a bad reading stop the regulation
+                out = 'ERROR: control loop: ' + repr(err)
+            end = time.monotonic()
+
+            deadline += period
+            missed = 0
+            if end > deadline:
+                missed = int((end - deadline) // period) + 1
+                deadline += missed * period
+            self.stats.record(start - scheduled, end - start, missed, isinstance(out, str))
+            last = start
+            _report_update(self._log, self._listener, self._key, asm, out, wall_time)
+
+
+def _report_update(logger, listener, key, asm, out, wall_time):
     """
-    Server that istens for commands from a remote machine, then executes the command on the respective assembly object.
-    The server will continue to regulate an oven regardless of the connection of the remote machine. This means that if
-    the connection to the remote machine is lost, the server will still continue to regulate the temperature of the
-    heater assembly.
+    Log the result of a control update of an assembly and pass its record to the listener of the control loop. See
+    AssemblyControlLoop.
+    """
+    sample = None if isinstance(out, str) else asm.last_sample
+    log_update(logger, key, out, sample)
+    if listener is None:
+        return
+    if sample is None:
+        listener(key, {
+            'time': wall_time,
+            'temp': None,
+            'volts': asm.last_output,
+            'setpoint': asm.get_pid_setpoint(),
+            'error': out,
+        })
+    else:
+        listener(key, {
+            'time': sample.time,
+            'temp': sample.temp,
+            'volts': sample.volts,
+            'setpoint': sample.setpoint,
+            'error': None,
+        })
 
-    Parameters:
-    asm_dict : dictionary of str: HeaterAssembly
-        dictionary containing all the HeaterAssembly objects to be used by the oven and their respective keys. The
-        keys are used to identify each HeaterAssembly in the Oven class. Keys are not case-sensitive.
 
+def _read_control_temp(asm):
+    try:
+        return asm.read_control_temp()
+    except Exception as err:  # never let a bad reading stop the regulation
+        return time.time(), 'ERROR: control loop: ' + repr(err)
+
+
+def _apply_control_output(asm, t, temp, volts):
+    try:
+        return asm.apply_control_output(t, temp, volts)
+    except Exception as err:
+        return 'ERROR: control loop: ' + repr(err)
+
+
+class _BankZone:
+    """
+    Assembly regulated by a BankControlLoop. Takes the place of an AssemblyControlLoop in OvenServer.control_loops.
+    """
+    def __init__(self, loop, key, asm):
+        self.key = key
+        self.asm = asm
+        self.stats = LoopStats()
+        self.log = logging.getLogger('oven.control.' + key)
+        self.deadline = 0.0  # time.monotonic() of the next update
+        self.last = None  # start of the last update, None while not regulating
+        self.busy = False  # True while its voltage is being written
+        self._loop = loop
+
+    def stop(self, timeout=None):
+        """
+        Stop regulating the assembly. The loop goes on with the others.
+        """
+        self._loop.remove(self.key)
+
+
+class BankControlLoop:
+    def __init__(self, bank=None, idle_interval=0.1, listener=None, max_workers=32):
+        """
+        Thread regulating many HeaterAssembly objects with a single PidBank, for ovens with too many heater zones for
+        one AssemblyControlLoop each. At every tick, the temperatures of the assemblies that are due are read in
+        parallel, all their PIDs are updated with one PidBank.update(), and the new voltages are written to the supplies
+        in parallel. The loop does not wait for the writes: an assembly whose write is not done yet at its next
+        deadline skips that update, and the others keep their timing. Deadlines are kept per assembly as in
+        AssemblyControlLoop. An assembly that starts regulating joins the ticks of the assemblies with the same sample
+        time, so that they share the vectorized step.
+
+        Parameters
+        ----------
+        bank : PidBank, None
+            bank holding the PIDs of the assemblies. If None, a new one.
+        idle_interval : float
+            time in seconds between checks of the assemblies that are not regulating or not connected.
+        listener : callable, None
+            called as listener(key, record) after every update of an assembly, from the thread that finished it. See
+            AssemblyControlLoop.
+        max_workers : int
+            threads reading the DAQs and writing the power supplies. Each write waits for its supply to settle, so
+            there should be about one per assembly.
+        """
+        self._bank = PidBank() if bank is None else bank
+        self._idle_interval = idle_interval
+        self._listener = listener
+        self._zones = {}  # assembly key: _BankZone
+        self._lock = threading.Lock()  # held while changing the zones and their schedule
+        self._pool = concurrent.futures.ThreadPoolExecutor(max_workers, thread_name_prefix='bank io')
+        self._stop = threading.Event()
+        self._wake = threading.Event()  # set by stop() and when a write is done
+        self._thread = None
+
+    @property
+    def bank(self):
+        return self._bank
+
+    @property
+    def is_alive(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def add(self, key, asm):
+        """
+        Regulate an assembly. Its PID is moved into the bank (see HeaterAssembly.use_pid_bank()).
+
+        Returns
+        -------
+        _BankZone
+            the assembly in the loop, with the LoopStats of its updates.
+        """
+        asm.use_pid_bank(self._bank)
+        zone = _BankZone(self, key, asm)
+        with self._lock:
+            self._zones[key] = zone
+        self._wake.set()
+        return zone
+
+    def remove(self, key):
+        with self._lock:
+            self._zones.pop(key, None)
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='control bank', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        self._pool.shutdown(wait=False)
+
+    def _run(self):
+        while not self._stop.is_set():
+            start = time.monotonic()
+            due = []
+            wake = start + self._idle_interval
+            with self._lock:
+                for zone in self._zones.values():
+                    if zone.busy:
+                        continue
+                    if not zone.asm.is_ready or not zone.asm.get_pid_regulation():
+                        zone.last = None
+                        continue
+                    if zone.last is None:  # first update after regulation was turned on
+                        zone.deadline = start
+                    if zone.deadline <= start:
+                        due.append(zone)
+                        zone.busy = True
+                    else:
+                        wake = min(wake, zone.deadline)
+            if due:
+                self._tick(due, start)
+                continue
+            self._wake.wait(max(wake - time.monotonic(), 0))
+            self._wake.clear()
+
+    def _tick(self, due, start):
+        """
+        Update the assemblies that are due: read their temperatures, one PidBank step, then start writing their
+        voltages.
+        """
+        wall_time = time.time()
+        readings = list(self._pool.map(_read_control_temp, [zone.asm for zone in due]))
+
+        with self._bank.lock:  # no slot is added or released while the inputs are laid out by index
+            slots = [None if isinstance(temp, str) else zone.asm.pid for zone, (t, temp) in zip(due, readings)]
+            inputs = np.full(len(self._bank), np.nan)  # nan: not updated
+            dt = np.zeros(len(self._bank))
+            for zone, (t, temp), slot in zip(due, readings, slots):
+                if slot is not None:
+                    inputs[slot.index] = temp
+                    dt[slot.index] = slot.sample_time if zone.last is None else max(start - zone.last, slot.sample_time)
+            outputs = self._bank.update(inputs, dt)
+            volts = [None if slot is None else float(outputs[slot.index]) for slot in slots]
+
+        for zone, (t, temp), v in zip(due, readings, volts):
+            if v is None:
+                self._done(zone, start, wall_time, temp)
+                continue
+            future = self._pool.submit(_apply_control_output, zone.asm, t, temp, v)
+            future.add_done_callback(
+                lambda f, zone=zone: self._done(zone, start, wall_time, f.result()))
+
+    def _done(self, zone, start, wall_time, out):
+        """
+        Finish an update: schedule the next one, record its timing, and report it.
+        """
+        end = time.monotonic()
+        period = zone.asm.get_pid_sample_time()
+        with self._lock:
+            scheduled = zone.deadline
+            missed = 0
+            if zone.last is None:  # share the ticks of the assemblies already regulating with the same sample time
+                deadline = start + period
+                for other in self._zones.values():
+                    if other is not zone and other.last is not None and other.asm.get_pid_sample_time() == period:
+                        deadline = other.deadline
+                        while deadline <= end:
+                            deadline += period
+                        break
+                zone.deadline = deadline
+            else:
+                zone.deadline += period
+                if end > zone.deadline:
+                    missed = int((end - zone.deadline) // period) + 1
+                    zone.deadline += missed * period
+            zone.last = start
+            zone.busy = False
+        zone.stats.record(start - scheduled, end - start, missed, isinstance(out, str))
+        _report_update(zone.log, self._listener, zone.key, zone.asm, out, wall_time)
+        self._wake.set()
+
+
+class _Client:
+    """
+    State of a client connected to the OvenServer.
     """
-    keys_raw = list(asm_dict)
-    for key in keys_raw:      # change all keys to uppercase
-        asm_dict[key.upper()] = asm_dict.pop(key)
+    __slots__ = ('sock', 'addr', 'rx', 'tx', 'pending', 'subs', 'updates', 'keys')
 
-    HOST = get_host_ip(loopback=False)  # set to False for BeagleBoneBlack use,
-    # HOST = get_host_ip(loopback=True)  # set to True for testing with local host,
-    PORT = 65432
+    def __init__(self, sock, addr):
+        self.sock = sock
+        self.addr = addr
+        self.rx = bytearray()  # bytes of commands not complete yet
+        self.tx = bytearray()  # replies not sent yet
+        self.pending = collections.deque()  # [reply bytes or None] of each command, in order, from the first unfinished
+        self.subs = {}  # assembly key, or None for all assemblies: decimation of the telemetry
+        self.updates = {}  # assembly key: number of updates since subscribing
+        self.keys = None  # assembly keys by index if the client uses the binary protocol, else None
+
+
+class _AssemblyWorker:
+    """
+    Thread running the commands of an assembly that talk to its devices, one at a time, in the order they were
+    submitted, so the selector thread of the OvenServer never waits for an instrument.
+    """
+    def __init__(self, key, on_done):
+        """
+        Parameters
+        ----------
+        key : str
+            assembly key, or 'OVEN' for the OVEN commands that talk to the devices.
+        on_done : callable
+            called as on_done(key, done, out) from the worker thread after every command.
+        """
+        self.key = key
+        self.busy = 0  # commands submitted and not done yet. Only used by the selector thread
+        self._on_done = on_done
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name='commands ' + key, daemon=True)
+        self._thread.start()
 
-    s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    s.bind((HOST, PORT))
-    print('Bound to', HOST, PORT)
+    def submit(self, func, done):
+        """
+        Run func() on the worker thread, then pass its return value to done() on the selector thread.
+        """
+        self.busy += 1
+        self._queue.put((func, done))
 
-    while True:
-        t0_dict = {}
-        for key in asm_dict.keys():
-            t0_dict[key] = time.time()  # Keeps track of time for every assembly. Used for update_heaters()
+    def stop(self):
+        self._queue.put(None)
 
-        while True:  # Listen for connections for one second. If timeout, update heaters using stored PID settings.
-            s.settimeout(1)
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                return
+            func, done = job
             try:
-                print('listening')
-                s.listen()
-                conn, addr = s.accept()
-                break
-            except socket.timeout:
-                t0_dict, out_dict = update_heaters(asm_dict, t0_dict)
+                out = func()
+            except Exception as err:  # never let a bad command stop the worker
+                log.exception('Command of %s failed', self.key)
+                out = 'ERROR: ' + repr(err)
+            self._on_done(self.key, done, out)
+
+
+class OvenServer:
+    def __init__(self, asm_dict, host, port=65432, control_interval=0.1, bank_min_zones=BANK_MIN_ZONES):
+        """
+        Server that listens for commands from any number of remote machines at the same time, then executes the
+        commands on the respective assembly objects. A single thread waits on all the sockets with selectors. Commands
+        that only touch settings kept in memory (OVEN commands, PID gains, telemetry history, ...) are answered on
+        that thread as soon as they arrive. Commands that talk to an instrument run on a worker thread of their
+        assembly, one at a time and in order, so a slow instrument only holds up the commands of its own assembly.
+        Every heater is regulated by its own control thread, so the control loops keep their timing regardless of the
+        clients and of each other, and keep running when every client disconnects. Ovens with many heaters are
+        regulated by a single BankControlLoop instead, which updates all their PIDs in one vectorized step.
+
+        Every command ends with '\r', and so does every reply. Bytes are buffered per client until the terminator
+        arrives, so a client can send many commands at once without waiting for each reply (see Oven.pipeline()).
+        The replies come back in the same order as the commands. After 'OVEN OV:BINR', a client speaks the binary
+        protocol of oven_protocol.py instead, where the reply of a command that runs on a worker is sent as soon as it
+        is done, possibly before the replies of commands received earlier.
+
+        Parameters
+        ----------
+        asm_dict : dictionary of str: HeaterAssembly
+            dictionary containing all the HeaterAssembly objects to be used by the oven and their respective keys. The
+            keys are used to identify each HeaterAssembly in the Oven class. Keys are not case-sensitive.
+        host : str
+            address to listen on.
+        port : int
+            port to listen on.
+        control_interval : float
+            time in seconds between checks for new assemblies in asm_dict. Every assembly is regulated by its own
+            AssemblyControlLoop.
+        bank_min_zones : int, None
+            If there are at least this many assemblies when the server starts, counting the ones still connecting
+            (see start_assemblies()), they are all regulated by one BankControlLoop instead. None to always use one
+            AssemblyControlLoop per assembly.
+        """
+        keys_raw = list(asm_dict)
+        for key in keys_raw:  # change all keys to uppercase
+            asm_dict[key.upper()] = asm_dict.pop(key)
+
+        self._asm_dict = asm_dict
+        self._host = host
+        self._port = port
+        self._control_interval = control_interval
+        self._selector = selectors.DefaultSelector()
+        self._listener = None
+        self._clients = {}
+        self._stop = threading.Event()
+        self._control_thread = None
+        self._bank_min_zones = bank_min_zones
+        self.control_loops = {}  # assembly key: AssemblyControlLoop, or its zone in the bank_loop
+        self.bank_loop = None  # BankControlLoop regulating every assembly, if there are bank_min_zones of them
+        self._telemetry = collections.deque(maxlen=10000)  # (key, record) waiting to be pushed to subscribers
+        self._subscribed = False  # True if any client subscribed to telemetry
+        self._workers = {}  # assembly key: _AssemblyWorker
+        self._done = collections.deque()  # (worker key, done, out) of the commands finished by the workers
+        self._wake_r, self._wake_w = socket.socketpair()  # wakes up the selector when telemetry or replies arrive
+        self._wake_r.setblocking(False)
+        self._wake_w.setblocking(False)
+
+    @property
+    def address(self):
+        if self._listener is None:
+            return self._host, self._port
+        return self._listener.getsockname()[:2]
+
+    @property
+    def clients(self):
+        """
+        Addresses of the connected clients.
+        """
+        return [client.addr for client in list(self._clients.values())]
+
+    def bind(self):
+        """
+        Start listening. Called by serve_forever() if needed.
+        """
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        s.bind((self._host, self._port))
+        s.listen()
+        s.setblocking(False)
+        self._listener = s
+        self._selector.register(s, selectors.EVENT_READ)
+        self._selector.register(self._wake_r, selectors.EVENT_READ)
+        log.info('Bound to %s %s', *self.address)
+
+    def serve_forever(self):
+        """
+        Start the control thread and serve the clients until stop() is called.
+        """
+        if self._listener is None:
+            self.bind()
+        self._stop.clear()
+        self._control_thread = threading.Thread(target=self._control_loop, name='oven control', daemon=True)
+        self._control_thread.start()
+
+        try:
+            while not self._stop.is_set():
+                for key, events in self._selector.select(timeout=0.5):
+                    if key.fileobj is self._listener:
+                        self._accept()
+                        continue
+                    if key.fileobj is self._wake_r:
+                        self._wake_up()
+                        continue
+                    client = self._clients.get(key.fileobj)
+                    if client is None:
+                        continue
+                    if events & selectors.EVENT_READ:
+                        self._read(client)
+                    if events & selectors.EVENT_WRITE and client.sock in self._clients:
+                        self._flush(client)
+        finally:
+            self._stop.set()
+            for worker in self._workers.values():
+                worker.stop()
+            self._workers.clear()
+            for client in list(self._clients.values()):
+                self._close(client)
+            self._selector.unregister(self._listener)
+            self._selector.unregister(self._wake_r)
+            self._listener.close()
+            self._listener = None
+
+    def stop(self):
+        """
+        Stop serving. serve_forever() returns within half a second.
+        """
+        self._stop.set()
+
+    def _control_loop(self):
+        """
+        Give every assembly its own AssemblyControlLoop, or a zone of the BankControlLoop if there are at least
+        bank_min_zones assemblies, including assemblies added after the server started.
+        """
+        n_zones = len(set(self._asm_dict) | set(asm_status))
+        if self._bank_min_zones is not None and n_zones >= self._bank_min_zones:
+            self.bank_loop = BankControlLoop(listener=self._on_update).start()
+        while not self._stop.wait(self._control_interval):
+            for key, asm in list(self._asm_dict.items()):
+                if key in self.control_loops:
+                    continue
+                if self.bank_loop is not None:
+                    self.control_loops[key] = self.bank_loop.add(key, asm)
+                else:
+                    self.control_loops[key] = AssemblyControlLoop(key, asm, listener=self._on_update).start()
+        for key in list(self.control_loops):
+            self.control_loops.pop(key).stop(timeout=5)
+        if self.bank_loop is not None:
+            self.bank_loop.stop(timeout=5)
+            self.bank_loop = None
+
+    def _on_update(self, key, record):
+        """
+        Listener of the control loops. Runs in their threads, so it only queues the record for the selector thread.
+        """
+        if not self._subscribed:
+            return
+        self._telemetry.append((key, record))
+        self._wake()
+
+    def _on_done(self, key, done, out):
+        """
+        Called by the workers when a command is done. Runs in their threads, so it only queues the reply for the
+        selector thread.
+        """
+        self._done.append((key, done, out))
+        self._wake()
+
+    def _wake(self):
+        try:
+            self._wake_w.send(b'\0')
+        except BlockingIOError:  # the selector has plenty of wake ups pending already
+            pass
+
+    def _wake_up(self):
+        """
+        Handle what the other threads queued for the selector thread: replies of the workers, and telemetry.
+        """
+        try:
+            while self._wake_r.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+
+        while self._done:
+            key, done, out = self._done.popleft()
+            worker = self._workers.get(key)
+            if worker is not None:
+                worker.busy -= 1
+            done(out)
+        if self._telemetry:
+            self._push_telemetry()
+
+    def _push_telemetry(self):
+        """
+        Send the queued telemetry records to the subscribed clients as lines:
+
+            #TM <assembly key> time=<time.time()> temp=<temp> volts=<PID output> setpoint=<PID setpoint>\r
 
+        or '#TM <assembly key> time=<time.time()> ERROR: ...\r' if the update failed.
+        """
+        touched = set()
+        while self._telemetry:
+            key, record = self._telemetry.popleft()
+            line = None
+            for client in list(self._clients.values()):
+                decimation = client.subs.get(key, client.subs.get(None))
+                if decimation is None:
+                    continue
+                n = client.updates.get(key, 0)
+                client.updates[key] = n + 1
+                if n % decimation:
+                    continue
+                if line is None:
+                    line = format_telemetry(key, record).encode('utf-8')
+                client.tx += line
+                touched.add(client)
+        for client in touched:
+            if client.sock in self._clients:
+                self._flush(client)
+
+    def _telemetry_command(self, client, cmd):
+        """
+        Subscribe a client to the telemetry of an assembly, or of all of them with the OVEN key:
+
+            <assembly key> TM:SUBS <decimation (optional)>\r     push every <decimation>-th update, default 1.
+            <assembly key> TM:UNSB\r                            stop pushing.
+
+        Returns
+        -------
+        str
+            Reply to the command: None or an error string.
+        """
+        parts = cmd.split()
+        asm_key = parts[0]
+        if asm_key == 'OVEN':
+            asm_key = None
+        elif asm_key not in self._asm_dict and asm_key not in asm_status:
+            return 'ERROR: HeaterAssembly name ' + asm_key + ' not found'
+
+        if parts[1] == 'TM:SUBS':
+            try:
+                decimation = int(parts[2]) if len(parts) > 2 else 1
+            except ValueError:
+                return 'ERROR: bad parameter ' + str(parts[2])
+            if decimation < 1:
+                return 'ERROR: bad parameter ' + str(parts[2])
+            client.subs[asm_key] = decimation
+        elif asm_key is None:
+            client.subs.clear()
+        else:
+            client.subs.pop(asm_key, None)
+        client.updates.clear()
+        self._update_subscribed()
+
+    def _update_subscribed(self):
+        self._subscribed = any(client.subs for client in list(self._clients.values()))
+
+    def _accept(self):
+        try:
+            conn, addr = self._listener.accept()
+        except BlockingIOError:
+            return
         conn.setblocking(False)
-        print(f"Connected by {addr}")
-        with conn:  # with connection: regulate oven, then listen for commands to carry on.
-            while True:
-                t0_dict, out_dict = update_heaters(asm_dict, t0_dict)
-                time.sleep(0.2)
-                try:
-                    data = conn.recv(1024).decode('utf-8').upper()
-                    if not data:
-                        print(f"Disconnected by {addr}")
-                        break
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._clients[conn] = _Client(conn, addr)
+        self._selector.register(conn, selectors.EVENT_READ)
+        log.info('Connected by %s', addr)
+
+    def _close(self, client):
+        log.info('Disconnected by %s', client.addr)
+        self._clients.pop(client.sock, None)
+        if client.subs:
+            self._update_subscribed()
+        try:
+            self._selector.unregister(client.sock)
+        except (KeyError, ValueError):
+            pass
+        client.sock.close()
+
+    def _read(self, client):
+        try:
+            data = client.sock.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:  # if connection is lost, forget the client
+            self._close(client)
+            return
+        if not data:
+            self._close(client)
+            return
+
+        client.rx += data
+        if client.keys is None:
+            self._read_lines(client)
+        if client.keys is not None:  # also if the client switched to binary in the middle of the data
+            self._read_frames(client)
+        if client.tx:
+            self._flush(client)
+
+    def _read_lines(self, client):
+        """
+        Run every complete ASCII command received from a client.
+        """
+        start = 0
+        while client.keys is None:
+            end = client.rx.find(b'\r', start)
+            if end == -1:
+                break
+            line = client.rx[start:end].decode('utf-8', 'replace').strip().upper()
+            start = end + 1
+            if not line:
+                continue
+            command_log.debug('%s %s', client.addr, line)
+            name = line.split()[1:2]
+            if name in (['TM:SUBS'], ['TM:UNSB']):
+                out = self._telemetry_command(client, line)
+            elif name == ['OV:BINR'] and line.startswith('OVEN'):
+                out = self._start_binary(client)
+            else:
+                parts = parse_command(line)
+                if isinstance(parts, str):
+                    out = parts
+                else:
+                    self._dispatch(client, *parts, encode=_encode_line)
+                    continue
+            self._reply(client, _encode_line(out))
+        del client.rx[:start]
+
+        if client.keys is None and len(client.rx) > MAX_COMMAND_LENGTH:  # never terminated, drop it
+            client.rx.clear()
+            self._reply(client, _encode_line('ERROR: command longer than ' + str(MAX_COMMAND_LENGTH) + ' bytes'))
+
+    def _worker_key(self, asm_key, dev_comm):
+        """
+        Returns
+        -------
+        str
+            key of the worker that has to run the command.
+        None
+            If the command can run on the selector thread.
+        """
+        if asm_key == 'OVEN':
+            return 'OVEN' if dev_comm in OVEN_DEVICE_COMMANDS else None
+        handler = COMMANDS.get(dev_comm)
+        if handler is None or asm_key not in self._asm_dict:  # answered right away with an error
+            return None
+        if handler.inline:
+            # keep the order of the commands of the assembly: wait behind the ones already sent to its worker
+            worker = self._workers.get(asm_key)
+            return asm_key if worker is not None and worker.busy else None
+        return asm_key
+
+    def _dispatch(self, client, asm_key, dev_comm, param, encode, ordered=True):
+        """
+        Run a command on the selector thread, or send it to the worker of its assembly.
+
+        Parameters
+        ----------
+        encode : callable
+            changes the output of run_command() into the bytes of the reply.
+        ordered : bool
+            If True, the reply is sent after the replies of the commands received before it. If False, the reply of a
+            command sent to a worker is sent as soon as it is done, so that a slow instrument does not hold up the
+            replies of the other assemblies. Only for replies that carry the id of their request.
+        """
+        worker_key = self._worker_key(asm_key, dev_comm)
+        if worker_key is None:
+            self._reply(client, encode(run_command(asm_key, dev_comm, param, self._asm_dict, self)))
+            return
+
+        if ordered:
+            slot = [None]
+            client.pending.append(slot)
+
+            def done(out):
+                slot[0] = encode(out)
+                self._release(client)
+        else:
+            def done(out):
+                if client.sock in self._clients:
+                    self._reply(client, encode(out))
+                    self._release(client)
+
+        worker = self._workers.get(worker_key)
+        if worker is None:
+            worker = self._workers[worker_key] = _AssemblyWorker(worker_key, self._on_done)
+        worker.submit(lambda: run_command(asm_key, dev_comm, param, self._asm_dict, self), done)
+
+    def _reply(self, client, data):
+        """
+        Queue a reply, after the replies of the commands still running on the workers.
+        """
+        if client.pending:
+            client.pending.append([data])
+        else:
+            client.tx += data
+
+    def _release(self, client):
+        """
+        Move the replies that are done, up to the first command still running, to the bytes to send.
+        """
+        if client.sock not in self._clients:
+            return
+        pending = client.pending
+        while pending and pending[0][0] is not None:
+            client.tx += pending.popleft()[0]
+        if client.tx:
+            self._flush(client)
+
+    def _start_binary(self, client):
+        """
+        Switch a client to the binary protocol (see oven_protocol.py).
+
+        Returns
+        -------
+        str
+            the reply with the tables of the binary protocol.
+        """
+        keys = list(self._asm_dict) + [k for k in asm_status if k not in self._asm_dict]
+        client.keys = keys
+        if client.subs:  # telemetry lines would corrupt the binary stream
+            client.subs.clear()
+            self._update_subscribed()
+        return 'BINR ' + str(oven_protocol.VERSION) + ' ' + ','.join(keys) + ' ' + ','.join(BINARY_COMMANDS)
+
+    def _read_frames(self, client):
+        """
+        Run every complete binary request received from a client. Responses are matched to their request by id, so
+        the ones of the commands sent to the workers are not held back behind each other.
+        """
+        offset = 0
+        while True:
+            request = oven_protocol.unpack_request(client.rx, offset)
+            if request is None:
+                break
+            request_id, asm_index, command_id, query, param, size = request
+            offset += size
 
-                    print(data)
-                    out = process_command(data, asm_dict)
-                    if out is None:
-                        out = 'NOERROR'
-                    conn.sendall((str(out) + '\r').encode('utf-8'))
+            if asm_index == oven_protocol.OVEN_INDEX:
+                asm_key = 'OVEN'
+            elif asm_index < len(client.keys):
+                asm_key = client.keys[asm_index]
+            else:
+                asm_key = None
+            if asm_key is None:
+                out = 'ERROR: assembly index ' + str(asm_index) + ' not valid'
+            elif command_id >= len(BINARY_COMMANDS):
+                out = 'ERROR: command id ' + str(command_id) + ' not valid'
+            else:
+                if query:
+                    param = '?'
+                elif isinstance(param, str):
+                    param = param.upper()
+                self._dispatch(client, asm_key, BINARY_COMMANDS[command_id], param,
+                               lambda out, request_id=request_id: oven_protocol.pack_response(request_id, out),
+                               ordered=False)
+                continue
+            self._reply(client, oven_protocol.pack_response(request_id, out))
+        del client.rx[:offset]
 
-                except BlockingIOError:
-                    pass
-                except ConnectionResetError:  # if connection is lost, go back to listening for connections.
-                    print(f"Disconnected by {addr}")
-                    break
+    def _flush(self, client):
+        """
+        Send as much of the pending replies as the socket takes. If some are left, wait until the socket is writable.
+        """
+        try:
+            sent = client.sock.send(client.tx)
+        except BlockingIOError:
+            sent = 0
+        except OSError:
+            self._close(client)
+            return
+        del client.tx[:sent]
+        events = selectors.EVENT_READ | selectors.EVENT_WRITE if client.tx else selectors.EVENT_READ
+        self._selector.modify(client.sock, events)
+
+
+def server_loop(asm_dict, loopback=False, port=65432, bank_min_zones=BANK_MIN_ZONES):
+    """
+    Server that istens for commands from remote machines, then executes the command on the respective assembly object.
+    The server will continue to regulate an oven regardless of the connection of the remote machines. This means that
+    if the connection to a remote machine is lost, the server will still continue to regulate the temperature of the
+    heater assembly. See OvenServer.
+
+    Parameters:
+    asm_dict : dictionary of str: HeaterAssembly
+        dictionary containing all the HeaterAssembly objects to be used by the oven and their respective keys. The
+        keys are used to identify each HeaterAssembly in the Oven class. Keys are not case-sensitive.
+    loopback : bool
+        Set to False for BeagleBoneBlack use. Set to True for testing with local host.
+    port : int
+        port to listen on.
+    bank_min_zones : int, None
+        number of assemblies from which they are regulated by a single BankControlLoop. See OvenServer.
+
+    """
+    server = OvenServer(asm_dict, get_host_ip(loopback=loopback), port, bank_min_zones=bank_min_zones)
+    server.serve_forever()
 
 
 ########################################################################################################################
@@ -407,54 +1458,109 @@ def main():
     'organs'. The BeagleBone receives commands from the main experiment (or master) PC to control the HeaterAssembly
     object.
 
-    Follow the steps below to assemble all the separate components into a working oven.
+    Follow the steps below to assemble all the separate components into a working oven. Each assembly is built by
+    its own function so that all the devices connect at the same time, and an instrument that is powered off does not
+    hold up the rest of the oven.
     """
 
-    # Step 1:
-    # -------
-    # create the power supply object and specify the channel that will be used:
-    ps = Spd3303x('10.176.42.121')
-    ps_chan = 1
+    def make_asm1():
+        # Step 1:
+        # -------
+        # create the power supply object and specify the channel that will be used. Use Spd3303x.shared() so that
+        # assemblies using different channels of the same power supply share a single connection:
+        ps = Spd3303x.shared('10.176.42.121')
+        ps_chan = 1
 
 
-    # Step 2:
-    # -------
-    # Create the temeprature DAQ object and specify the channel that will be used
-    daq_ip = '10.176.42.173'
-    try:
-        daq = ETcWindows(0, daq_ip)
-    except NameError:
-        daq = ETcLinux(daq_ip)
-    daq_chan = 0
+        # Step 2:
+        # -------
+        # Create the temeprature DAQ object and specify the channel that will be used
+        daq_ip = '10.176.42.173'
+        try:
+            daq = ETcWindows(0, daq_ip)
+        except NameError:
+            daq = ETcLinux(daq_ip)
+        daq_chan = 0
 
 
-    # Step 3:
-    # -------
-    # This step is optional. Create a heater object to set MAX limits for temperature, voltage, and current. If no
-    # heater object is added to the assembly, a dummy Heater object is added automatically with infinite limits.
-    h = Heater(MAX_temp=100, MAX_volts=30, MAX_current=0.5)
+        # Step 3:
+        # -------
+        # This step is optional. Create a heater object to set MAX limits for temperature, voltage, and current. If
+        # no heater object is added to the assembly, a dummy Heater object is added automatically with infinite
+        # limits.
+        h = Heater(MAX_temp=100, MAX_volts=30, MAX_current=0.5)
 
 
-    # Step 4:
-    # -------
-    # Create the HeaterAssembly object putting all the previous objects together. If more HeaterAssembly
-    # objects are needed, repeat the previous steps until all the needed HeaterAssembly objects are created. The
-    # heater is an optional parameter.
-    asm1 = HeaterAssembly((ps, ps_chan), (daq, daq_chan), h)
+        # Step 4:
+        # -------
+        # Create the HeaterAssembly object putting all the previous objects together and return it. If more
+        # HeaterAssembly objects are needed, write one function like this one for each of them. The heater is an
+        # optional parameter.
+        return HeaterAssembly((ps, ps_chan), (daq, daq_chan), h)
 
 
     # Step 5:
     # -------
-    # Create a dictionary containing all the assemblies with name strings as the keys. Names for assemblies
+    # Create a dictionary containing all the assembly functions with name strings as the keys. Names for assemblies
     # are not case-sensitive. 'OVEN' is reserved.
-    asm_dict = {'asm1': asm1}
+    asm_factories = {'asm1': make_asm1}
 
 
 
     # Step 6:
     # -------
-    # Setup is complete. Run the following line and the BeagleBone will start to listen for remote connections. 
+    # Setup is complete. Run the following lines and the BeagleBone will start to connect to the devices in the
+    # background and listen for remote connections. Assemblies are regulated as soon as their devices are up.
+    # Log to the console and to rotating files next to the script, without ever blocking the control loops. Use
+    # level=logging.DEBUG to also log every command received.
+    ServerLog('oven_server.log').start()
+    asm_dict = {}
+    start_assemblies(asm_factories, asm_dict)
     server_loop(asm_dict)
 
 
-main()
+def main_simulated(time_scale=10):
+    """
+    Run the server on the local host with a simulated SPD3303X power supply and a simulated temperature DAQ instead of
+    the hardware. Each of the two supply channels heats one thermocouple channel of the simulated oven. Used for
+    testing on any Linux machine.
+
+    Parameters
+    ----------
+    time_scale : float
+        simulated seconds per real second of the thermal model. Larger values make the oven heat up faster.
+    """
+    try:
+        from daq_simulator import SimulatedDaq
+        from daq_simulator import ThermalPlant
+        from daq_simulator import supply_power
+        from supply_simulator import SupplySimulator
+    except ModuleNotFoundError:
+        from automation.daq_simulator import SimulatedDaq
+        from automation.daq_simulator import ThermalPlant
+        from automation.daq_simulator import supply_power
+        from automation.supply_simulator import SupplySimulator
+
+    sim = SupplySimulator('spd3303x', load_resistance=20).start()
+    plant = ThermalPlant(n_nodes=8, time_scale=time_scale)
+    daq = SimulatedDaq(plant)
+
+    def make_asm(ps_chan):
+        def make():
+            ps = Spd3303x.shared(*sim.address)
+            asm = HeaterAssembly((ps, ps_chan), (daq, ps_chan - 1), Heater(MAX_temp=150, MAX_volts=30, MAX_current=3))
+            plant.add_heater(ps_chan - 1, supply_power(sim, ps_chan))
+            return asm
+        return make
+
+    ServerLog().start()
+    asm_dict = {}
+    start_assemblies({'asm1': make_asm(1), 'asm2': make_asm(2)}, asm_dict)
+    server_loop(asm_dict, loopback=True)
+
+
+if __name__ == '__main__':
+    if '--simulate' in sys.argv:
+        main_simulated()
+    else:
+        main()
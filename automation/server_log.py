@@ -0,0 +1,231 @@
+"""
+Logging of the oven server that never stalls the control loops. The server logs to the 'oven' logger and its children:
+
+    oven.server         start up, connections, and assemblies becoming ready
+    oven.command        every command received (DEBUG)
+    oven.control.<key>  every control update of an assembly (INFO, errors as WARNING)
+
+ServerLog sends these records to a bounded queue emptied by a background thread that writes them to the console and to
+rotating log files. Logging a record only costs a put_nowait() on the queue: if the queue is full (a slow console or
+disk), the record is dropped and counted instead of blocking the caller. Every category is also rate-limited with a
+token bucket, so a loop logging every update, or an error repeated every tick, cannot flood the log:
+
+    log = ServerLog('oven_server.log').start()
+    ...
+    log.stop()
+"""
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+
+LOGGER = 'oven'
+LOG_FORMAT = '%(asctime)s %(levelname)s %(name)s: %(message)s'
+
+# messages per second and burst of every category. Child loggers have their own bucket with the rate of the closest
+# parent listed, so every assembly gets its own budget.
+DEFAULT_RATES = {
+    'oven': (50.0, 200),
+    'oven.command': (20.0, 100),
+    'oven.control': (2.0, 10),
+}
+
+
+class RateLimitFilter(logging.Filter):
+    def __init__(self, rates=None):
+        """
+        Token bucket per logger name. Records over the limit are dropped, and the number dropped is attached to the next
+        record of the same logger as record.suppressed.
+
+        Parameters
+        ----------
+        rates : dictionary of str: (float, int), None
+            maps logger names to (messages per second, burst). Loggers without an entry use the entry of their closest
+            parent, and are not limited if there is none. Defaults to DEFAULT_RATES.
+        """
+        super().__init__()
+        self._rates = dict(DEFAULT_RATES if rates is None else rates)
+        self._buckets = {}  # logger name: [tokens, last refill, rate, burst, suppressed]
+        self._lock = threading.Lock()
+        self.suppressed = 0  # total number of records dropped
+
+    def _rate(self, name):
+        while name:
+            if name in self._rates:
+                return self._rates[name]
+            name = name.rpartition('.')[0]
+        return None
+
+    def filter(self, record):
+        now = time.monotonic()
+        with self._lock:
+            bucket = self._buckets.get(record.name)
+            if bucket is None:
+                rate = self._rate(record.name)
+                if rate is None:
+                    bucket = [0.0, now, None, None, 0]
+                else:
+                    bucket = [float(rate[1]), now, float(rate[0]), rate[1], 0]
+                self._buckets[record.name] = bucket
+            if bucket[2] is None:
+                return True
+
+            bucket[0] = min(bucket[0] + (now - bucket[1]) * bucket[2], bucket[3])
+            bucket[1] = now
+            if bucket[0] < 1:
+                bucket[4] += 1
+                self.suppressed += 1
+                return False
+            bucket[0] -= 1
+            if bucket[4]:
+                record.suppressed = bucket[4]
+                bucket[4] = 0
+            return True
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """
+    QueueHandler that drops records when the queue is full instead of raising. The number dropped is attached to the
+    next record queued as record.dropped.
+    """
+    def __init__(self, queue_):
+        super().__init__(queue_)
+        self.dropped = 0
+        self._pending = 0
+
+    def prepare(self, record):
+        record = super().prepare(record)
+        record.exc_text = None  # the traceback is already in the message
+        return record
+
+    def enqueue(self, record):
+        if self._pending:
+            record.dropped = self._pending
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            self._pending += 1
+        else:
+            self._pending = 0
+
+
+class _QueueListener(logging.handlers.QueueListener):
+    def enqueue_sentinel(self):
+        self.queue.put(self._sentinel)  # wait for room, put_nowait() would raise if the queue is full
+
+
+class _Formatter(logging.Formatter):
+    def format(self, record):
+        text = super().format(record)
+        suppressed = getattr(record, 'suppressed', 0)
+        dropped = getattr(record, 'dropped', 0)
+        if suppressed:
+            text += ' [' + str(suppressed) + ' earlier messages suppressed]'
+        if dropped:
+            text += ' [' + str(dropped) + ' messages dropped, log queue full]'
+        return text
+
+
+class ServerLog:
+    def __init__(
+            self,
+            path=None,
+            level=logging.INFO,
+            console=True,
+            max_bytes=1000000,
+            backup_count=5,
+            queue_size=10000,
+            rates=None,
+    ):
+        """
+        Non-blocking logging of the oven server. Nothing happens until start() is called.
+
+        Parameters
+        ----------
+        path : str, None
+            log file. It is rotated when it reaches max_bytes, keeping backup_count old files. None for no file.
+        level : int
+            lowest level logged. logging.DEBUG also logs every command received.
+        console : bool
+            also write the records to stdout.
+        max_bytes : int
+            size in bytes of a log file before it is rotated.
+        backup_count : int
+            number of rotated log files kept.
+        queue_size : int
+            most records waiting to be written. Records logged while the queue is full are dropped.
+        rates : dictionary of str: (float, int), None
+            rate limit of every category. See RateLimitFilter.
+        """
+        formatter = _Formatter(LOG_FORMAT)
+        handlers = []
+        if console:
+            handlers.append(logging.StreamHandler(sys.stdout))
+        if path is not None:
+            handlers.append(logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count))
+        for handler in handlers:
+            handler.setFormatter(formatter)
+
+        self._level = level
+        self._filter = RateLimitFilter(rates)
+        self._queue = queue.Queue(queue_size)
+        self._handler = _DroppingQueueHandler(self._queue)
+        self._handler.addFilter(self._filter)
+        self._listener = _QueueListener(self._queue, *handlers)
+        self._handlers = handlers
+        self._running = False
+
+    @property
+    def dropped(self):
+        """
+        Number of records dropped because the queue was full.
+        """
+        return self._handler.dropped
+
+    @property
+    def suppressed(self):
+        """
+        Number of records dropped by the rate limits.
+        """
+        return self._filter.suppressed
+
+    def start(self):
+        """
+        Start the writer thread and send the 'oven' logger to it.
+
+        Returns
+        -------
+        ServerLog
+            self, so that it can be created and started in one line.
+        """
+        if self._running:
+            return self
+        logger = logging.getLogger(LOGGER)
+        logger.setLevel(self._level)
+        logger.propagate = False
+        logger.addHandler(self._handler)
+        self._listener.start()
+        self._running = True
+        return self
+
+    def stop(self):
+        """
+        Write the records still queued, stop the writer thread and close the log files.
+        """
+        if not self._running:
+            return
+        self._running = False
+        logging.getLogger(LOGGER).removeHandler(self._handler)
+        self._listener.stop()
+        for handler in self._handlers:
+            handler.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
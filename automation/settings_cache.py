@@ -0,0 +1,146 @@
+"""
+Read-through cache of the settings of an oven that almost never change (PID gains, heater limits, thermocouple types,
+units, supply limits, ...), used by Oven.enable_cache() so that dashboards do not query the oven server for static
+values over and over.
+
+A cached reply is dropped when:
+    - its time to live, which depends on the setting, expires. Settings that can change without the oven server knowing,
+      like supply limits set from the front panel, have short times to live.
+    - the client changes anything on the same assembly.
+    - the settings generation of the server (OVEN OV:GENR) changes, which happens whenever any client changes a setting.
+      It is checked at most once every generation_interval seconds.
+"""
+import threading
+import time
+
+
+DEFAULT_TTLS = {  # command: seconds a reply is kept
+    'PD:KPRO': 60.0,
+    'PD:KINT': 60.0,
+    'PD:KDER': 60.0,
+    'PD:SAMP': 60.0,
+    'PD:LIMS': 60.0,
+    'HT:TMAX': 600.0,
+    'HT:VMAX': 600.0,
+    'HT:AMAX': 600.0,
+    'AM:MAXV': 600.0,
+    'AM:MAXA': 600.0,
+    'DQ:TCTY': 600.0,
+    'DQ:UNIT': 600.0,
+    'DQ:CHAN': 600.0,
+    'DQ:IDN': 3600.0,
+    'PS:VLIM': 30.0,
+    'PS:ALIM': 30.0,
+    'PS:CHAN': 600.0,
+    'PS:IDN': 3600.0,
+}
+
+
+class SettingsCache:
+    def __init__(self, ttls=None, generation_interval=1.0):
+        """
+        Parameters
+        ----------
+        ttls : dictionary of str: float, None
+            maps commands ('PD:KPRO') to the time in seconds their replies are kept. Commands not listed are never
+            cached. Defaults to DEFAULT_TTLS.
+        generation_interval : float
+            shortest time in seconds between checks of the settings generation of the server. None to never check it,
+            and rely on the times to live only.
+        """
+        self._ttls = {command.upper(): ttl for command, ttl in (DEFAULT_TTLS if ttls is None else ttls).items()}
+        self._generation_interval = generation_interval
+        self._entries = {}  # (assembly key, command): (expiry time, reply)
+        self._generation = None
+        self._checked = None  # time.monotonic() of the last generation check
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def command(self, msg, param=None):
+        """
+        Parameters
+        ----------
+        msg : str
+            message sent to the oven, e.g. 'PD:KPRO ?'.
+        param : object
+            parameter sent after msg.
+
+        Returns
+        -------
+        str
+            the command of msg, if it is a query of a cached setting.
+        None
+            If the reply to msg should not be cached.
+        """
+        parts = msg.split()
+        if param is not None or len(parts) != 2 or parts[1] != '?':
+            return None
+        command = parts[0].upper()
+        return command if command in self._ttls else None
+
+    def get(self, asm_key, command):
+        """
+        Returns
+        -------
+        tuple of (bool, object)
+            True and the cached reply, or False and None if there is no valid reply cached.
+        """
+        key = (asm_key.upper(), command)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self.hits += 1
+                return True, entry[1]
+            self._entries.pop(key, None)
+            self.misses += 1
+            return False, None
+
+    def put(self, asm_key, command, reply):
+        """
+        Cache a reply. Error replies are not cached.
+        """
+        if isinstance(reply, (str, bytes)) and reply[:5] in ('ERROR', b'ERROR'):
+            return
+        with self._lock:
+            self._entries[(asm_key.upper(), command)] = (time.monotonic() + self._ttls[command], reply)
+
+    def invalidate(self, asm_key=None):
+        """
+        Drop the cached replies of an assembly, or of all the assemblies if asm_key is None.
+        """
+        with self._lock:
+            if asm_key is None:
+                self._entries.clear()
+                return
+            asm_key = asm_key.upper()
+            for key in [key for key in self._entries if key[0] == asm_key]:
+                del self._entries[key]
+
+    def generation_due(self):
+        """
+        True if the settings generation of the server should be checked before using the cache.
+        """
+        if self._generation_interval is None:
+            return False
+        return self._checked is None or time.monotonic() - self._checked >= self._generation_interval
+
+    def set_generation(self, generation):
+        """
+        Record the settings generation of the server, and drop every cached reply if it changed.
+
+        Parameters
+        ----------
+        generation : str, None
+            reply to OVEN OV:GENR. None if it could not be read, e.g. from a server without OV:GENR.
+        """
+        with self._lock:
+            self._checked = time.monotonic()
+            if generation is None or generation == self._generation:
+                return
+            if self._generation is not None:
+                self._entries.clear()
+            self._generation = generation
@@ -0,0 +1,394 @@
+"""
+Simulated power supplies for testing without the hardware. SupplySimulator is a TCP server speaking the subset of the
+Siglent SPD3303X and the Magna-Power / B&K Precision MR50040 command sets used by device_models.Spd3303x and
+device_models.Mr50040. Each channel drives a resistive load, replies can be delayed with a configurable latency and
+jitter, and several commands can be sent in one message separated by ';'.
+
+    with SupplySimulator('spd3303x', latency=0.005) as sim:
+        ps = Spd3303x(*sim.address)
+        ps.set_voltage(1, 5)
+        ps.set_channel_state(1, True)
+        ps.get_actual_current(1)  # 5 V over the default 10 ohm load: 0.5 A
+
+Run this file to start a simulator from the command line:
+
+    python supply_simulator.py --model mr50040 --port 5025 --latency 0.01 --jitter 0.002 --load 25
+"""
+import argparse
+import collections
+import math
+import random
+import socketserver
+import threading
+import time
+
+
+class SimulatedChannel:
+    def __init__(self, max_voltage, max_current, load_resistance=10.0):
+        """
+        Output channel of a simulated power supply connected to a resistor.
+
+        Parameters
+        ----------
+        max_voltage : float
+            largest voltage setpoint accepted.
+        max_current : float
+            largest current setpoint accepted.
+        load_resistance : float, None
+            resistance of the load in ohms. None for an open circuit.
+        """
+        self.max_voltage = max_voltage
+        self.max_current = max_current
+        self.voltage_limit = max_voltage
+        self.current_limit = max_current
+        self.setpoint_voltage = 0.0
+        self.setpoint_current = 0.0
+        self.output = False
+        self.load_resistance = load_resistance
+
+    def measure(self):
+        """
+        Output of the channel. The supply works in constant voltage until the load draws more than the current
+        setpoint, then in constant current.
+
+        Returns
+        -------
+        tuple of (float, float, str)
+            voltage, current, and mode: 'CV', 'CC', or 'OFF'.
+        """
+        if not self.output:
+            return 0.0, 0.0, 'OFF'
+        r = self.load_resistance
+        if r is None or r == math.inf:
+            return self.setpoint_voltage, 0.0, 'CV'
+        if r <= 0 or self.setpoint_voltage / r > self.setpoint_current:
+            return self.setpoint_current * max(r, 0), self.setpoint_current, 'CC'
+        return self.setpoint_voltage, self.setpoint_voltage / r, 'CV'
+
+
+class SupplySimulator:
+    models = ('spd3303x', 'mr50040')
+
+    def __init__(
+            self,
+            model='spd3303x',
+            host='127.0.0.1',
+            port=0,
+            latency=0.0,
+            jitter=0.0,
+            load_resistance=10.0,
+    ):
+        """
+        Parameters
+        ----------
+        model : {'spd3303x', 'mr50040'}
+            command set to speak.
+        host : str
+            address to listen on.
+        port : int
+            port to listen on. 0 picks a free port, see the address property.
+        latency : float
+            time in seconds before every reply is sent.
+        jitter : float
+            largest random variation in seconds added to or removed from the latency.
+        load_resistance : float, list of float, None
+            load on every channel in ohms, or one value per channel. None for an open circuit.
+
+        Raises
+        ------
+        ValueError
+            If the model is not supported.
+        """
+        model = model.lower()
+        if model not in self.models:
+            raise ValueError('model should be one of ' + str(self.models) + ', not ' + str(model))
+
+        if model == 'spd3303x':
+            limits = [(32, 3.2), (32, 3.2)]
+            self.idn = 'Siglent Technologies,SPD3303X,SIM0000001,1.01.01.02.05,V3.0'
+        else:
+            limits = [(500, 40)]
+            self.idn = 'Magna-Power Electronics Inc.,MR50040,SIM0000001,1.0'
+
+        if not isinstance(load_resistance, (list, tuple)):
+            load_resistance = [load_resistance] * len(limits)
+        self.channels = [SimulatedChannel(v, a, r) for (v, a), r in zip(limits, load_resistance)]
+
+        self.model = model
+        self.latency = latency
+        self.jitter = jitter
+        self.cccv_protection = False
+        self.cvcc_protection = False
+        self.power_setpoint = 20000.0
+        self._errors = collections.deque(maxlen=16)
+        self._lock = threading.RLock()
+        self._host = host
+        self._port = port
+        self._server = None
+        self._thread = None
+        self.message_count = 0
+
+    # Server
+    # ------
+    def start(self):
+        """
+        Start listening in a background thread. Every client is served by its own thread.
+
+        Returns
+        -------
+        SupplySimulator
+            self, so that 'sim = SupplySimulator().start()' works.
+        """
+        sim = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                sim._serve_connection(self.request)
+
+        socketserver.ThreadingTCPServer.allow_reuse_address = True
+        self._server = socketserver.ThreadingTCPServer((self._host, self._port), Handler)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, name='supply simulator', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        if self._server is None:
+            self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+    @property
+    def address(self):
+        """
+        (host, port) the simulator listens on.
+        """
+        if self._server is None:
+            return self._host, self._port
+        return self._server.server_address[:2]
+
+    def _serve_connection(self, conn):
+        buffer = b''
+        while True:
+            try:
+                data = conn.recv(4096)
+            except OSError:
+                return
+            if not data:
+                return
+            buffer += data
+            *lines, buffer = buffer.split(b'\n')
+            if buffer:  # the SPD3303X driver does not terminate its messages
+                lines.append(buffer)
+                buffer = b''
+            for line in lines:
+                reply = self.handle_message(line.decode('utf-8', 'replace'))
+                if reply is None:
+                    continue
+                delay = self.latency + random.uniform(-self.jitter, self.jitter)
+                if delay > 0:
+                    time.sleep(delay)
+                try:
+                    conn.sendall((reply + '\n').encode('utf-8'))
+                except OSError:
+                    return
+
+    # Commands
+    # --------
+    def handle_message(self, msg):
+        """
+        Run every command of a message and return the replies to its queries.
+
+        Parameters
+        ----------
+        msg : str
+            one message without its terminator. Commands are separated by ';'.
+
+        Returns
+        -------
+        str
+            replies to the queries of the message separated by ';'.
+        None
+            If the message has no queries.
+        """
+        replies = []
+        with self._lock:
+            self.message_count += 1
+            for part in msg.split(';'):
+                part = part.strip().lstrip(':')
+                if not part:
+                    continue
+                header, _, args = part.partition(' ')
+                reply = self._run(header.lower(), args.strip())
+                if reply is not None:
+                    replies.append(reply)
+        if not replies:
+            return None
+        return ';'.join(replies)
+
+    def push_error(self, code, message):
+        self._errors.append((code, message))
+
+    def set_load(self, channel, ohms):
+        """
+        Parameters
+        ----------
+        channel : int
+            channel number, starting from 1.
+        ohms : float, None
+            new load resistance. None for an open circuit.
+        """
+        with self._lock:
+            self.channels[channel - 1].load_resistance = ohms
+
+    def _run(self, header, args):
+        if header == '*idn?':
+            return self.idn
+        if header == 'system:error?':
+            if self._errors:
+                code, message = self._errors.popleft()
+                return str(code) + ',"' + message + '"'
+            return '0,"No error"'
+        if self.model == 'spd3303x':
+            out = self._run_spd3303x(header, args)
+        else:
+            out = self._run_mr50040(header, args)
+        if out is NotImplemented:
+            self.push_error(-113, 'Undefined header')
+            return None
+        return out
+
+    def _set(self, channel, attr, args, limit):
+        try:
+            value = float(args)
+        except ValueError:
+            self.push_error(-104, 'Data type error')
+            return None
+        if not 0 <= value <= limit:
+            self.push_error(-222, 'Data out of range')
+            return None
+        setattr(channel, attr, value)
+        return None
+
+    def _run_spd3303x(self, header, args):
+        if header.startswith('ch') and ':' in header:
+            name, _, what = header.partition(':')
+            try:
+                ch = self.channels[int(name[2:]) - 1]
+            except (ValueError, IndexError):
+                return NotImplemented
+            if what == 'voltage?':
+                return '{:.3f}'.format(ch.setpoint_voltage)
+            if what == 'current?':
+                return '{:.3f}'.format(ch.setpoint_current)
+            if what == 'voltage':
+                return self._set(ch, 'setpoint_voltage', args, ch.max_voltage)
+            if what == 'current':
+                return self._set(ch, 'setpoint_current', args, ch.max_current)
+            return NotImplemented
+
+        if header in ('measure:voltage?', 'measure:current?', 'measure:power?'):
+            try:
+                ch = self.channels[int(args.upper().replace('CH', '') or 1) - 1]
+            except (ValueError, IndexError):
+                self.push_error(-222, 'Data out of range')
+                return None
+            volts, amps, _ = ch.measure()
+            return '{:.3f}'.format({'measure:voltage?': volts, 'measure:current?': amps,
+                                    'measure:power?': volts * amps}[header])
+
+        if header == 'output':
+            try:
+                name, state = [a.strip().upper() for a in args.split(',')]
+                ch = self.channels[int(name.replace('CH', '')) - 1]
+            except (ValueError, IndexError):
+                self.push_error(-224, 'Illegal parameter value')
+                return None
+            ch.output = state in ('ON', '1')
+            return None
+
+        if header == 'system:status?':
+            status = 0
+            for i, ch in enumerate(self.channels):
+                status |= int(ch.measure()[2] == 'CC') << i
+                status |= int(ch.output) << (4 + i)
+            return hex(status)
+
+        if header == 'ip?':
+            return self.address[0]
+
+        return NotImplemented
+
+    def _run_mr50040(self, header, args):
+        ch = self.channels[0]
+        volts, amps, mode = ch.measure()
+        queries = {
+            'voltage?': lambda: '{:.3f}'.format(ch.setpoint_voltage),
+            'current?': lambda: '{:.3f}'.format(ch.setpoint_current),
+            'power?': lambda: '{:.3f}'.format(self.power_setpoint),
+            'voltage:max?': lambda: '{:.3f}'.format(ch.voltage_limit),
+            'current:max?': lambda: '{:.3f}'.format(ch.current_limit),
+            'measure:voltage?': lambda: '{:.3f}'.format(volts),
+            'measure:current?': lambda: '{:.3f}'.format(amps),
+            'measure:power?': lambda: '{:.3f}'.format(volts * amps),
+            'output?': lambda: str(int(ch.output)),
+            'cccv:protection?': lambda: str(int(self.cccv_protection)),
+            'cvcc:protection?': lambda: str(int(self.cvcc_protection)),
+            'status:operation:condition?': lambda: str(int(mode == 'CV') | int(mode == 'CC') << 1),
+            '*stb?': lambda: str(int(bool(self._errors)) << 2),
+        }
+        if header in queries:
+            return queries[header]()
+
+        if header == 'voltage':
+            return self._set(ch, 'setpoint_voltage', args, ch.voltage_limit)
+        if header == 'current':
+            return self._set(ch, 'setpoint_current', args, ch.current_limit)
+        if header == 'voltage:max':
+            return self._set(ch, 'voltage_limit', args, ch.max_voltage)
+        if header == 'current:max':
+            return self._set(ch, 'current_limit', args, ch.max_current)
+        if header in ('output', 'cccv:protection', 'cvcc:protection'):
+            if args not in ('0', '1'):
+                self.push_error(-224, 'Illegal parameter value')
+                return None
+            if header == 'output':
+                ch.output = args == '1'
+            elif header == 'cccv:protection':
+                self.cccv_protection = args == '1'
+            else:
+                self.cvcc_protection = args == '1'
+            return None
+
+        return NotImplemented
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulated SPD3303X or MR50040 power supply.')
+    parser.add_argument('--model', default='spd3303x', choices=SupplySimulator.models)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5025)
+    parser.add_argument('--latency', type=float, default=0.0, help='reply latency in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='reply jitter in seconds')
+    parser.add_argument('--load', type=float, default=10.0, help='load resistance in ohms')
+    args = parser.parse_args()
+
+    sim = SupplySimulator(args.model, args.host, args.port, args.latency, args.jitter, args.load).start()
+    print('Simulated', args.model, 'listening on', sim.address)
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        sim.stop()
+
+
+if __name__ == '__main__':
+    main()
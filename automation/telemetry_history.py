@@ -0,0 +1,134 @@
+"""
+History of the control updates of a HeaterAssembly, kept on the oven server so that clients can fetch the samples they
+missed while disconnected. See HeaterAssembly.history and Oven.get_history().
+"""
+import collections
+import math
+import threading
+
+import numpy as np
+
+
+HISTORY_CHUNK = 200  # most samples returned by a single TM:HIST server command
+HISTORY_DTYPE = np.dtype([
+    ('time', 'f8'),  # time.time() at the start of the update
+    ('temp', 'f8'),  # temperature used by the PID
+    ('volts', 'f8'),  # voltage commanded by the PID
+    ('setpoint', 'f8'),  # PID setpoint
+    ('p', 'f8'),  # proportional, integral, and derivative terms of the PID output
+    ('i', 'f8'),
+    ('d', 'f8'),
+])
+
+
+class ControlSample(collections.namedtuple('ControlSample', HISTORY_DTYPE.names)):
+    """
+    One control update of a HeaterAssembly, with the fields of HISTORY_DTYPE: time.time() at the start of the update,
+    temperature read from the DAQ, voltage commanded by the PID, PID setpoint, and the P, I, and D terms. The
+    temperature is read once per update, and the same sample is used by the PID, recorded in the history, returned to
+    the control loop, logged, and plotted. See HeaterAssembly.last_sample.
+    """
+    __slots__ = ()
+
+
+class TelemetryHistory:
+    def __init__(self, size=3600):
+        """
+        Ring buffer of control updates. All the memory is allocated up front, and the oldest samples are overwritten
+        once it is full.
+
+        Parameters
+        ----------
+        size : int
+            number of samples kept. At the default PID sample time of 2 seconds, 3600 samples are 2 hours.
+        """
+        self._data = np.full(size, np.nan, dtype=HISTORY_DTYPE)
+        self._size = size
+        self._next = 0  # index of the next sample written
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def size(self):
+        return self._size
+
+    def append(self, time_, temp, volts, setpoint, p, i, d):
+        """
+        Record one control update. None is stored as nan.
+        """
+        row = tuple(math.nan if value is None else value for value in (time_, temp, volts, setpoint, p, i, d))
+        with self._lock:
+            self._data[self._next] = row
+            self._next = (self._next + 1) % self._size
+            self._count = min(self._count + 1, self._size)
+
+    def clear(self):
+        with self._lock:
+            self._next = 0
+            self._count = 0
+
+    def since(self, t, max_samples=None):
+        """
+        Samples recorded after a given time, oldest first.
+
+        Parameters
+        ----------
+        t : float
+            time.time() value. Only samples strictly after it are returned.
+        max_samples : int, None
+            return at most this many samples, the oldest ones. None for no limit.
+
+        Returns
+        -------
+        numpy.ndarray
+            copy of the samples, with dtype HISTORY_DTYPE.
+        """
+        with self._lock:
+            if self._count < self._size:
+                ordered = self._data[:self._count]
+            else:
+                ordered = np.concatenate((self._data[self._next:], self._data[:self._next]))
+            start = np.searchsorted(ordered['time'], t, side='right')
+            end = len(ordered) if max_samples is None else start + max_samples
+            return ordered[start:end].copy()
+
+
+def format_history(samples):
+    """
+    Format samples as the reply of the TM:HIST server command: one sample per ';', values separated by ',' in the
+    order of HISTORY_DTYPE, without losing precision.
+
+    Parameters
+    ----------
+    samples : numpy.ndarray
+        samples with dtype HISTORY_DTYPE.
+
+    Returns
+    -------
+    str
+    """
+    return ';'.join(','.join(repr(value) for value in row) for row in samples.tolist())
+
+
+def parse_history(reply):
+    """
+    Parameters
+    ----------
+    reply : str
+        reply of the TM:HIST server command.
+
+    Returns
+    -------
+    numpy.ndarray
+        samples with dtype HISTORY_DTYPE.
+
+    Raises
+    ------
+    ValueError
+        If the reply is not a history.
+    """
+    rows = [tuple(float(value) for value in row.split(',')) for row in reply.split(';') if row]
+    return np.array(rows, dtype=HISTORY_DTYPE)
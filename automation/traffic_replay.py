@@ -0,0 +1,427 @@
+"""
+Record the byte traffic between a driver and its device to a file, and replay it later as a fake device. Used to test
+and benchmark the drivers (Spd3303x, Mr50040, Gm3, Srs100, ...) without the hardware.
+
+Recording a live session:
+
+    with TrafficRecorder('spd.trace') as rec:
+        ps = Spd3303x('10.176.42.121', socket_factory=rec.socket_factory())
+        ps.get_snapshot()
+
+Replaying it, as fast as possible or with the original device timing:
+
+    replay = TrafficReplay('spd.trace', realtime=False)
+    ps = Spd3303x('10.176.42.121', socket_factory=replay.socket_factory())
+    ps.get_snapshot()
+
+Serial drivers take a serial_factory instead: Gm3('COM3', serial_factory=rec.serial_factory()).
+
+File format: an 8 byte magic, a header with the format version and the wall-clock time of the recording, then one record
+per read or write: time since the start of the recording (float64), direction (uint8, 0 for bytes sent to the device, 1
+for bytes received from it), length (uint32), and the bytes themselves.
+"""
+import socket
+import struct
+import threading
+import time
+
+
+MAGIC = b'AUTOTRAF'
+VERSION = 1
+SENT = 0
+RECEIVED = 1
+
+_header = struct.Struct('<Hd')
+_record = struct.Struct('<dBI')
+
+
+class ReplayError(Exception):
+    """
+    Raised when the driver sends bytes that are different from the recording.
+    """
+    pass
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Recording
+# ----------------------------------------------------------------------------------------------------------------------
+class TrafficRecorder:
+    def __init__(self, path):
+        """
+        Write every read and write of the wrapped sockets and serial ports to a file.
+
+        Parameters
+        ----------
+        path : str
+            file to write. Overwritten if it exists.
+        """
+        self._file = open(path, 'wb')
+        self._lock = threading.Lock()
+        self._t0 = time.monotonic()
+        self._file.write(MAGIC + _header.pack(VERSION, time.time()))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def record(self, direction, data):
+        """
+        Parameters
+        ----------
+        direction : int
+            SENT or RECEIVED.
+        data : bytes
+        """
+        if not data:
+            return
+        with self._lock:
+            self._file.write(_record.pack(time.monotonic() - self._t0, direction, len(data)) + bytes(data))
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def socket_factory(self):
+        """
+        Returns
+        -------
+        callable
+            socket factory for SocketEthernetDevice that opens a real socket and records its traffic.
+        """
+        return lambda: RecordingSocket(socket.socket(socket.AF_INET, socket.SOCK_STREAM), self)
+
+    def serial_factory(self):
+        """
+        Returns
+        -------
+        callable
+            serial factory for the serial drivers that opens a real serial port and records its traffic.
+        """
+        import serial
+        return lambda **kwargs: RecordingSerial(serial.Serial(**kwargs), self)
+
+
+class RecordingSocket:
+    """
+    Socket wrapper writing everything sent and received to a TrafficRecorder. Everything else is passed to the socket.
+    """
+    def __init__(self, sock, recorder):
+        self._sock = sock
+        self._recorder = recorder
+
+    def __getattr__(self, name):
+        return getattr(self._sock, name)
+
+    def sendall(self, data):
+        out = self._sock.sendall(data)
+        self._recorder.record(SENT, data)
+        return out
+
+    def send(self, data):
+        n = self._sock.send(data)
+        self._recorder.record(SENT, data[:n])
+        return n
+
+    def recv(self, bufsize, *args):
+        data = self._sock.recv(bufsize, *args)
+        self._recorder.record(RECEIVED, data)
+        return data
+
+
+class RecordingSerial:
+    """
+    serial.Serial wrapper writing everything written and read to a TrafficRecorder. Everything else is passed to the
+    serial port.
+    """
+    def __init__(self, ser, recorder):
+        self._ser = ser
+        self._recorder = recorder
+
+    def __getattr__(self, name):
+        return getattr(self._ser, name)
+
+    def write(self, data):
+        out = self._ser.write(data)
+        self._recorder.record(SENT, data)
+        return out
+
+    def read(self, size=1):
+        data = self._ser.read(size)
+        self._recorder.record(RECEIVED, data)
+        return data
+
+    def read_until(self, expected=b'\n', size=None):
+        data = self._ser.read_until(expected, size)
+        self._recorder.record(RECEIVED, data)
+        return data
+
+    def readline(self, size=None):
+        return self.read_until(b'\n', size)
+
+
+# ----------------------------------------------------------------------------------------------------------------------
+# Replay
+# ----------------------------------------------------------------------------------------------------------------------
+def load_traffic(path):
+    """
+    Read a file written by TrafficRecorder.
+
+    Parameters
+    ----------
+    path : str
+
+    Returns
+    -------
+    list of tuple
+        (time, direction, data) for every record, in order.
+
+    Raises
+    ------
+    ValueError
+        If the file is not a traffic recording.
+    """
+    with open(path, 'rb') as f:
+        raw = f.read()
+
+    if raw[:len(MAGIC)] != MAGIC:
+        raise ValueError(str(path) + ' is not a traffic recording')
+    version, _ = _header.unpack_from(raw, len(MAGIC))
+    if version != VERSION:
+        raise ValueError('traffic recording version ' + str(version) + ' not supported')
+
+    records = []
+    i = len(MAGIC) + _header.size
+    while i < len(raw):
+        t, direction, n = _record.unpack_from(raw, i)
+        i += _record.size
+        records.append((t, direction, raw[i:i + n]))
+        i += n
+    return records
+
+
+class TrafficReplay:
+    def __init__(self, path_or_records, realtime=False, check_sent=True):
+        """
+        Fake device answering with the bytes of a recording.
+
+        Every write of the driver is compared with the recorded bytes sent, and every read returns the recorded bytes
+        received after them. Reads with no recorded bytes left before the next write behave like a device that does
+        not answer: sockets raise socket.timeout and serial reads return what is available.
+
+        Parameters
+        ----------
+        path_or_records : str, list of tuple
+            file written by TrafficRecorder, or the records returned by load_traffic().
+        realtime : bool
+            If False, replies are available right away. If True, each reply arrives with the same delay after the
+            preceding write as in the recording.
+        check_sent : bool
+            If True, raise ReplayError when the driver sends bytes that are different from the recording.
+        """
+        if isinstance(path_or_records, str):
+            path_or_records = load_traffic(path_or_records)
+        self._records = path_or_records
+        self._realtime = realtime
+        self._check_sent = check_sent
+        self._lock = threading.RLock()
+        self.rewind()
+
+    def rewind(self):
+        """
+        Start again from the beginning of the recording.
+        """
+        with self._lock:
+            self._i = 0
+            self._expected = bytearray()  # recorded bytes sent that have not been matched yet
+            self._rx = bytearray()
+            self._offset = None  # time.monotonic() - recording time at the last write
+
+    @property
+    def done(self):
+        """
+        True if all the recording has been replayed.
+        """
+        return self._i >= len(self._records) and not self._expected and not self._rx
+
+    def _wait(self, t):
+        if self._realtime and self._offset is not None:
+            delay = t + self._offset - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+
+    def write(self, data):
+        """
+        Take bytes sent by the driver.
+
+        Raises
+        ------
+        ReplayError
+            If check_sent is True and data is different from the recording.
+        """
+        data = bytes(data)
+        with self._lock:
+            while len(self._expected) < len(data) and self._i < len(self._records):
+                t, direction, chunk = self._records[self._i]
+                self._i += 1
+                if direction == SENT:
+                    self._expected += chunk
+                    self._offset = time.monotonic() - t
+                else:
+                    self._rx += chunk  # the driver did not read this reply in the recording either
+
+            expected = bytes(self._expected[:len(data)])
+            del self._expected[:len(data)]
+            if self._check_sent and expected != data:
+                raise ReplayError('sent ' + str(data) + ' but the recording has ' + str(expected))
+        return len(data)
+
+    def _fill(self):
+        """
+        Move the next recorded reply into the receive buffer. Returns False if the next record is a write or the
+        recording is over.
+        """
+        if self._i >= len(self._records) or self._records[self._i][1] != RECEIVED:
+            return False
+        t, direction, chunk = self._records[self._i]
+        self._i += 1
+        self._wait(t)
+        self._rx += chunk
+        return True
+
+    def read(self, size, until=None):
+        """
+        Take up to size bytes received from the fake device. If until is given, stop after it.
+
+        Returns
+        -------
+        bytes
+            might be shorter than requested if the recording has no more bytes before the next write.
+        """
+        with self._lock:
+            while True:
+                if until is not None:
+                    idx = self._rx.find(until)
+                    if idx != -1:
+                        end = idx + len(until)
+                        if size is None or end <= size:
+                            break
+                if size is not None and len(self._rx) >= size:
+                    break
+                if not self._fill():
+                    break
+
+            end = len(self._rx)
+            if until is not None and self._rx.find(until) != -1:
+                end = self._rx.find(until) + len(until)
+            if size is not None:
+                end = min(end, size)
+            out = bytes(self._rx[:end])
+            del self._rx[:end]
+            return out
+
+    def recv(self, size):
+        """
+        Take the next bytes received from the fake device, like socket.recv().
+        """
+        with self._lock:
+            if not self._rx and not self._fill():
+                raise socket.timeout('no more replies in the recording before the next write')
+            out = bytes(self._rx[:size])
+            del self._rx[:size]
+            return out
+
+    def socket_factory(self):
+        """
+        Returns
+        -------
+        callable
+            socket factory for SocketEthernetDevice returning a ReplaySocket.
+        """
+        return lambda: ReplaySocket(self)
+
+    def serial_factory(self):
+        """
+        Returns
+        -------
+        callable
+            serial factory for the serial drivers returning a ReplaySerial.
+        """
+        return lambda **kwargs: ReplaySerial(self, **kwargs)
+
+
+class ReplaySocket:
+    """
+    Socket-like object backed by a TrafficReplay.
+    """
+    settle_scale = 0.0  # drivers skip their waits for the device to settle, the replay answers right away
+
+    def __init__(self, replay):
+        self._replay = replay
+        self._timeout = None
+
+    def connect(self, address):
+        pass
+
+    def settimeout(self, timeout):
+        self._timeout = timeout
+
+    def gettimeout(self):
+        return self._timeout
+
+    def setblocking(self, flag):
+        pass
+
+    def sendall(self, data):
+        self._replay.write(data)
+
+    def send(self, data):
+        return self._replay.write(data)
+
+    def recv(self, bufsize, *args):
+        return self._replay.recv(bufsize)
+
+    def close(self):
+        pass
+
+
+class ReplaySerial:
+    """
+    serial.Serial-like object backed by a TrafficReplay.
+    """
+    settle_scale = 0.0  # drivers skip their waits for the device to settle, the replay answers right away
+
+    def __init__(self, replay, **kwargs):
+        self._replay = replay
+        self.port = kwargs.get('port')
+        self.timeout = kwargs.get('timeout')
+        self.is_open = True
+
+    def write(self, data):
+        return self._replay.write(data)
+
+    def read(self, size=1):
+        return self._replay.read(size)
+
+    def read_until(self, expected=b'\n', size=None):
+        return self._replay.read(size, until=expected)
+
+    def readline(self, size=None):
+        return self.read_until(b'\n', size)
+
+    @property
+    def in_waiting(self):
+        return len(self._replay._rx)
+
+    def reset_input_buffer(self):
+        pass
+
+    def reset_output_buffer(self):
+        pass
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.is_open = False
@@ -0,0 +1,188 @@
+import argparse
+import multiprocessing
+import random
+import socket
+import time
+
+import numpy as np
+
+#######################################################################################################################
+# Load and jitter benchmark of the oven server. Launches server_loop() on localhost in its own process, with simulated
+# power supplies and a simulated DAQ instead of the hardware, and drives it with concurrent synthetic clients, each in
+# its own process, sending a mix of queries and commands as fast as the server answers them. Reports commands per
+# second, reply latency percentiles, and the period jitter of the control loop of every heater while under load.
+#
+#     PYTHONPATH=. python testingFiles/benchmarkOvenServer.py --heaters 8 --clients 4 --duration 30
+#
+# Use --supply-latency to mimic the response time of real power supplies (a few ms), and --think to give the clients
+# a pause between commands, like a GUI polling the oven, instead of a closed loop. --local leaves out the commands
+# that go to the supplies and the DAQ, to measure the server alone. --bank-min-zones sets how many heaters it takes for
+# the server to regulate them all with one BankControlLoop instead of one AssemblyControlLoop each (0 to always, -1 for
+# never).
+#######################################################################################################################
+
+# (command, weight). {} is replaced by a random assembly key. Setters write the values already set, so that the
+# regulation is not disturbed.
+MIX = [
+    ('{} PD:SETP ?', 4),
+    ('{} PD:KPRO ?', 2),
+    ('{} HT:TMAX ?', 2),
+    ('{} DQ:TEMP ?', 2),
+    ('{} PS:VSET ?', 2),
+    ('{} PS:VOLT ?', 1),
+    ('{} PD:KPRO 0.4', 1),
+    ('{} HT:TMAX 150', 1),
+    ('OVEN OV:STAT', 1),
+]
+
+
+def run_server(n_heaters, port, supply_latency, time_scale, bank_min_zones):
+    from automation.assemblies import HeaterAssembly
+    from automation.daq_simulator import SimulatedDaq
+    from automation.daq_simulator import ThermalPlant
+    from automation.daq_simulator import supply_power
+    from automation.device_models import Spd3303x
+    from automation.device_type import Heater
+    from automation.pid_controller_server import server_loop
+    from automation.supply_simulator import SupplySimulator
+
+    plant = ThermalPlant(n_nodes=max(n_heaters, 1), time_scale=time_scale)
+    daq = SimulatedDaq(plant)
+    asm_dict = {}
+    for i in range(n_heaters):
+        if i % 2 == 0:  # two heaters per SPD3303X, like the real oven
+            sim = SupplySimulator('spd3303x', load_resistance=20, latency=supply_latency).start()
+            ps = Spd3303x(*sim.address)
+        chan = i % 2 + 1
+        asm_dict['ASM' + str(i + 1)] = HeaterAssembly(
+            (ps, chan), (daq, i), Heater(MAX_temp=150, MAX_volts=30, MAX_current=3))
+        plant.add_heater(i, supply_power(sim, chan))
+    server_loop(asm_dict, loopback=True, port=port, bank_min_zones=None if bank_min_zones < 0 else bank_min_zones)
+
+
+def connect(port, timeout=30.0):
+    t0 = time.monotonic()
+    while True:
+        try:
+            sock = socket.create_connection(('127.0.0.1', port))
+        except ConnectionRefusedError:
+            if time.monotonic() - t0 > timeout:
+                raise
+            time.sleep(0.2)
+            continue
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+
+def exchange(sock, buffer, cmd):
+    sock.sendall((cmd + '\r').encode('utf-8'))
+    while b'\r' not in buffer:
+        data = sock.recv(4096)
+        if not data:
+            raise ConnectionError('server closed the connection')
+        buffer += data
+    end = buffer.index(b'\r')
+    reply = buffer[:end].decode('utf-8')
+    del buffer[:end + 1]
+    return reply
+
+
+def run_client(port, keys, start, duration, think, local, seed, results):
+    rng = random.Random(seed)
+    commands = [cmd for cmd, weight in MIX for i in range(weight) if not (local and (' PS:' in cmd or ' DQ:' in cmd))]
+    sock = connect(port)
+    buffer = bytearray()
+    latencies = []
+    errors = 0
+    start.wait()
+    end = time.monotonic() + duration
+    while True:
+        t0 = time.monotonic()
+        if t0 >= end:
+            break
+        reply = exchange(sock, buffer, rng.choice(commands).format(rng.choice(keys)))
+        latencies.append(time.monotonic() - t0)
+        errors += reply.startswith('ERROR')
+        if think:
+            time.sleep(think)
+    sock.close()
+    results.put((np.array(latencies), errors))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load and jitter benchmark of the oven server.')
+    parser.add_argument('--heaters', type=int, default=4, help='number of simulated heater assemblies')
+    parser.add_argument('--clients', type=int, default=4, help='number of concurrent clients')
+    parser.add_argument('--duration', type=float, default=20.0, help='seconds of load')
+    parser.add_argument('--sample-time', type=float, default=1.0, help='PID sample time of every heater, >= 1')
+    parser.add_argument('--think', type=float, default=0.0, help='pause of every client between commands')
+    parser.add_argument('--supply-latency', type=float, default=0.0, help='response time of the simulated supplies')
+    parser.add_argument('--time-scale', type=float, default=10.0, help='speed of the simulated oven')
+    parser.add_argument('--local', action='store_true', help='only commands that do not touch the devices')
+    parser.add_argument('--bank-min-zones', type=int, default=16, help='heaters from which the PIDs run in a bank')
+    parser.add_argument('--port', type=int, default=65433)
+    args = parser.parse_args()
+
+    keys = ['ASM' + str(i + 1) for i in range(args.heaters)]
+    server = multiprocessing.Process(
+        target=run_server,
+        args=(args.heaters, args.port, args.supply_latency, args.time_scale, args.bank_min_zones),
+        daemon=True,
+    )
+    server.start()
+    try:
+        sock = connect(args.port)
+        buffer = bytearray()
+        while len(exchange(sock, buffer, 'OVEN OV:KEYS').split()) < len(keys):
+            time.sleep(0.2)
+        for key in keys:
+            exchange(sock, buffer, key + ' PD:SAMP ' + str(args.sample_time))
+            exchange(sock, buffer, key + ' PD:SETP 60')
+            exchange(sock, buffer, key + ' PD:REGT 1')
+
+        start = multiprocessing.Event()
+        results = multiprocessing.Queue()
+        clients = [
+            multiprocessing.Process(
+                target=run_client,
+                args=(args.port, keys, start, args.duration, args.think, args.local, i, results),
+                daemon=True,
+            )
+            for i in range(args.clients)
+        ]
+        for client in clients:
+            client.start()
+        time.sleep(1)  # let every client connect
+        start.set()
+        latencies, errors = [], 0
+        for client in clients:
+            client_latencies, client_errors = results.get()
+            latencies.append(client_latencies)
+            errors += client_errors
+        for client in clients:
+            client.join()
+        loop_stats = exchange(sock, buffer, 'OVEN OV:LOOP')
+        sock.close()
+    finally:
+        server.terminate()
+
+    latencies = np.concatenate(latencies) * 1000
+    print('heaters={} clients={} duration={}s sample_time={}s supply_latency={}s think={}s local={} bank_min_zones={}'
+          .format(args.heaters, args.clients, args.duration, args.sample_time, args.supply_latency, args.think,
+                  args.local, args.bank_min_zones))
+    print()
+    print('commands       {}'.format(len(latencies)))
+    print('commands/s     {:.0f}'.format(len(latencies) / args.duration))
+    print('errors         {}'.format(errors))
+    if len(latencies):
+        for p in (50, 90, 99, 99.9):
+            print('latency p{:<5} {:.3f} ms'.format(p, np.percentile(latencies, p)))
+        print('latency max    {:.3f} ms'.format(latencies.max()))
+    print()
+    print('control loops under load (times in ms):')
+    for part in loop_stats.split(';'):
+        print('  ' + part.strip())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+import time
+
+import numpy as np
+import simple_pid
+
+from automation.pid_bank import PidBank
+
+#######################################################################################################################
+# Cost of a control step of many heater zones: one simple_pid.PID per zone called in a Python loop, against a single
+# PidBank.update() for all of them. Also checks that both give the same outputs while no output saturates.
+#######################################################################################################################
+
+N_STEPS = 2000
+ZONES = [1, 4, 16, 64, 256]
+GAINS = dict(Kp=0.4, Ki=0.015, Kd=0.005)
+
+
+def main():
+    rng = np.random.default_rng()
+    print('zones   simple_pid us/step   PidBank us/step')
+    for n in ZONES:
+        pids = [simple_pid.PID(**GAINS, setpoint=60, sample_time=None, output_limits=(-1e9, 1e9)) for i in range(n)]
+        bank = PidBank()
+        for i in range(n):
+            bank.add(kp=GAINS['Kp'], ki=GAINS['Ki'], kd=GAINS['Kd'], setpoint=60, sample_time=None,
+                     output_limits=(-1e9, 1e9))
+        temps = rng.uniform(20, 80, (N_STEPS, n))
+
+        t0 = time.perf_counter()
+        ref = [[pid(temp, dt=0.1) for pid, temp in zip(pids, row)] for row in temps]
+        t1 = time.perf_counter()
+        out = [bank.update(row, dt=0.1) for row in temps]
+        t2 = time.perf_counter()
+
+        assert np.allclose(ref, out), 'PidBank and simple_pid disagree'
+        print('{:<8}{:<21.1f}{:.1f}'.format(n, (t1 - t0) / N_STEPS * 1e6, (t2 - t1) / N_STEPS * 1e6))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+import time
+
+from automation.assemblies import HeaterAssembly
+from automation.daq_simulator import SimulatedDaq
+from automation.device_models import Spd3303x
+from automation.device_type import Heater
+from automation.pid_controller_server import process_command
+from automation.supply_simulator import SupplySimulator
+
+#######################################################################################################################
+# Micro-benchmark of process_command(): cost of parsing and dispatching a command, in microseconds per command.
+# Commands that only touch the PID or heater settings measure the dispatch alone. PS:VSET ? goes to the (simulated)
+# power supply through the network, for comparison.
+#######################################################################################################################
+
+N = 20000  # repetitions per command
+
+COMMANDS = [
+    'ASM1 PD:KPRO ?',
+    'ASM1 PD:KPRO 1.5',
+    'ASM1 PD:SETP ?',
+    'ASM1 HT:TMAX ?',
+    'ASM1 AM:MAXV',
+    'OVEN OV:KEYS',
+    'ASM1 PD:NOPE ?',
+    'ASM9 PD:KPRO ?',
+]
+
+
+def time_command(cmd, asm_dict, n):
+    t0 = time.perf_counter()
+    for i in range(n):
+        process_command(cmd, asm_dict)
+    return (time.perf_counter() - t0) / n
+
+
+def main():
+    sim = SupplySimulator('spd3303x').start()
+    ps = Spd3303x(*sim.address)
+    asm = HeaterAssembly((ps, 1), (SimulatedDaq(), 0), Heater(MAX_temp=150, MAX_volts=30, MAX_current=3))
+    asm_dict = {'ASM1': asm}
+
+    print('command                 us/command')
+    for cmd in COMMANDS:
+        print('{:<24}{:.2f}'.format(cmd, time_command(cmd, asm_dict, N) * 1e6))
+    print('{:<24}{:.2f}'.format('ASM1 PS:VSET ?', time_command('ASM1 PS:VSET ?', asm_dict, 200) * 1e6))
+
+    ps.disconnect()
+    sim.stop()
+
+
+if __name__ == '__main__':
+    main()